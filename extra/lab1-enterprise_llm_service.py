@@ -9,10 +9,12 @@ import logging
 import time
 import uuid
 from dataclasses import dataclass
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import yaml
 from pathlib import Path
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
 @dataclass
@@ -25,6 +27,20 @@ class LLMConfig:
     rate_limit_per_minute: int = 60
     log_level: str = "INFO"
 
+# Static prefix shared by every request. Keep it byte-identical between calls:
+# Ollama reuses the KV cache for a matching prompt prefix, so anything that
+# varies per request (tier, knowledge, the query itself) goes after it.
+SYSTEM_PROMPT = """You are TechCorp's customer service AI assistant. Provide helpful, professional responses.
+
+Guidelines:
+- Be professional, empathetic, and solution-focused
+- Provide specific steps when possible
+- If you cannot help, clearly state limitations
+- Never make promises about refunds or account changes without verification
+- Always prioritize customer satisfaction within company policies
+
+"""
+
 class CircuitBreaker:
     """Circuit breaker pattern for resilience"""
     
@@ -64,11 +80,54 @@ class EnterpriseLLMService:
     def __init__(self, config_path: str = "config/app_config.yaml"):
         self.config = self._load_config(config_path)
         self.setup_logging()
+        breaker_config = self.config.get('circuit_breaker', {})
         self.circuit_breaker = CircuitBreaker(
-            failure_threshold=self.config.get('circuit_breaker', {}).get('failure_threshold', 5),
-            recovery_timeout=self.config.get('circuit_breaker', {}).get('recovery_timeout', 60)
+            failure_threshold=breaker_config.get('failure_threshold', 5),
+            recovery_timeout=breaker_config.get('recovery_timeout', 60)
+        )
+        # The small routed model trips its own breaker, so its failures never
+        # block the large-model fallback (which uses the main breaker above)
+        self.small_circuit_breaker = CircuitBreaker(
+            failure_threshold=breaker_config.get('failure_threshold', 5),
+            recovery_timeout=breaker_config.get('recovery_timeout', 60)
         )
         self.usage_stats = {"total_requests": 0, "total_tokens": 0, "total_cost": 0.0}
+        
+        # Session-scoped Ollama context: turn N continues from the token state
+        # returned by turn N-1 instead of re-sending the whole conversation
+        llm_config = self._llm_config()
+        session_config = llm_config.get('sessions', {})
+        self.system_prompt = llm_config.get('system_prompt', SYSTEM_PROMPT)
+        self.keep_alive = llm_config.get('keep_alive', '30m')
+        self.max_sessions = session_config.get('max_sessions', 256)
+        self.session_ttl = session_config.get('ttl_seconds', 1800)
+        self.max_session_context = session_config.get('max_context_tokens', 4096)
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._session_lock = threading.Lock()
+        
+        # Warm-up and readiness: not ready until every backend has loaded
+        # its model and evaluated the static prompt prefix once
+        warmup_config = llm_config.get('warmup', {})
+        self.warmup_query = warmup_config.get('query', 'Hello')
+        self.warmup_timeout = warmup_config.get('timeout', 120)
+        self.keep_warm_interval = warmup_config.get('keep_warm_interval', 240)
+        self.warmup_status: Dict[str, Dict[str, Any]] = {}
+        self.ready = threading.Event()
+        self._last_used: Dict[str, float] = {}
+        self._warm_thread: Optional[threading.Thread] = None
+        self._warm_stop = threading.Event()
+        
+        # Small/large model routing by query complexity
+        routing_config = llm_config.get('routing', {})
+        self.routing_enabled = routing_config.get('enabled', False)
+        self.complexity_threshold = routing_config.get('complexity_threshold', 0.5)
+        self.self_check_config = routing_config.get('self_check', {"enabled": True})
+        self.escalation_signals = [
+            signal.lower() for signal in
+            self.config.get('business_rules', {}).get('agent', {}).get('escalation_triggers', [])
+        ]
+        self.model_stats: Dict[str, Dict[str, Any]] = {}
+        
         self.logger.info("Enterprise LLM Service initialized", extra={"service": "llm"})
     
     def _load_config(self, config_path: str) -> Dict[str, Any]:
@@ -84,6 +143,10 @@ class EnterpriseLLMService:
                 "business": {"cost_per_1k_tokens": 0.002}
             }
     
+    def _llm_config(self) -> Dict[str, Any]:
+        """LLM settings live under 'llm' (fallback config) or 'llm_service' (app_config.yaml)"""
+        return self.config.get('llm') or self.config.get('llm_service', {})
+    
     def setup_logging(self):
         """Setup structured logging with correlation IDs"""
         log_level = self.config.get('logging', {}).get('level', 'INFO')
@@ -110,20 +173,36 @@ class EnterpriseLLMService:
         self.logger.addHandler(console_handler)
         self.logger.addHandler(file_handler)
     
-    def call_llm(self, prompt: str, correlation_id: Optional[str] = None) -> Dict[str, Any]:
+    def call_llm(self, prompt: str, correlation_id: Optional[str] = None,
+                 session_id: Optional[str] = None,
+                 options: Optional[Dict[str, Any]] = None,
+                 routing_hints: Optional[Dict[str, Any]] = None,
+                 prompt_is_complete: bool = False) -> Dict[str, Any]:
         """
         Call LLM with enterprise patterns:
         - Input validation
         - Request correlation
         - Error handling
         - Usage tracking
+        - Session context reuse (when session_id is given)
+        - Small/large model routing (when llm_service.routing is enabled)
+        
+        ``options`` overrides Ollama generation options for this call, e.g. a
+        shorter num_predict when the caller is short on latency budget.
+        ``routing_hints`` may carry "category", "retrieved_chunks" and
+        "escalation_signals" to sharpen the complexity score, and "query"
+        (the customer's own words) when ``prompt`` is a complete prompt.
+        ``prompt_is_complete`` sends ``prompt`` as given, for callers that add
+        their own context; it must open with ``system_prompt`` to share the
+        cached prefix, and never continues a session.
         """
         if not correlation_id:
             correlation_id = str(uuid.uuid4())
         
         self.logger.info(f"LLM request initiated", extra={
             "correlation_id": correlation_id,
-            "prompt_length": len(prompt)
+            "prompt_length": len(prompt),
+            "session_id": session_id
         })
         
         # Validate input
@@ -132,19 +211,56 @@ class EnterpriseLLMService:
             self.logger.error(error_msg, extra={"correlation_id": correlation_id})
             return {"error": error_msg, "correlation_id": correlation_id}
         
+        tier, complexity = self.select_model((routing_hints or {}).get("query", prompt), routing_hints)
+        if prompt_is_complete:
+            session_id = None
+        
         try:
-            # Use circuit breaker for resilience
-            response = self.circuit_breaker.call(self._make_llm_request, prompt)
+            try:
+                response, request_prompt, session_reused = self._generate(
+                    tier, prompt, session_id, options, prompt_is_complete
+                )
+            except Exception as e:
+                if tier != "small":
+                    raise
+                # A missing or failing small model must not fail the request
+                self.logger.warning(f"Small model failed ({e}), retrying on the large model", extra={
+                    "correlation_id": correlation_id
+                })
+                self._model_stats(self._model_spec("small")["model"])["errors"] += 1
+                tier = "large"
+                response, request_prompt, session_reused = self._generate(
+                    tier, prompt, session_id, options, prompt_is_complete
+                )
+            
+            # Cheap answers from the small model get a quick self-check before they ship
+            self_check_escalated = False
+            if tier == "small" and not self._passes_self_check(prompt, response.get('response', '')):
+                self.logger.info("Small model answer failed self-check, escalating", extra={
+                    "correlation_id": correlation_id
+                })
+                self._model_stats(self._model_spec("small")["model"])["self_check_failures"] += 1
+                tier = "large"
+                self_check_escalated = True
+                response, request_prompt, session_reused = self._generate(
+                    tier, prompt, session_id, options, prompt_is_complete
+                )
+            
+            if session_id:
+                self._update_session(session_id, response.get('context'), self._model_spec(tier)["model"])
             
             # Track usage for cost management
-            tokens_used = len(prompt.split()) + len(response.get('response', '').split())
+            tokens_used = len(request_prompt.split()) + len(response.get('response', '').split())
             cost = self._calculate_cost(tokens_used)
             self.track_usage(tokens_used, cost)
             
             self.logger.info("LLM request completed successfully", extra={
                 "correlation_id": correlation_id,
                 "tokens_used": tokens_used,
-                "cost": cost
+                "cost": cost,
+                "model": response.get('model'),
+                "complexity": complexity,
+                "prompt_eval_count": response.get('prompt_eval_count')
             })
             
             return {
@@ -152,6 +268,10 @@ class EnterpriseLLMService:
                 "correlation_id": correlation_id,
                 "tokens_used": tokens_used,
                 "cost": cost,
+                "model": self._model_spec(tier)["model"],
+                "complexity": complexity,
+                "self_check_escalated": self_check_escalated,
+                "session_reused": session_reused,
                 "circuit_breaker_state": self.circuit_breaker.state
             }
             
@@ -166,29 +286,252 @@ class EnterpriseLLMService:
                 "circuit_breaker_state": self.circuit_breaker.state
             }
     
-    def _make_llm_request(self, prompt: str) -> Dict[str, Any]:
-        """Make the actual LLM API request"""
-        llm_config = self.config.get('llm', {})
-        url = f"{llm_config.get('base_url', 'http://localhost:11434')}/api/generate"
+    def _generate(self, tier: str, query: str, session_id: Optional[str],
+                  options: Optional[Dict[str, Any]], prompt_is_complete: bool = False) -> tuple:
+        """
+        One model call with session reuse and per-model metrics
+        
+        Returns (response, prompt, session_reused). The session itself is
+        only updated by the caller once an answer is accepted.
+        """
+        spec = self._model_spec(tier)
         
+        # Ollama context tokens belong to one model, so only reuse them on the same model
+        session_context = self._session_context(session_id, spec["model"])
+        request_prompt = query if prompt_is_complete else self.build_prompt(query, continuing=bool(session_context))
+        
+        start_time = time.time()
+        breaker = self.small_circuit_breaker if tier == "small" else self.circuit_breaker
+        response = breaker.call(
+            self._make_llm_request, request_prompt, session_context, options, spec
+        )
+        self._record_model_call(spec["model"], time.time() - start_time, request_prompt, response)
+        return response, request_prompt, bool(session_context)
+    
+    def _model_spec(self, tier: str) -> Dict[str, str]:
+        """Model and base URL for a routing tier; the primary model when routing is off"""
+        llm_config = self._llm_config()
+        primary = {
+            "base_url": llm_config.get('base_url', 'http://localhost:11434'),
+            "model": llm_config.get('model', 'llama3.2:3b')
+        }
+        if not self.routing_enabled:
+            return primary
+        spec = llm_config.get('routing', {}).get(tier) or {}
+        return {
+            "base_url": spec.get('base_url', primary['base_url']),
+            "model": spec.get('model', primary['model'])
+        }
+    
+    def score_complexity(self, query: str, hints: Optional[Dict[str, Any]] = None) -> float:
+        """
+        Cheap 0-1 complexity score from length, category, retrieved chunks and
+        escalation signals; no model call involved
+        """
+        hints = hints or {}
+        query_lower = query.lower()
+        
+        length = min(len(query.split()) / 80, 1.0)
+        category_weight = {
+            "technical": 1.0, "billing": 0.6, "general": 0.4, "account": 0.2
+        }.get(hints.get("category"), 0.4)
+        chunks = min(hints.get("retrieved_chunks", 0) / 5, 1.0)
+        signals = hints.get("escalation_signals", 0) + sum(
+            1 for signal in self.escalation_signals if signal in query_lower
+        )
+        questions = min(query.count("?") / 3, 1.0)
+        
+        return round(
+            0.35 * length
+            + 0.2 * category_weight
+            + 0.15 * chunks
+            + 0.2 * min(signals / 2, 1.0)
+            + 0.1 * questions,
+            3
+        )
+    
+    def select_model(self, query: str, hints: Optional[Dict[str, Any]] = None) -> tuple:
+        """Routing tier ('small' or 'large') and the complexity score behind it"""
+        if not self.routing_enabled:
+            return "primary", None
+        complexity = self.score_complexity(query, hints)
+        return ("large" if complexity >= self.complexity_threshold else "small"), complexity
+    
+    def _passes_self_check(self, query: str, answer: str) -> bool:
+        """Quick heuristics that catch empty, evasive or looping small-model answers"""
+        if not self.self_check_config.get('enabled', True):
+            return True
+        
+        words = answer.split()
+        if len(words) < self.self_check_config.get('min_words', 8):
+            return False
+        
+        answer_lower = answer.lower()
+        for phrase in self.self_check_config.get('reject_phrases', [
+            "i'm not sure", "i am not sure", "i don't know", "i do not know",
+            "as an ai", "i cannot help", "i can't help"
+        ]):
+            if phrase in answer_lower:
+                return False
+        
+        # Heavy repetition usually means the model is looping
+        if len(set(words)) / len(words) < self.self_check_config.get('min_unique_ratio', 0.3):
+            return False
+        
+        return True
+    
+    def _model_stats(self, model: str) -> Dict[str, Any]:
+        return self.model_stats.setdefault(model, {
+            "requests": 0,
+            "errors": 0,
+            "self_check_failures": 0,
+            "total_latency": 0.0,
+            "average_latency": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "tokens_per_second": 0.0,
+            "share": 0.0
+        })
+    
+    def _record_model_call(self, model: str, latency: float, prompt: str, response: Dict[str, Any]):
+        stats = self._model_stats(model)
+        stats["requests"] += 1
+        stats["total_latency"] += latency
+        stats["average_latency"] = stats["total_latency"] / stats["requests"]
+        stats["prompt_tokens"] += response.get('prompt_eval_count') or len(prompt.split())
+        stats["completion_tokens"] += response.get('eval_count') or len(response.get('response', '').split())
+        stats["tokens_per_second"] = stats["completion_tokens"] / max(stats["total_latency"], 1e-9)
+        
+        total = sum(s["requests"] for s in self.model_stats.values())
+        for other in self.model_stats.values():
+            other["share"] = other["requests"] / total
+    
+    def build_prompt(self, query: str, continuing: bool = False) -> str:
+        """
+        Static system prompt first, variable turn last
+        
+        A continuing session already holds the system prompt in its Ollama
+        context, so only the new turn is sent.
+        """
+        turn = f"Customer Query: {query}\n\nResponse:"
+        return turn if continuing else f"{self.system_prompt}{turn}"
+    
+    def _build_payload(self, prompt: str, context: Optional[List[int]] = None,
+                       stream: bool = False, options: Optional[Dict[str, Any]] = None,
+                       model: Optional[str] = None) -> Dict[str, Any]:
+        llm_config = self._llm_config()
+        performance = llm_config.get('performance', {})
         payload = {
-            "model": llm_config.get('model', 'llama3.2:3b'),
+            "model": model or llm_config.get('model', 'llama3.2:3b'),
             "prompt": prompt,
-            "stream": False,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
             "options": {
                 "temperature": 0.7,
-                "num_predict": 150
+                "num_ctx": performance.get('num_ctx', 2048),
+                "num_predict": performance.get('num_predict', 150),
+                **(options or {})
             }
         }
+        if context:
+            payload["context"] = context
+        return payload
+    
+    def _make_llm_request(self, prompt: str, context: Optional[List[int]] = None,
+                          options: Optional[Dict[str, Any]] = None,
+                          spec: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Make the actual LLM API request"""
+        llm_config = self._llm_config()
+        spec = spec or self._model_spec("primary")
+        base_url = spec['base_url']
+        url = f"{base_url}/api/generate"
         
+        payload = self._build_payload(prompt, context, options=options, model=spec['model'])
         response = requests.post(
             url, 
             json=payload, 
             timeout=llm_config.get('timeout', 30)
         )
         response.raise_for_status()
+        self._last_used[f"{base_url}/{payload['model']}"] = time.time()
         return response.json()
     
+    def _stream_llm_request(self, prompt: str, context: Optional[List[int]] = None) -> Dict[str, Any]:
+        """Streaming request that records time-to-first-token alongside the final chunk"""
+        llm_config = self._llm_config()
+        url = f"{llm_config.get('base_url', 'http://localhost:11434')}/api/generate"
+        
+        start_time = time.perf_counter()
+        first_token_time = None
+        text = []
+        final = {}
+        with requests.post(url, json=self._build_payload(prompt, context, stream=True),
+                           timeout=llm_config.get('timeout', 30), stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('response'):
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    text.append(chunk['response'])
+                if chunk.get('done'):
+                    final = chunk
+                    break
+        end_time = time.perf_counter()
+        
+        return {
+            **final,
+            "response": "".join(text),
+            "ttft": (first_token_time or end_time) - start_time,
+            "total_time": end_time - start_time
+        }
+    
+    def _session_context(self, session_id: Optional[str], model: Optional[str] = None) -> Optional[List[int]]:
+        """Context tokens from the previous turn on the same model, or None for a fresh start"""
+        if not session_id:
+            return None
+        with self._session_lock:
+            self._expire_sessions()
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            session["last_used"] = time.time()
+            self.sessions.move_to_end(session_id)
+            if model and session.get("model") != model:
+                return None
+            return session["context"]
+    
+    def _update_session(self, session_id: str, context: Optional[List[int]], model: Optional[str] = None):
+        """Store the returned context, restarting sessions that outgrow the window"""
+        with self._session_lock:
+            session = self.sessions.setdefault(session_id, {"context": None, "turns": 0})
+            session["turns"] += 1
+            session["model"] = model
+            session["last_used"] = time.time()
+            if context and len(context) <= self.max_session_context:
+                session["context"] = context
+            else:
+                # Next turn starts again from the static prefix
+                session["context"] = None
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+    
+    def _expire_sessions(self):
+        cutoff = time.time() - self.session_ttl
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.get("last_used", 0) >= cutoff:
+                break
+            del self.sessions[session_id]
+    
+    def end_session(self, session_id: str):
+        """Forget a conversation's context"""
+        with self._session_lock:
+            self.sessions.pop(session_id, None)
+    
     def validate_input(self, prompt: str) -> bool:
         """Validate and sanitize input"""
         security_config = self.config.get('security', {})
@@ -226,20 +569,210 @@ class EnterpriseLLMService:
         cost_per_1k = self.config.get('business', {}).get('cost_per_1k_tokens', 0.002)
         return (tokens_used / 1000) * cost_per_1k
     
+    def _backends(self) -> List[Dict[str, str]]:
+        """Primary model, routed models and any extra entries under 'backends' (same keys as the primary)"""
+        llm_config = self._llm_config()
+        primary = {
+            "base_url": llm_config.get('base_url', 'http://localhost:11434'),
+            "model": llm_config.get('model', 'llama3.2:3b')
+        }
+        backends = [primary]
+        extra = list(llm_config.get('backends', []))
+        if self.routing_enabled:
+            extra += [self._model_spec("small"), self._model_spec("large")]
+        for backend in extra:
+            spec = {
+                "base_url": backend.get('base_url', primary['base_url']),
+                "model": backend.get('model', primary['model'])
+            }
+            if spec not in backends:
+                backends.append(spec)
+        return backends
+    
+    def warm_up(self) -> bool:
+        """
+        Prime every backend before reporting ready
+        
+        Each backend gets a one-token generation over the static system
+        prompt, which loads the model and leaves the tokenized prefix in the
+        server's KV cache for the first real customer. The payload carries the
+        same options as real requests: Ollama reloads a model whose num_ctx
+        changes, so a bare warm-up would not spare the first call its load.
+        """
+        all_warm = True
+        prompt = self.build_prompt(self.warmup_query)
+        
+        for backend in self._backends():
+            key = f"{backend['base_url']}/{backend['model']}"
+            start_time = time.time()
+            try:
+                response = requests.post(
+                    f"{backend['base_url']}/api/generate",
+                    json=self._build_payload(prompt, options={"num_predict": 1}, model=backend['model']),
+                    timeout=self.warmup_timeout
+                )
+                response.raise_for_status()
+                result = response.json()
+                self._last_used[key] = time.time()
+                self.warmup_status[key] = {
+                    "status": "warm",
+                    "duration": time.time() - start_time,
+                    "load_duration": result.get('load_duration', 0) / 1e9,
+                    "prefix_tokens": result.get('prompt_eval_count'),
+                    "timestamp": datetime.now().isoformat()
+                }
+                self.logger.info(f"Backend warmed up: {key}", extra=self.warmup_status[key])
+            except Exception as e:
+                # The small routed model is optional: its calls fall back to the large one
+                all_warm = all_warm and self._is_optional_backend(backend)
+                self.warmup_status[key] = {
+                    "status": "failed",
+                    "error": str(e),
+                    "timestamp": datetime.now().isoformat()
+                }
+                self.logger.warning(f"Warm-up failed for {key}: {e}")
+        
+        if all_warm:
+            self.ready.set()
+        return all_warm
+    
+    def _is_optional_backend(self, backend: Dict[str, str]) -> bool:
+        return (self.routing_enabled
+                and backend == self._model_spec("small")
+                and backend not in (self._model_spec("large"), self._model_spec("primary")))
+    
+    def keep_warm(self):
+        """Touch backends that have been idle long enough to risk an unload"""
+        now = time.time()
+        for backend in self._backends():
+            key = f"{backend['base_url']}/{backend['model']}"
+            if now - self._last_used.get(key, 0) < self.keep_warm_interval:
+                continue
+            try:
+                # An empty prompt just loads the model and resets keep_alive; the
+                # real requests' options keep it loaded with their num_ctx
+                response = requests.post(
+                    f"{backend['base_url']}/api/generate",
+                    json=self._build_payload("", options={"num_predict": 1}, model=backend['model']),
+                    timeout=self.warmup_timeout
+                )
+                response.raise_for_status()
+                self._last_used[key] = time.time()
+            except Exception as e:
+                self.logger.warning(f"Keep-warm ping failed for {key}: {e}")
+    
+    def start_warmup(self):
+        """Warm up in the background, then keep the models loaded"""
+        if self._warm_thread and self._warm_thread.is_alive():
+            return
+        self._warm_stop.clear()
+        self._warm_thread = threading.Thread(target=self._warm_loop, daemon=True)
+        self._warm_thread.start()
+    
+    def stop_warmup(self):
+        self._warm_stop.set()
+    
+    def _warm_loop(self):
+        while not self._warm_stop.is_set():
+            if not self.ready.is_set():
+                # Retry until every backend answers; stay not-ready meanwhile
+                self.warm_up()
+            else:
+                self.keep_warm()
+            self._warm_stop.wait(self.keep_warm_interval if self.ready.is_set()
+                                 else min(5, self.keep_warm_interval))
+    
+    def is_ready(self) -> bool:
+        return self.ready.is_set()
+    
     def get_health_status(self) -> Dict[str, Any]:
         """Return service health status"""
         return {
             "status": "healthy" if self.circuit_breaker.state != "OPEN" else "degraded",
             "circuit_breaker_state": self.circuit_breaker.state,
+            "small_model_circuit_breaker_state": self.small_circuit_breaker.state,
             "total_requests": self.usage_stats["total_requests"],
-            "total_cost": self.usage_stats["total_cost"]
+            "total_cost": self.usage_stats["total_cost"],
+            "active_sessions": len(self.sessions),
+            "keep_alive": self.keep_alive,
+            "ready": self.is_ready(),
+            "warmup": self.warmup_status,
+            "models": self.model_stats
+        }
+
+BENCHMARK_CONVERSATION = [
+    "I can't log into my account after the latest update.",
+    "I already tried resetting my password, what else can I do?",
+    "The error says my session expired. Does that mean anything?",
+    "Is there a way to stay signed in on my work laptop?",
+    "Thanks. Will this affect my billing in any way?"
+]
+
+def benchmark_ttft(service: EnterpriseLLMService, rounds: int = 3,
+                   conversation: List[str] = BENCHMARK_CONVERSATION) -> Dict[str, Any]:
+    """
+    Time-to-first-token per conversation turn, with and without session reuse
+    
+    "stateless" re-sends the static prefix plus the transcript so far on every
+    turn (what a client without server context has to do); "session" sends
+    only the new turn and the context Ollama returned for the previous one.
+    """
+    modes = {"stateless": [[] for _ in conversation], "session": [[] for _ in conversation]}
+    prompt_tokens = {"stateless": [[] for _ in conversation], "session": [[] for _ in conversation]}
+    
+    for round_number in range(rounds):
+        # Stateless: growing transcript behind the byte-identical prefix
+        transcript = ""
+        for turn, query in enumerate(conversation):
+            result = service._stream_llm_request(service.build_prompt(transcript + query))
+            transcript += f"{query}\nAssistant: {result['response'].strip()}\nCustomer: "
+            modes["stateless"][turn].append(result["ttft"])
+            prompt_tokens["stateless"][turn].append(result.get("prompt_eval_count", 0))
+        
+        # Session: prefix once, then the returned context carries the conversation
+        context = None
+        for turn, query in enumerate(conversation):
+            result = service._stream_llm_request(service.build_prompt(query, continuing=bool(context)), context)
+            context = result.get("context")
+            modes["session"][turn].append(result["ttft"])
+            prompt_tokens["session"][turn].append(result.get("prompt_eval_count", 0))
+    
+    def mean(values):
+        return sum(values) / max(len(values), 1)
+    
+    return {
+        "model": service._llm_config().get('model', 'llama3.2:3b'),
+        "keep_alive": service.keep_alive,
+        "rounds": rounds,
+        "turns": len(conversation),
+        "timestamp": datetime.now().isoformat(),
+        "results": {
+            mode: [
+                {
+                    "turn": turn + 1,
+                    "ttft_ms": mean(samples) * 1000,
+                    "prompt_eval_tokens": mean(prompt_tokens[mode][turn])
+                }
+                for turn, samples in enumerate(per_turn)
+            ]
+            for mode, per_turn in modes.items()
         }
+    }
 
 def main():
     """Main function demonstrating enterprise LLM service"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="TechCorp Enterprise LLM Service")
+    parser.add_argument("--benchmark-ttft", action="store_true",
+                        help="Measure time-to-first-token for turn 1 vs turn N and exit")
+    parser.add_argument("--rounds", type=int, default=3, help="Conversations per benchmark mode")
+    parser.add_argument("--output", default="metrics/ttft_benchmark.json", help="Benchmark results file")
+    args = parser.parse_args()
+    
     print("=== TechCorp Customer Support AI - LLM Service ===")
     print("Enterprise patterns: logging, monitoring, resilience")
-    print("Type 'quit' to exit, 'health' for status, 'stats' for usage\n")
+    print("Type 'quit' to exit, 'health' for status, 'stats' for usage, 'reset' for a new conversation\n")
     
     # Initialize enterprise service
     try:
@@ -249,6 +782,29 @@ def main():
         print(f"❌ Failed to initialize service: {e}")
         return
     
+    print("🔥 Warming up model backends...")
+    if service.warm_up():
+        print("✅ Backends warm, service ready")
+    else:
+        print("⚠️  Warm-up incomplete, first requests may be slow")
+    service.start_warmup()
+    
+    if args.benchmark_ttft:
+        print(f"⏱️  Benchmarking time-to-first-token over {args.rounds} conversations...")
+        report = benchmark_ttft(service, args.rounds)
+        for mode, turns in report["results"].items():
+            print(f"\n{mode}:")
+            for turn in turns:
+                print(f"   turn {turn['turn']}: TTFT {turn['ttft_ms']:.0f}ms, "
+                      f"prompt eval {turn['prompt_eval_tokens']:.0f} tokens")
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📊 Results written to {args.output}")
+        return
+    
+    session_id = str(uuid.uuid4())
+    
     # Interactive demonstration
     while True:
         user_input = input("\nCustomer Query: ").strip()
@@ -264,9 +820,18 @@ def main():
             print(json.dumps(service.get_health_status(), indent=2))
             continue
             
+        if user_input.lower() == 'reset':
+            service.end_session(session_id)
+            session_id = str(uuid.uuid4())
+            print("🔄 Started a new conversation")
+            continue
+            
         if user_input.lower() == 'stats':
             print("\n📈 Usage Statistics:")
             print(json.dumps(service.usage_stats, indent=2))
+            if service.model_stats:
+                print("\n🧭 Per-model Statistics:")
+                print(json.dumps(service.model_stats, indent=2))
             continue
             
         if not user_input:
@@ -277,7 +842,7 @@ def main():
         print(f"🔄 Processing query (ID: {correlation_id})...")
         
         start_time = time.time()
-        result = service.call_llm(user_input, correlation_id)
+        result = service.call_llm(user_input, correlation_id, session_id=session_id)
         end_time = time.time()
         
         if 'error' in result:
@@ -288,6 +853,9 @@ def main():
             print(f"📊 Tokens: {result['tokens_used']}, Cost: ${result['cost']:.4f}")
             print(f"⏱️  Response time: {end_time - start_time:.2f}s")
             print(f"🔧 Circuit Breaker: {result['circuit_breaker_state']}")
+            if result.get('complexity') is not None:
+                escalated = " (escalated after self-check)" if result['self_check_escalated'] else ""
+                print(f"🧭 Model: {result['model']}, complexity {result['complexity']:.2f}{escalated}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
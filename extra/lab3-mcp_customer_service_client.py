@@ -4,13 +4,22 @@
 # Complete implementation with enterprise patterns
 
 import asyncio
+import bisect
+import hashlib
+import itertools
 import json
 import logging
+import math
+import os
+import random
 import time
 import uuid
+from collections import OrderedDict
+from datetime import datetime
 from typing import Dict, Any, List, Optional
 from dataclasses import dataclass
 import httpx
+import yaml
 from pathlib import Path
 
 @dataclass
@@ -20,24 +29,214 @@ class ClientConfig:
     max_retries: int = 3
     timeout: int = 30
     correlation_id: Optional[str] = None
+    config_path: str = "config/mcp_client_config.yaml"
+
+@dataclass
+class EndpointState:
+    """Health and latency of one MCP server endpoint, kept in memory by the health checker"""
+    url: str
+    health_url: str
+    weight: int = 1
+    healthy: bool = True  # Optimistic until the first probe says otherwise
+    latency_ewma: Optional[float] = None
+    consecutive_failures: int = 0
+    last_checked: Optional[float] = None
+    in_flight: int = 0
+    capacity: Optional[int] = None  # Hints the server publishes with its registry heartbeat
+    reported_load: Optional[int] = None
+
+class ConsistentHashRing:
+    """
+    Consistent hash ring over endpoint URLs with virtual nodes
+    
+    Each endpoint owns ``virtual_nodes`` points on the ring, so adding or
+    removing one replica only remaps about 1/N of the keys. Lookups walk
+    clockwise from the key's hash; with a load cap, saturated endpoints are
+    skipped (consistent hashing with bounded loads).
+    """
+    
+    def __init__(self, urls: List[str], virtual_nodes: int = 160):
+        self.urls = tuple(urls)
+        self.virtual_nodes = virtual_nodes
+        points = sorted(
+            (self._hash(f"{url}#{replica}"), url)
+            for url in self.urls
+            for replica in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [url for _, url in points]
+    
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+    
+    def lookup(self, key: str, accept=None) -> Optional[str]:
+        """Owner of ``key``, or the next owner clockwise that ``accept`` allows"""
+        if not self._hashes:
+            return None
+        start = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        seen = set()
+        for offset in range(len(self._hashes)):
+            url = self._owners[(start + offset) % len(self._hashes)]
+            if url in seen:
+                continue
+            if accept is None or accept(url):
+                return url
+            seen.add(url)
+            if len(seen) == len(self.urls):
+                break
+        return None
+
+class LoadBalancer:
+    """
+    Client-side load balancing across healthy MCP replicas
+    
+    Strategies (load_balancing.algorithm in mcp_client_config.yaml):
+    - round_robin: each healthy endpoint in turn
+    - weighted: smooth weighted round robin on static_endpoints weights
+    - least_connections: fewest calls in flight from this client
+    - p2c_ewma: power of two random choices, scored by latency EWMA
+      times (in-flight + 1)
+    
+    With affinity enabled, calls that carry a routing key (customer_id or
+    session_id) go to that key's replica on a consistent hash ring so
+    per-process caches keep hitting; a replica already above
+    ``load_factor`` times the mean in-flight count spills the call to the
+    next replica on the ring. Calls without a key use the algorithm above.
+    """
+    
+    STRATEGIES = ("round_robin", "weighted", "least_connections", "p2c_ewma")
+    
+    def __init__(self,
+                 algorithm: str = "round_robin",
+                 affinity: bool = False,
+                 virtual_nodes: int = 160,
+                 load_factor: float = 1.25):
+        if algorithm not in self.STRATEGIES:
+            raise ValueError(f"Unknown load balancing algorithm: {algorithm} (expected one of {self.STRATEGIES})")
+        if load_factor < 1.0:
+            raise ValueError("load_factor must be at least 1.0")
+        self.algorithm = algorithm
+        self._select = getattr(self, f"_{algorithm}")
+        self._counter = itertools.count()
+        self._current_weights: Dict[str, float] = {}
+        self.selections: Dict[str, int] = {}
+        
+        self.affinity = affinity
+        self.virtual_nodes = virtual_nodes
+        self.load_factor = load_factor
+        self._ring: Optional[ConsistentHashRing] = None
+        self.affinity_stats = {"routed": 0, "spilled": 0}
+    
+    def select(self, healthy: List[EndpointState], routing_key: Optional[str] = None) -> EndpointState:
+        if len(healthy) == 1:
+            state = healthy[0]
+        elif self.affinity and routing_key:
+            state = self._consistent_hash(healthy, routing_key)
+        else:
+            state = self._select(healthy)
+        self.selections[state.url] = self.selections.get(state.url, 0) + 1
+        return state
+    
+    def _consistent_hash(self, healthy: List[EndpointState], routing_key: str) -> EndpointState:
+        urls = tuple(sorted(state.url for state in healthy))
+        if self._ring is None or self._ring.urls != urls:
+            # Rebuilt only when the healthy set changes
+            self._ring = ConsistentHashRing(urls, self.virtual_nodes)
+        
+        by_url = {state.url: state for state in healthy}
+        capacity = math.ceil(self.load_factor * (sum(state.in_flight for state in healthy) + 1) / len(healthy))
+        owner = self._ring.lookup(routing_key)
+        url = self._ring.lookup(routing_key, lambda candidate: by_url[candidate].in_flight < capacity)
+        
+        self.affinity_stats["routed"] += 1
+        if url != owner:
+            self.affinity_stats["spilled"] += 1
+        return by_url[url or owner]
+    
+    def _round_robin(self, healthy: List[EndpointState]) -> EndpointState:
+        return healthy[next(self._counter) % len(healthy)]
+    
+    def _weighted(self, healthy: List[EndpointState]) -> EndpointState:
+        # nginx-style smooth weighted round robin: no bursts to the heaviest endpoint
+        total = 0
+        best = None
+        for state in healthy:
+            weight = max(state.weight, 0)
+            total += weight
+            current = self._current_weights.get(state.url, 0) + weight
+            self._current_weights[state.url] = current
+            if best is None or current > self._current_weights[best.url]:
+                best = state
+        self._current_weights[best.url] -= total
+        return best
+    
+    def _least_connections(self, healthy: List[EndpointState]) -> EndpointState:
+        # Ties rotate so idle replicas share the load
+        offset = next(self._counter) % len(healthy)
+        rotated = healthy[offset:] + healthy[:offset]
+        return min(rotated, key=lambda state: state.in_flight / max(state.weight, 1))
+    
+    def _p2c_ewma(self, healthy: List[EndpointState]) -> EndpointState:
+        first, second = random.sample(healthy, 2)
+        
+        def cost(state: EndpointState) -> float:
+            # Unmeasured endpoints look free so they get tried
+            return (state.latency_ewma or 0.0) * (state.in_flight + 1)
+        
+        return first if cost(first) <= cost(second) else second
 
 class ServiceDiscovery:
-    """Service discovery client for finding available MCP services"""
+    """
+    Service discovery client for finding available MCP services
+    
+    A background asyncio task reads the registry and probes every endpoint's
+    health URL on ``health_check_interval``; requests only ever read the
+    resulting in-memory table, so endpoint selection never touches the disk
+    or the network.
     
-    def __init__(self, registry_path: str = "mcp_services/service_registry.json"):
+    A second task watches the heartbeat registry that server instances write
+    (``active_services.json``): it only stats the file, re-reads it when it
+    changes or when the next entry's TTL runs out, and probes new instances
+    straight away, so a freshly started replica takes traffic within about
+    ``watch_interval`` plus one probe.
+    """
+    
+    def __init__(self,
+                 registry_path: str = "mcp_services/service_registry.json",
+                 health_check_interval: float = 10.0,
+                 health_timeout: float = 5.0,
+                 static_endpoints: Optional[List[Dict[str, Any]]] = None,
+                 latency_alpha: float = 0.3,
+                 load_balancer: Optional[LoadBalancer] = None,
+                 active_services_path: str = "mcp_services/active_services.json",
+                 watch_interval: float = 0.5):
         self.registry_path = registry_path
-        self.active_services_path = "mcp_services/active_services.json"
+        self.active_services_path = active_services_path
+        self.watch_interval = watch_interval
+        self.health_check_interval = health_check_interval
+        self.health_timeout = health_timeout
+        self.static_endpoints = static_endpoints or []
+        self.latency_alpha = latency_alpha
+        self.load_balancer = load_balancer or LoadBalancer()
+        self.default_url = "http://localhost:8000"
         self.logger = logging.getLogger("service_discovery")
         
+        # service_type -> url -> state, plus the healthy subset for O(1) selection
+        self.endpoints: Dict[str, Dict[str, EndpointState]] = {}
+        self._healthy: Dict[str, List[EndpointState]] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._registry_mtime: Optional[int] = None
+        self._next_expiry = float("inf")
+        
     def discover_services(self, service_type: str) -> List[Dict[str, Any]]:
         """Discover available services of the specified type"""
         try:
-            # First try to load from active services (runtime registration)
-            if Path(self.active_services_path).exists():
-                with open(self.active_services_path, 'r') as f:
-                    active_data = json.load(f)
-                    if "services" in active_data:
-                        return active_data["services"]
+            # First try live entries from the heartbeat registry (runtime registration)
+            live = self._live_registry_entries(service_type)
+            if live:
+                return live
             
             # Fallback to static registry
             if Path(self.registry_path).exists():
@@ -49,6 +248,10 @@ class ServiceDiscovery:
                         service_config = services[service_type]
                         return service_config.get("endpoints", [])
             
+            # Finally the static endpoints from mcp_client_config.yaml
+            if self.static_endpoints:
+                return self.static_endpoints
+            
             self.logger.warning(f"No services found for type: {service_type}")
             return []
             
@@ -56,30 +259,296 @@ class ServiceDiscovery:
             self.logger.error(f"Service discovery failed: {e}")
             return []
     
-    def get_healthy_endpoint(self, service_type: str) -> Optional[str]:
-        """Get a healthy endpoint for the service type"""
-        services = self.discover_services(service_type)
+    def _live_registry_entries(self, service_type: str) -> List[Dict[str, Any]]:
+        """Registry entries whose heartbeat is within their TTL"""
+        try:
+            with open(self.active_services_path, 'r') as f:
+                services = json.load(f).get("services", [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
         
+        now = time.time()
+        live = []
+        next_expiry = float("inf")
         for service in services:
-            # Try to connect to health check endpoint
-            try:
-                health_url = f"http://{service.get('host', 'localhost')}:{service.get('port', 8000)}/health"
-                
-                with httpx.Client(timeout=5.0) as client:
-                    response = client.get(health_url)
-                    if response.status_code == 200:
-                        service_url = f"http://{service.get('host', 'localhost')}:{service.get('port', 8000)}/mcp"
-                        self.logger.info(f"Found healthy service at: {service_url}")
-                        return service_url
-                        
-            except Exception as e:
-                self.logger.warning(f"Health check failed for {service}: {e}")
+            if service.get("service_name", service_type) != service_type:
                 continue
+            heartbeat = service.get("last_heartbeat")
+            if heartbeat is None:  # Written by hand: never expires
+                live.append(service)
+                continue
+            expires_at = heartbeat + service.get("ttl_seconds", 15.0)
+            if expires_at >= now:
+                live.append(service)
+                next_expiry = min(next_expiry, expires_at)
+        self._next_expiry = next_expiry
+        return live
+    
+    @staticmethod
+    def _endpoint_urls(service: Dict[str, Any]) -> tuple:
+        """(base URL, health URL) for a registry or static_endpoints entry"""
+        base_url = service.get("url") or f"http://{service.get('host', 'localhost')}:{service.get('port', 8000)}"
+        base_url = base_url.rstrip("/")
+        health_url = service.get("health_check_url") or f"{base_url}{service.get('health_check', '/health')}"
+        return base_url, health_url
+    
+    def _apply_services(self, service_type: str, services: List[Dict[str, Any]]):
+        """Merge discovered services into the endpoint table, keeping known health state"""
+        known = self.endpoints.get(service_type, {})
+        table = {}
+        for service in services:
+            base_url, health_url = self._endpoint_urls(service)
+            state = known.get(base_url) or EndpointState(url=base_url, health_url=health_url)
+            state.health_url = health_url
+            state.weight = int(service.get("weight", 1))
+            state.capacity = service.get("capacity")
+            state.reported_load = service.get("load")
+            table[base_url] = state
+        self.endpoints[service_type] = table
+        self._rebuild_healthy(service_type)
+    
+    def _rebuild_healthy(self, service_type: str):
+        # Replaced wholesale so readers never see a half-built list
+        self._healthy[service_type] = [
+            state for state in self.endpoints.get(service_type, {}).values() if state.healthy
+        ]
+    
+    async def start_health_checks(self):
+        """Start the background health checker and registry watcher (idempotent)"""
+        if self._health_task and not self._health_task.done():
+            return
+        self._health_task = asyncio.create_task(self._health_loop())
+        self._watch_task = asyncio.create_task(self._watch_loop())
+        self.logger.info("Background health checks started", extra={
+            "interval": self.health_check_interval
+        })
+    
+    async def stop_health_checks(self):
+        for task in (self._health_task, self._watch_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._health_task = None
+        self._watch_task = None
+    
+    def _registry_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.active_services_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        changed = mtime != self._registry_mtime
+        self._registry_mtime = mtime
+        return changed or time.time() >= self._next_expiry
+    
+    async def _watch_loop(self):
+        async with httpx.AsyncClient(timeout=self.health_timeout) as client:
+            while True:
+                await asyncio.sleep(self.watch_interval)
+                if not self._registry_changed():
+                    continue
+                try:
+                    await self.refresh_membership(client)
+                except Exception as e:
+                    self.logger.error(f"Registry refresh failed: {e}")
+    
+    async def refresh_membership(self, client: httpx.AsyncClient):
+        """Apply registry changes now; probe instances that have never been checked"""
+        for service_type in list(self.endpoints.keys()) or ["customer_service"]:
+            before = set(self.endpoints.get(service_type, {}))
+            services = await asyncio.to_thread(self.discover_services, service_type)
+            self._apply_services(service_type, services)
+            
+            table = self.endpoints[service_type]
+            added = set(table) - before
+            removed = before - set(table)
+            if added or removed:
+                self.logger.info(f"Registry change for {service_type}: +{sorted(added)} -{sorted(removed)}")
+            fresh = [state for state in table.values() if state.last_checked is None]
+            if fresh:
+                await asyncio.gather(*(self._probe(client, state) for state in fresh))
+                self._rebuild_healthy(service_type)
+    
+    async def _health_loop(self):
+        async with httpx.AsyncClient(timeout=self.health_timeout) as client:
+            while True:
+                try:
+                    await self.check_all(client)
+                except Exception as e:
+                    self.logger.error(f"Health check round failed: {e}")
+                await asyncio.sleep(self.health_check_interval)
+    
+    async def check_all(self, client: httpx.AsyncClient):
+        """Re-read the registry and probe every known endpoint concurrently"""
+        for service_type in list(self.endpoints.keys()) or ["customer_service"]:
+            services = await asyncio.to_thread(self.discover_services, service_type)
+            self._apply_services(service_type, services)
+            
+            states = list(self.endpoints[service_type].values())
+            await asyncio.gather(*(self._probe(client, state) for state in states))
+            self._rebuild_healthy(service_type)
+    
+    async def _probe(self, client: httpx.AsyncClient, state: EndpointState):
+        start_time = time.perf_counter()
+        try:
+            response = await client.get(state.health_url)
+            healthy = response.status_code == 200
+        except Exception as e:
+            self.logger.warning(f"Health check failed for {state.url}: {e}")
+            healthy = False
+        
+        state.last_checked = time.time()
+        if healthy:
+            self.record_latency(state, time.perf_counter() - start_time)
+            state.consecutive_failures = 0
+        else:
+            state.consecutive_failures += 1
+        if healthy != state.healthy:
+            self.logger.info(f"Endpoint {state.url} is now {'healthy' if healthy else 'unhealthy'}")
+        state.healthy = healthy
+    
+    def record_latency(self, state: EndpointState, seconds: float):
+        if state.latency_ewma is None:
+            state.latency_ewma = seconds
+        else:
+            state.latency_ewma += self.latency_alpha * (seconds - state.latency_ewma)
+    
+    def mark_unhealthy(self, service_type: str, url: str):
+        """Passive health check: take an endpoint out after a failed call until it probes healthy"""
+        state = self.endpoints.get(service_type, {}).get(url)
+        if state and state.healthy:
+            state.healthy = False
+            state.consecutive_failures += 1
+            self._rebuild_healthy(service_type)
+            self.logger.warning(f"Endpoint {url} marked unhealthy after a failed call")
+    
+    def select_endpoint(self, service_type: str, routing_key: Optional[str] = None) -> Optional[EndpointState]:
+        """Load-balanced choice among healthy endpoints, or None if there are none"""
+        if service_type not in self.endpoints:
+            # First sight of this service type: seed the table once, optimistically
+            self._apply_services(service_type, self.discover_services(service_type))
+        
+        healthy = self._healthy.get(service_type)
+        if not healthy:
+            return None
+        return self.load_balancer.select(healthy, routing_key)
+    
+    def get_healthy_endpoint(self, service_type: str) -> Optional[str]:
+        """Get a healthy endpoint for the service type from the in-memory table"""
+        state = self.select_endpoint(service_type)
+        if state:
+            return f"{state.url}/mcp"
         
         # Fallback to default if no healthy services found
-        default_url = "http://localhost:8000/mcp"
+        default_url = f"{self.default_url}/mcp"
         self.logger.warning(f"No healthy services found, using default: {default_url}")
         return default_url
+    
+    def get_endpoint_status(self, service_type: str = "customer_service") -> List[Dict[str, Any]]:
+        """Current health table for monitoring"""
+        return [
+            {
+                "url": state.url,
+                "healthy": state.healthy,
+                "latency_ms": state.latency_ewma * 1000 if state.latency_ewma is not None else None,
+                "consecutive_failures": state.consecutive_failures,
+                "last_checked": state.last_checked,
+                "weight": state.weight,
+                "in_flight": state.in_flight,
+                "capacity": state.capacity,
+                "reported_load": state.reported_load,
+                "selections": self.load_balancer.selections.get(state.url, 0)
+            }
+            for state in self.endpoints.get(service_type, {}).values()
+        ]
+
+class EndpointConnectionPools:
+    """
+    One long-lived httpx.AsyncClient per MCP endpoint
+    
+    Connections stay open between tool calls instead of being set up and torn
+    down per request. HTTP/2 multiplexing is used when enabled and the ``h2``
+    package is installed; otherwise the pools fall back to HTTP/1.1
+    keep-alive.
+    """
+    
+    def __init__(self,
+                 connection_timeout: float = 5.0,
+                 read_timeout: float = 30.0,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0,
+                 http2: bool = False):
+        self.logger = logging.getLogger("connection_pools")
+        self.timeout = httpx.Timeout(connection_timeout, read=read_timeout, pool=connection_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2 and self._h2_available()
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._in_flight: Dict[str, int] = {}
+    
+    def _h2_available(self) -> bool:
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            self.logger.warning("HTTP/2 requested but the 'h2' package is not installed - using HTTP/1.1")
+            return False
+    
+    def get(self, base_url: str) -> httpx.AsyncClient:
+        client = self._clients.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2
+            )
+            self._clients[base_url] = client
+            self._in_flight.setdefault(base_url, 0)
+        return client
+    
+    async def post(self, base_url: str, path: str, **kwargs) -> httpx.Response:
+        client = self.get(base_url)
+        self._in_flight[base_url] += 1
+        try:
+            return await client.post(path, **kwargs)
+        finally:
+            self._in_flight[base_url] -= 1
+    
+    async def close(self):
+        """Close every pool; safe to call more than once"""
+        clients, self._clients = self._clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()), return_exceptions=True)
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Connections open/idle and requests in flight/waiting, per endpoint"""
+        stats = {}
+        for base_url, client in self._clients.items():
+            # httpcore's pool is not public API; report what is there
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            requests = list(getattr(pool, "_requests", []))
+            stats[base_url] = {
+                "http2": self.http2,
+                "connections_open": len(connections),
+                "connections_idle": sum(1 for c in connections if c.is_idle()),
+                "in_flight": self._in_flight.get(base_url, 0),
+                "waiting": sum(1 for r in requests if getattr(r, "connection", None) is None)
+            }
+        return stats
+
+class RetryAfterError(Exception):
+    """The server shed the call (503/429) and asked the caller to wait ``retry_after`` seconds"""
+    
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 class RetryPolicy:
     """Retry policy with exponential backoff for MCP client calls"""
@@ -104,8 +573,8 @@ class RetryPolicy:
                     self.logger.error(f"All retry attempts failed: {e}")
                     break
                 
-                # Exponential backoff
-                delay = self.base_delay * (2 ** attempt)
+                # Exponential backoff, but never sooner than the server asked for
+                delay = max(self.base_delay * (2 ** attempt), getattr(e, "retry_after", 0))
                 self.logger.warning(f"Attempt {attempt + 1} failed: {e}. Retrying in {delay}s...")
                 await asyncio.sleep(delay)
         
@@ -173,10 +642,47 @@ class MCPCustomerServiceClient:
     
     def __init__(self, config: ClientConfig):
         self.config = config
-        self.service_discovery = ServiceDiscovery()
+        self.settings = self._load_settings(config.config_path)
+        
+        load_balancing = self.settings.get("load_balancing", {})
+        affinity = load_balancing.get("affinity", {})
+        self.affinity_key = affinity.get("key", "customer_id")
+        discovery = self.settings.get("service_discovery", {})
+        self.service_discovery = ServiceDiscovery(
+            health_check_interval=load_balancing.get("health_check_interval", 10),
+            health_timeout=self.settings.get("timeouts", {}).get("connection_timeout", 5.0),
+            static_endpoints=discovery.get("static_endpoints", []),
+            active_services_path=discovery.get("registry_file", "mcp_services/active_services.json"),
+            watch_interval=discovery.get("watch_interval", 0.5),
+            load_balancer=LoadBalancer(
+                load_balancing.get("algorithm", "round_robin"),
+                affinity=affinity.get("enabled", False),
+                virtual_nodes=affinity.get("virtual_nodes", 160),
+                load_factor=affinity.get("load_factor", 1.25)
+            )
+        )
+        
+        # Long-lived connection pools, one per endpoint
+        timeouts = self.settings.get("timeouts", {})
+        pool_settings = self.settings.get("connection_pool", {})
+        self.total_timeout = timeouts.get("total_timeout", config.timeout)
+        self.connection_pools = EndpointConnectionPools(
+            connection_timeout=timeouts.get("connection_timeout", 5.0),
+            read_timeout=timeouts.get("read_timeout", config.timeout),
+            max_connections=pool_settings.get("max_connections", 100),
+            max_keepalive_connections=pool_settings.get("max_keepalive_connections", 20),
+            keepalive_expiry=pool_settings.get("keepalive_expiry", 30.0),
+            http2=pool_settings.get("http2", False)
+        )
         self.retry_policy = RetryPolicy(max_retries=config.max_retries)
         self.distributed_tracing = DistributedTracing()
         
+        # Idempotency key -> endpoint that took the first attempt. The server's
+        # idempotency store is per replica, so a retry only replays (or joins)
+        # the original call if it goes back to the same one
+        self._pinned_endpoints: "OrderedDict[str, str]" = OrderedDict()
+        self.max_pinned_endpoints = 10000
+        
         # Setup logging
         self.setup_logging()
         
@@ -191,6 +697,28 @@ class MCPCustomerServiceClient:
         
         self.logger.info("MCP Customer Service Client initialized")
     
+    @staticmethod
+    def _load_settings(config_path: str) -> Dict[str, Any]:
+        """Load mcp_client_config.yaml; built-in defaults apply when it is missing"""
+        try:
+            with open(config_path, 'r') as f:
+                return yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            logging.getLogger("mcp_client").warning(
+                f"Client config {config_path} not found - discovery, load balancing, pooling "
+                f"and timeout settings fall back to built-in defaults"
+            )
+            return {}
+    
+    async def start(self):
+        """Start background health checking; requests never wait on a probe"""
+        await self.service_discovery.start_health_checks()
+    
+    async def close(self):
+        """Stop background tasks and close pooled connections"""
+        await self.service_discovery.stop_health_checks()
+        await self.connection_pools.close()
+    
     def setup_logging(self):
         """Setup structured logging for client operations"""
         # Create logs directory
@@ -235,7 +763,7 @@ class MCPCustomerServiceClient:
         self.metrics["total_requests"] += 1
         
         try:
-            # Use retry policy for resilience
+            # Use retry policy for resilience; one idempotency key for every attempt
             result = await self.retry_policy.execute_with_retry(
                 self.call_mcp_service,
                 "customer_service",
@@ -244,7 +772,8 @@ class MCPCustomerServiceClient:
                     "query": query,
                     "customer_id": customer_id,
                     "correlation_id": correlation_id
-                }
+                },
+                idempotency_key=str(uuid.uuid4())
             )
             
             if result.get("success", False):
@@ -274,16 +803,112 @@ class MCPCustomerServiceClient:
             
             return fallback_result
     
-    async def call_mcp_service(self, service_type: str, tool_name: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
-        """Generic method to call MCP services with enterprise patterns"""
+    async def call_mcp_service(self,
+                               service_type: str,
+                               tool_name: str,
+                               parameters: Dict[str, Any],
+                               routing_key: Optional[str] = None,
+                               idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generic method to call MCP services with enterprise patterns
         
-        # Discover healthy service endpoint
-        service_url = self.service_discovery.get_healthy_endpoint(service_type)
-        if not service_url:
-            raise Exception(f"No healthy {service_type} services available")
+        ``routing_key`` pins the call to a replica when affinity routing is
+        enabled; it defaults to the configured affinity parameter
+        (customer_id or session_id) when the call carries one.
+        
+        Pass the same ``idempotency_key`` on every retry of one logical call:
+        the server then runs it at most once and hands retries the result.
+        Retries go back to the replica that took the first attempt, since
+        that is the one holding the result.
+        """
         
         # Prepare MCP request
-        mcp_request = {
+        mcp_request = self._tool_call(tool_name, parameters, idempotency_key)
+        if routing_key is None:
+            routing_key = self._routing_key(parameters)
+        
+        result = await self._post_jsonrpc(service_type, mcp_request, routing_key, idempotency_key)
+        
+        # Extract result from MCP response
+        if "result" in result:
+            return result["result"]
+        elif "error" in result:
+            raise Exception(f"MCP error: {result['error']}")
+        else:
+            raise Exception("Invalid MCP response format")
+    
+    async def call_mcp_batch(self,
+                             service_type: str,
+                             calls: List[tuple],
+                             routing_key: Optional[str] = None,
+                             idempotency_keys: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Send several tool calls as one JSON-RPC batch (one network round trip)
+        
+        ``calls`` is a list of (tool_name, parameters). Results come back in
+        the same order; a call that failed on the server becomes a
+        ``{"success": False, "error": ...}`` entry instead of failing the
+        batch. Transport failures raise, as in call_mcp_service.
+        ``idempotency_keys`` (one per call) work as in call_mcp_service.
+        """
+        keys = idempotency_keys or [None] * len(calls)
+        batch = [self._tool_call(tool_name, parameters, key)
+                 for (tool_name, parameters), key in zip(calls, keys)]
+        if routing_key is None:
+            routing_key = next(filter(None, (self._routing_key(parameters) for _, parameters in calls)), None)
+        
+        # The keys always travel together, so the first one pins the whole batch
+        responses = await self._post_jsonrpc(service_type, batch, routing_key, keys[0])
+        if not isinstance(responses, list):
+            # Whole-batch rejection (e.g. too many calls) comes back as one error object
+            raise Exception(f"MCP batch error: {responses.get('error', responses)}")
+        
+        by_id = {response.get("id"): response for response in responses}
+        results = []
+        for request in batch:
+            response = by_id.get(request["id"], {"error": {"code": -32603, "message": "No response for call"}})
+            if "result" in response:
+                results.append(response["result"])
+            else:
+                error = response.get("error", {})
+                results.append({
+                    "success": False,
+                    "error": error.get("message", "Invalid MCP response format"),
+                    "error_code": error.get("code"),
+                    "tool": request["params"]["name"]
+                })
+        return results
+    
+    async def scatter_gather(self,
+                             calls: List[tuple],
+                             service_type: str = "customer_service") -> List[Dict[str, Any]]:
+        """
+        Run a multi-tool agent turn in one round trip, with retries
+        
+        If the batch cannot be delivered at all, every call gets the same
+        graceful fallback response that handle_customer_query would give.
+        """
+        correlation_id = str(uuid.uuid4())
+        span = self.distributed_tracing.create_span("scatter_gather", correlation_id)
+        
+        try:
+            keys = [str(uuid.uuid4()) for _ in calls]
+            results = await self.retry_policy.execute_with_retry(
+                self.call_mcp_batch, service_type, calls, idempotency_keys=keys
+            )
+            self.distributed_tracing.log_span(span, {
+                "success": all(result.get("success", False) for result in results)
+            })
+            return results
+        except Exception as e:
+            self.logger.error(f"MCP batch call failed: {str(e)}")
+            self.distributed_tracing.log_span(span, {"success": False, "error": str(e)})
+            query = next((parameters.get("query", "") for _, parameters in calls if "query" in parameters), "")
+            return [self.get_fallback_response(query, str(e)) for _ in calls]
+    
+    @staticmethod
+    def _tool_call(tool_name: str, parameters: Dict[str, Any], idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        request = {
             "jsonrpc": "2.0",
             "id": str(uuid.uuid4()),
             "method": "tools/call",
@@ -292,34 +917,104 @@ class MCPCustomerServiceClient:
                 "arguments": parameters
             }
         }
+        if idempotency_key:
+            # MCP reserves params._meta for request metadata
+            request["params"]["_meta"] = {"idempotency_key": idempotency_key}
+        return request
+    
+    def _routing_key(self, parameters: Dict[str, Any]) -> Optional[str]:
+        routing_key = parameters.get(self.affinity_key)
+        if routing_key == "unknown":  # Anonymous callers would all pile onto one replica
+            return None
+        return routing_key
+    
+    def _pinned_endpoint(self, service_type: str, idempotency_key: Optional[str]) -> Optional[EndpointState]:
+        """Endpoint that took an earlier attempt of this keyed call, while it is still healthy"""
+        url = self._pinned_endpoints.get(idempotency_key) if idempotency_key else None
+        state = self.service_discovery.endpoints.get(service_type, {}).get(url) if url else None
+        if state is None or not state.healthy:
+            # Gone or failing its probes: whatever it was running is lost, so run it elsewhere
+            return None
+        return state
+    
+    def _pin_endpoint(self, idempotency_key: Optional[str], url: str):
+        if not idempotency_key:
+            return
+        self._pinned_endpoints[idempotency_key] = url
+        self._pinned_endpoints.move_to_end(idempotency_key)
+        while len(self._pinned_endpoints) > self.max_pinned_endpoints:
+            self._pinned_endpoints.popitem(last=False)
+    
+    async def _post_jsonrpc(self,
+                            service_type: str,
+                            payload: Any,
+                            routing_key: Optional[str],
+                            idempotency_key: Optional[str] = None) -> Any:
+        """POST a JSON-RPC call or batch to a balanced, healthy endpoint and return the decoded body"""
         
-        # Make HTTP request with timeout
-        async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-            try:
-                response = await client.post(
-                    service_url,
-                    json=mcp_request,
+        # Pick a healthy endpoint from the in-memory table (no probe on the request path);
+        # a keyed retry goes back to the endpoint of its first attempt
+        await self.start()
+        endpoint = self._pinned_endpoint(service_type, idempotency_key) \
+            or self.service_discovery.select_endpoint(service_type, routing_key)
+        if endpoint is None:
+            self.logger.warning(f"No healthy {service_type} services found, using default endpoint")
+        base_url = endpoint.url if endpoint else self.service_discovery.default_url
+        service_url = f"{base_url}/mcp"
+        
+        # Reuse the endpoint's pooled connections; total_timeout bounds the whole call
+        if endpoint:
+            endpoint.in_flight += 1
+        start_time = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.connection_pools.post(
+                    base_url,
+                    "/mcp",
+                    json=payload,
                     headers={
                         "Content-Type": "application/json",
                         "Authorization": "Bearer demo-token"  # In production, use real auth
                     }
-                )
-                
-                response.raise_for_status()
-                result = response.json()
+                ),
+                timeout=self.total_timeout
+            )
+            
+            response.raise_for_status()
+            result = response.json()
+            if endpoint:
+                self.service_discovery.record_latency(endpoint, time.perf_counter() - start_time)
+            if idempotency_key:
+                self._pinned_endpoints.pop(idempotency_key, None)
+            return result
                 
-                # Extract result from MCP response
-                if "result" in result:
-                    return result["result"]
-                elif "error" in result:
-                    raise Exception(f"MCP error: {result['error']}")
-                else:
-                    raise Exception("Invalid MCP response format")
-                    
-            except httpx.RequestError as e:
-                raise Exception(f"Network error calling {service_url}: {e}")
-            except httpx.HTTPStatusError as e:
-                raise Exception(f"HTTP error {e.response.status_code} calling {service_url}")
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # Never reached the server: nothing ran, so retries can safely go elsewhere
+            self.service_discovery.mark_unhealthy(service_type, base_url)
+            if idempotency_key:
+                self._pinned_endpoints.pop(idempotency_key, None)
+            raise Exception(f"Network error calling {service_url}: {e!r}")
+        except (httpx.RequestError, asyncio.TimeoutError) as e:
+            if idempotency_key:
+                # The call may still be running there; keep the endpoint in rotation
+                # and send the retry back so it replays the result instead of re-running
+                self._pin_endpoint(idempotency_key, base_url)
+            else:
+                # Steer retries elsewhere until the health checker sees it recover
+                self.service_discovery.mark_unhealthy(service_type, base_url)
+            raise Exception(f"Network error calling {service_url}: {e!r}")
+        except httpx.HTTPStatusError as e:
+            retry_after = e.response.headers.get("Retry-After", "")
+            if e.response.status_code in (429, 503) and retry_after.replace(".", "", 1).isdigit():
+                # Overloaded, not down: back off instead of marking the endpoint unhealthy
+                raise RetryAfterError(
+                    f"HTTP error {e.response.status_code} calling {service_url} (retry after {retry_after}s)",
+                    float(retry_after)
+                )
+            raise Exception(f"HTTP error {e.response.status_code} calling {service_url}")
+        finally:
+            if endpoint:
+                endpoint.in_flight -= 1
     
     def get_fallback_response(self, query: str, error_type: str) -> Dict[str, Any]:
         """Provide fallback response when services are unavailable"""
@@ -368,6 +1063,10 @@ class MCPCustomerServiceClient:
         """Get list of discovered services for monitoring"""
         return self.service_discovery.discover_services("customer_service")
     
+    def get_endpoint_health(self) -> List[Dict[str, Any]]:
+        """In-memory health table maintained by the background checker"""
+        return self.service_discovery.get_endpoint_status("customer_service")
+    
     def get_client_metrics(self) -> Dict[str, Any]:
         """Get client performance metrics"""
         success_rate = 0.0
@@ -377,15 +1076,189 @@ class MCPCustomerServiceClient:
         return {
             **self.metrics,
             "success_rate": success_rate,
-            "fallback_rate": self.metrics["fallback_responses"] / max(self.metrics["total_requests"], 1)
+            "fallback_rate": self.metrics["fallback_responses"] / max(self.metrics["total_requests"], 1),
+            "affinity": self.service_discovery.load_balancer.affinity_stats,
+            "connection_pools": self.connection_pools.get_stats()
         }
 
+def _latency_summary(samples: List[float], elapsed: float) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "calls_per_second": len(ordered) / elapsed
+    }
+
+async def benchmark_call_overhead(client: MCPCustomerServiceClient,
+                                  calls: int = 200,
+                                  concurrency: int = 4,
+                                  tool_name: str = "search_knowledge_base") -> Dict[str, Any]:
+    """
+    Per-call latency of a cheap tool call, before and after connection pooling
+    
+    "per_call_client" reproduces the old behaviour (a fresh AsyncClient, and
+    so a fresh connection, for every call); "pooled" goes through
+    call_mcp_service and the endpoint's long-lived pool.
+    """
+    await client.start()
+    service_url = client.service_discovery.get_healthy_endpoint("customer_service")
+    client.service_discovery.load_balancer.selections.clear()
+    arguments = {"query": "password reset", "max_results": 1}
+    
+    async def per_call_client():
+        async with httpx.AsyncClient(timeout=client.config.timeout) as fresh:
+            response = await fresh.post(service_url, json={
+                "jsonrpc": "2.0",
+                "id": str(uuid.uuid4()),
+                "method": "tools/call",
+                "params": {"name": tool_name, "arguments": arguments}
+            }, headers={"Authorization": "Bearer demo-token"})
+            response.raise_for_status()
+    
+    async def pooled():
+        await client.call_mcp_service("customer_service", tool_name, arguments)
+    
+    results = {}
+    for mode, call in (("per_call_client", per_call_client), ("pooled", pooled)):
+        samples = []
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def timed():
+            async with semaphore:
+                start_time = time.perf_counter()
+                await call()
+                samples.append(time.perf_counter() - start_time)
+        
+        await call()  # Warm up (first pooled call opens the connection)
+        start_time = time.perf_counter()
+        await asyncio.gather(*(timed() for _ in range(calls)))
+        results[mode] = _latency_summary(samples, time.perf_counter() - start_time)
+    
+    return {
+        "endpoint": service_url,
+        "calls": calls,
+        "concurrency": concurrency,
+        "http2": client.connection_pools.http2,
+        "timestamp": datetime.now().isoformat(),
+        "results": results,
+        "connection_pools": client.connection_pools.get_stats()
+    }
+
+AGENT_TURN_CALLS = [
+    ("search_knowledge_base", {"query": "I was charged twice", "max_results": 3}),
+    ("handle_customer_query", {"query": "I was charged twice", "customer_id": "benchmark"}),
+    ("escalate_to_human", {"conversation_id": "benchmark", "reason": "duplicate charge"})
+]
+
+async def benchmark_agent_turn(client: MCPCustomerServiceClient, turns: int = 50) -> Dict[str, Any]:
+    """Latency of a three-tool agent turn: one call per round trip vs one JSON-RPC batch"""
+    await client.start()
+    
+    async def sequential():
+        for tool_name, parameters in AGENT_TURN_CALLS:
+            await client.call_mcp_service("customer_service", tool_name, parameters)
+    
+    async def batched():
+        await client.call_mcp_batch("customer_service", AGENT_TURN_CALLS)
+    
+    results = {}
+    for mode, turn in (("sequential", sequential), ("batched", batched)):
+        await turn()  # Warm up the pooled connection
+        samples = []
+        start_time = time.perf_counter()
+        for _ in range(turns):
+            turn_start = time.perf_counter()
+            await turn()
+            samples.append(time.perf_counter() - turn_start)
+        results[mode] = _latency_summary(samples, time.perf_counter() - start_time)
+    
+    return {
+        "tools_per_turn": len(AGENT_TURN_CALLS),
+        "turns": turns,
+        "timestamp": datetime.now().isoformat(),
+        "results": results
+    }
+
+def simulate_cache_locality(replicas: int = 4,
+                            customers: int = 2000,
+                            requests: int = 20000,
+                            cache_size: int = 250,
+                            virtual_nodes: int = 160,
+                            seed: int = 7) -> Dict[str, Any]:
+    """
+    Offline comparison of per-replica cache hit rates: round robin vs affinity
+    
+    Every replica holds an LRU of ``cache_size`` customers (standing in for
+    retrieval results, conversation context and LLM sessions); a request hits
+    when its replica has already served that customer recently. Customer
+    popularity is skewed so some customers come back for many turns. Also
+    reports the share of customers remapped when one replica is added.
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(customers)]
+    traffic = [f"customer-{index}" for index in rng.choices(range(customers), weights=weights, k=requests)]
+    states = [EndpointState(url=f"http://replica-{index}:8000", health_url="") for index in range(replicas)]
+    
+    results = {}
+    for mode in ("round_robin", "affinity"):
+        balancer = LoadBalancer("round_robin", affinity=(mode == "affinity"), virtual_nodes=virtual_nodes)
+        caches = {state.url: OrderedDict() for state in states}
+        hits = 0
+        for customer in traffic:
+            cache = caches[balancer.select(states, customer).url]
+            if customer in cache:
+                hits += 1
+                cache.move_to_end(customer)
+            else:
+                cache[customer] = True
+                if len(cache) > cache_size:
+                    cache.popitem(last=False)
+        results[mode] = {"hit_rate": hits / requests, "selections": balancer.selections}
+    
+    before = ConsistentHashRing([state.url for state in states], virtual_nodes)
+    after = ConsistentHashRing([state.url for state in states] + [f"http://replica-{replicas}:8000"], virtual_nodes)
+    keys = [f"customer-{index}" for index in range(customers)]
+    remapped = sum(1 for key in keys if before.lookup(key) != after.lookup(key))
+    
+    return {
+        "replicas": replicas,
+        "customers": customers,
+        "requests": requests,
+        "cache_size_per_replica": cache_size,
+        "results": results,
+        "remapped_on_scale_out": remapped / customers,
+        "ideal_remapped_on_scale_out": 1 / (replicas + 1)
+    }
+
 async def main():
     """Main function demonstrating enterprise MCP client"""
     print("=== TechCorp MCP Customer Service Client ===")
     print("Enterprise Features: Service Discovery, Retry Policies, Distributed Tracing")
     print("Commands: 'services' to show discovered services, 'metrics' for client stats, 'quit' to exit\n")
     
+    import argparse
+    parser = argparse.ArgumentParser(description="TechCorp MCP Customer Service Client")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare per-call clients with pooled connections and exit")
+    parser.add_argument("--calls", type=int, default=200, help="Calls per benchmark mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent benchmark calls")
+    parser.add_argument("--output", default="metrics/mcp_client_benchmark.json", help="Benchmark results file")
+    parser.add_argument("--benchmark-batch", action="store_true",
+                        help="Compare a three-tool turn sent call by call with one JSON-RPC batch and exit")
+    parser.add_argument("--locality-demo", action="store_true",
+                        help="Simulate per-replica cache hit rates for round robin vs affinity routing and exit")
+    parser.add_argument("--replicas", type=int, default=4, help="Replicas in the locality simulation")
+    args = parser.parse_args()
+    
+    if args.locality_demo:
+        report = simulate_cache_locality(replicas=args.replicas)
+        for mode, summary in report["results"].items():
+            print(f"   {mode}: cache hit rate {summary['hit_rate']:.1%}")
+        print(f"🔀 Adding a replica remaps {report['remapped_on_scale_out']:.1%} of customers "
+              f"(ideal {report['ideal_remapped_on_scale_out']:.1%})")
+        return
+    
     # Initialize client configuration
     config = ClientConfig(
         service_discovery_url="http://localhost:8000",
@@ -395,8 +1268,40 @@ async def main():
     
     # Create enterprise MCP client
     client = MCPCustomerServiceClient(config)
+    await client.start()
     
     print("✅ MCP Client initialized successfully")
+    
+    if args.benchmark or args.benchmark_batch:
+        # One client sends hundreds of calls in seconds, far past the shipped 100/min, burst 20
+        print("ℹ️  Start the server with MCP_RATE_LIMIT_PER_MINUTE=1200 MCP_RATE_LIMIT_BURST=500 "
+              "(or MCP_RATE_LIMIT_PER_MINUTE=0 to disable limiting) for benchmark runs")
+    
+    if args.benchmark:
+        print(f"⏱️  Benchmarking {args.calls} calls per mode at concurrency {args.concurrency}...")
+        report = await benchmark_call_overhead(client, args.calls, args.concurrency)
+        for mode, summary in report["results"].items():
+            print(f"   {mode}: mean {summary['mean_ms']:.1f}ms, p50 {summary['p50_ms']:.1f}ms, "
+                  f"p95 {summary['p95_ms']:.1f}ms, {summary['calls_per_second']:.0f} calls/s")
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📊 Results written to {args.output}")
+        await client.close()
+        return
+    
+    if args.benchmark_batch:
+        print(f"⏱️  Benchmarking {args.calls} three-tool turns per mode...")
+        report = await benchmark_agent_turn(client, args.calls)
+        for mode, summary in report["results"].items():
+            print(f"   {mode}: mean {summary['mean_ms']:.1f}ms, p50 {summary['p50_ms']:.1f}ms, "
+                  f"p95 {summary['p95_ms']:.1f}ms per turn")
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📊 Results written to {args.output}")
+        await client.close()
+        return
     print("🔍 Discovering available services...")
     
     # Test service discovery
@@ -409,7 +1314,8 @@ async def main():
     # Interactive client loop
     while True:
         try:
-            user_input = input("\nCustomer Query: ").strip()
+            # Read input off the event loop so background health checks keep running
+            user_input = (await asyncio.to_thread(input, "\nCustomer Query: ")).strip()
             
             if user_input.lower() in ['quit', 'exit']:
                 print("\n📊 Final Client Metrics:")
@@ -420,10 +1326,12 @@ async def main():
             
             if user_input.lower() == 'services':
                 print("\n🔍 Discovered Services:")
-                services = client.get_discovered_services()
-                if services:
-                    for i, service in enumerate(services, 1):
-                        print(f"  {i}. {service.get('host', 'unknown')}:{service.get('port', 'unknown')}")
+                endpoints = client.get_endpoint_health()
+                if endpoints:
+                    for i, endpoint in enumerate(endpoints, 1):
+                        status = "✅ healthy" if endpoint["healthy"] else "❌ unhealthy"
+                        latency = f", {endpoint['latency_ms']:.1f}ms" if endpoint["latency_ms"] is not None else ""
+                        print(f"  {i}. {endpoint['url']} {status}{latency}")
                 else:
                     print("  No services currently discovered")
                 continue
@@ -467,6 +1375,8 @@ async def main():
             break
         except Exception as e:
             print(f"❌ Unexpected error: {e}")
+    
+    await client.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -4,31 +4,121 @@
 # Complete implementation - MCP Customer Service Server
 
 import asyncio
+import contextvars
+import functools
+import hashlib
+import inspect
 import json
 import logging
+import math
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from dataclasses import dataclass, field
 import os
 
 # MCP and FastAPI imports
 from fastmcp import FastMCP
 from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import jwt
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: registry writes are not locked
+    fcntl = None
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for the shared rate-limit backend
+    redis_asyncio = None
+
 @dataclass
 class ServiceConfig:
     """Configuration for MCP service"""
     service_name: str = "customer_service"
     host: str = "localhost"
     port: int = 8000
-    max_requests_per_minute: int = 100
+    max_requests_per_minute: int = 100  # 0 disables rate limiting
+    burst_limit: int = 20
+    rate_limit_backend: str = "memory"  # memory (per process) or redis (shared across workers)
+    rate_limit_redis_url: str = "redis://localhost:6379/0"
+    rate_limit_max_clients: int = 10000  # In-process buckets kept before the least recent are evicted
+    rate_limit_fail_open: bool = True  # Admit requests while the shared backend is unreachable
     health_check_interval: int = 30
+    llm_warmup: bool = True
+    registry_path: str = "mcp_services/active_services.json"
+    heartbeat_interval: float = 5.0
+    registry_ttl: float = 15.0  # Missed heartbeats for this long and the instance drops out
+    capacity: int = 64  # Concurrent requests this instance is sized for (a hint for clients)
+    batch_max_calls: int = 16  # Largest JSON-RPC batch accepted in one request
+    tool_timeout: float = 30.0  # Per-call limit; a slow call fails alone, not the whole batch
+    # Per-tool overrides. The LLM call may generate twice (small-model self-check retry),
+    # each up to the LLM's own 30s timeout, so its tool must outlast both
+    tool_timeouts: Dict[str, float] = field(default_factory=lambda: {"handle_customer_query": 75.0})
+    idempotency_ttl: float = 600.0  # Completed results replayed to retries for this long
+    idempotency_max_entries: int = 10000
+    # Per-tool bulkheads: concurrent calls, calls allowed to wait, blocking-pool threads
+    bulkheads: Dict[str, Dict[str, int]] = field(default_factory=lambda: {
+        "handle_customer_query": {"max_concurrent": 8, "max_queue": 16, "threads": 8},
+        "search_knowledge_base": {"max_concurrent": 16, "max_queue": 64, "threads": 4},
+        "escalate_to_human": {"max_concurrent": 8, "max_queue": 32, "threads": 2}
+    })
+    default_bulkhead: Dict[str, int] = field(default_factory=lambda: {
+        "max_concurrent": 8, "max_queue": 16, "threads": 2
+    })
+    # Server-wide adaptive concurrency limit on /mcp; excess requests get 503 + Retry-After
+    adaptive_concurrency: Dict[str, Any] = field(default_factory=lambda: {
+        "enabled": True,
+        "initial_limit": 32,
+        "min_limit": 4,
+        "max_limit": 256,
+        "tolerance": 2.0,  # Latency growth over the no-load baseline tolerated before shrinking
+        "smoothing": 0.2,
+        "overload_hold_seconds": 5.0  # /ready stays 503 this long after the last shed request
+    })
+    
+    @classmethod
+    def from_config(cls, config_path: str = "config/mcp_server_config.yaml", **overrides) -> "ServiceConfig":
+        """Build from mcp_server_config.yaml; keyword overrides win, defaults fill any gaps"""
+        import yaml
+        settings = {}
+        try:
+            with open(config_path, 'r') as f:
+                data = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            logging.getLogger("mcp_server").warning(
+                f"Server config {config_path} not found - using built-in defaults"
+            )
+            data = {}
+        
+        server = data.get("server", {})
+        if "host" in server:
+            settings["host"] = server["host"]
+        if "port" in server:
+            settings["port"] = int(server["port"])
+        
+        rate_limiting = data.get("rate_limiting", {})
+        if "requests_per_minute" in rate_limiting:
+            settings["max_requests_per_minute"] = int(rate_limiting["requests_per_minute"])
+        if not rate_limiting.get("enabled", True):
+            settings["max_requests_per_minute"] = 0
+        for key, field_name in (("burst_limit", "burst_limit"),
+                                ("backend", "rate_limit_backend"),
+                                ("redis_url", "rate_limit_redis_url"),
+                                ("fail_open", "rate_limit_fail_open")):
+            if key in rate_limiting:
+                settings[field_name] = rate_limiting[key]
+        
+        settings.update(overrides)
+        return cls(**settings)
 
 class AuthenticationMiddleware:
     """Enterprise authentication middleware for MCP services"""
@@ -67,31 +157,155 @@ class AuthenticationMiddleware:
         
         raise HTTPException(status_code=401, detail="Invalid authentication token")
 
+class InProcessRateLimitBackend:
+    """
+    Token buckets in a bounded LRU, for a single server process
+    
+    A bucket that has been idle long enough to refill completely is
+    indistinguishable from a new one, so it is dropped; past
+    ``max_clients`` the least recently seen bucket goes too.
+    """
+    
+    def __init__(self, max_clients: int = 10000):
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()  # client -> [tokens, last refill]
+    
+    async def acquire(self, client_id: str, rate: float, burst: int) -> Tuple[bool, float]:
+        return self.acquire_now(client_id, rate, burst, time.monotonic())
+    
+    def acquire_now(self, client_id: str, rate: float, burst: int, now: float) -> Tuple[bool, float]:
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = self._buckets[client_id] = [float(burst), now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets.move_to_end(client_id)
+        self._evict(rate, burst, now)
+        
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return True, 0.0
+        return False, (1.0 - bucket[0]) / rate
+    
+    def _evict(self, rate: float, burst: int, now: float):
+        full_after = burst / rate
+        while self._buckets:
+            _, oldest_seen = next(iter(self._buckets.values()))
+            if len(self._buckets) <= self.max_clients and now - oldest_seen < full_after:
+                break
+            self._buckets.popitem(last=False)
+    
+    def tracked_clients(self) -> int:
+        return len(self._buckets)
+
+class RedisRateLimitBackend:
+    """
+    Token buckets in Redis (or any Redis-protocol server), shared by every worker process
+    
+    One Lua script refills and takes a token atomically, and each bucket
+    expires once it would be full again, so Redis memory stays bounded too.
+    """
+    
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+    return {allowed, tostring(tokens)}
+    """
+    
+    def __init__(self, url: str = "redis://localhost:6379/0", key_prefix: str = "mcp:ratelimit:",
+                 timeout: float = 0.25):
+        if redis_asyncio is None:
+            raise ImportError("The redis rate-limit backend needs the 'redis' package (pip install redis)")
+        # A hung Redis must not hold up every request; the limiter fails open on timeout
+        self.client = redis_asyncio.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.key_prefix = key_prefix
+        self._script = self.client.register_script(self.SCRIPT)
+    
+    async def acquire(self, client_id: str, rate: float, burst: int) -> Tuple[bool, float]:
+        allowed, tokens = await self._script(keys=[f"{self.key_prefix}{client_id}"], args=[rate, burst, time.time()])
+        if int(allowed):
+            return True, 0.0
+        return False, (1.0 - float(tokens)) / rate
+    
+    def tracked_clients(self) -> Optional[int]:
+        return None  # Lives in Redis; see its keyspace
+
 class RateLimitMiddleware:
-    """Rate limiting middleware for enterprise MCP services"""
+    """
+    Per-client token-bucket rate limiting for enterprise MCP services
     
-    def __init__(self, max_requests: int = 100):
+    Each client may burst up to ``burst_limit`` requests and is then held to
+    ``max_requests`` per minute, refilled continuously: no window edges, so
+    no 2x bursts when a window resets. O(1) per request; buckets live in an
+    in-process backend by default or in Redis when several worker processes
+    must share one budget.
+    
+    If the backend fails (Redis down or slow), requests are admitted when
+    ``fail_open`` is set - losing rate limiting for a while beats failing
+    all traffic - and rejected with a short retry otherwise.
+    """
+    
+    def __init__(self, max_requests: int = 100, burst_limit: int = 20, backend=None, fail_open: bool = True):
         self.max_requests = max_requests
-        self.request_counts = {}
-        self.window_start = time.time()
-        
-    def check_rate_limit(self, client_id: str) -> bool:
-        """Check if client is within rate limits"""
-        current_time = time.time()
-        
-        # Reset window every minute
-        if current_time - self.window_start > 60:
-            self.request_counts.clear()
-            self.window_start = current_time
-        
-        # Count requests for this client
-        current_count = self.request_counts.get(client_id, 0)
-        
-        if current_count >= self.max_requests:
-            return False
-        
-        self.request_counts[client_id] = current_count + 1
-        return True
+        self.burst_limit = burst_limit
+        self.rate = max_requests / 60.0
+        self.enabled = max_requests > 0
+        self.backend = backend or InProcessRateLimitBackend()
+        self.fail_open = fail_open
+        self.allowed = 0
+        self.limited = 0
+        self.backend_errors = 0
+        self._backend_down = False
+        self.logger = logging.getLogger("mcp_rate_limit")
+    
+    async def check_rate_limit(self, client_id: str) -> Tuple[bool, float]:
+        """(allowed, retry_after_seconds) for one request from this client"""
+        if not self.enabled:
+            return True, 0.0
+        try:
+            allowed, retry_after = await self.backend.acquire(client_id, self.rate, self.burst_limit)
+        except Exception as e:
+            self.backend_errors += 1
+            if not self._backend_down:  # Log the transition, not every request
+                self._backend_down = True
+                action = "admitting" if self.fail_open else "rejecting"
+                self.logger.warning(f"Rate limit backend failed ({e!r}) - {action} requests until it recovers")
+            return self.fail_open, 0.0 if self.fail_open else 1.0
+        if self._backend_down:
+            self._backend_down = False
+            self.logger.info("Rate limit backend recovered")
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+        return allowed, retry_after
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "max_requests_per_minute": self.max_requests,
+            "burst_limit": self.burst_limit,
+            "tracked_clients": self.backend.tracked_clients(),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "fail_open": self.fail_open,
+            "backend_errors": self.backend_errors,
+            "backend_down": self._backend_down
+        }
 
 class CircuitBreakerMiddleware:
     """Circuit breaker for downstream service calls"""
@@ -126,6 +340,370 @@ class CircuitBreakerMiddleware:
             
             raise e
 
+class ServiceRegistry:
+    """
+    Local multi-instance service registry: a file-locked JSON store
+    
+    Each instance upserts its own entry (keyed by instance_id) and refreshes
+    ``last_heartbeat`` on an interval together with load hints. Entries whose
+    heartbeat is older than their ``ttl_seconds`` are pruned on every write
+    and ignored by readers, so crashed instances age out on their own. Writes
+    go to a temp file that is renamed into place, so readers need no lock.
+    """
+    
+    def __init__(self, path: str = "mcp_services/active_services.json", ttl_seconds: float = 15.0):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.logger = logging.getLogger("service_registry")
+    
+    @contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    @staticmethod
+    def is_live(entry: Dict[str, Any], now: float) -> bool:
+        # Entries without a heartbeat were written by hand and never expire
+        heartbeat = entry.get("last_heartbeat")
+        return heartbeat is None or now - heartbeat <= entry.get("ttl_seconds", 15.0)
+    
+    def _read(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f).get("services", [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+    
+    def _update(self, mutate) -> List[Dict[str, Any]]:
+        with self._locked():
+            now = time.time()
+            services = [entry for entry in self._read() if self.is_live(entry, now)]
+            services = mutate(services, now)
+            temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_path, "w") as f:
+                json.dump({"services": services}, f, indent=2)
+            os.replace(temp_path, self.path)
+            return services
+    
+    def register(self, entry: Dict[str, Any]):
+        """Add or replace this instance's entry, keeping every other live instance"""
+        def upsert(services, now):
+            record = {**entry, "last_heartbeat": now, "ttl_seconds": self.ttl_seconds}
+            return [s for s in services if s.get("instance_id") != entry["instance_id"]] + [record]
+        self._update(upsert)
+    
+    def heartbeat(self, instance_id: str, hints: Dict[str, Any], entry: Dict[str, Any]):
+        """Refresh the heartbeat and load hints; re-registers if the entry expired meanwhile"""
+        def refresh(services, now):
+            for service in services:
+                if service.get("instance_id") == instance_id:
+                    service.update(hints, last_heartbeat=now)
+                    return services
+            self.logger.warning(f"Registry entry for {instance_id} had expired - re-registering")
+            return services + [{**entry, **hints, "last_heartbeat": now, "ttl_seconds": self.ttl_seconds}]
+        self._update(refresh)
+    
+    def deregister(self, instance_id: str):
+        self._update(lambda services, now: [s for s in services if s.get("instance_id") != instance_id])
+    
+    def live_services(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        return [entry for entry in self._read() if self.is_live(entry, now)]
+
+class BulkheadFullError(Exception):
+    """Raised when a tool's bulkhead queue is full; carries a retry-after hint in seconds"""
+    
+    def __init__(self, tool_name: str, retry_after: float):
+        super().__init__(f"Tool {tool_name} is at capacity - retry after {retry_after:.1f}s")
+        self.tool_name = tool_name
+        self.retry_after = retry_after
+
+class ToolBulkhead:
+    """
+    Concurrency limit, bounded queue and bounded thread pool for one MCP tool
+    
+    At most ``max_concurrent`` calls run at once and ``max_queue`` more may
+    wait; anything beyond that is rejected immediately with a retry-after
+    hint instead of piling up on the event loop. Blocking work goes through
+    ``run_blocking`` on the tool's own small thread pool, so a saturated tool
+    cannot take threads (or the loop) from the others. A call that times out
+    while its thread is still busy keeps its permit until the thread is done,
+    so the pool's own queue never grows past the bulkhead's limits.
+    """
+    
+    # Executor futures started by the call running in the current task
+    _blocking_futures: contextvars.ContextVar = contextvars.ContextVar("bulkhead_blocking_futures")
+    
+    def __init__(self, name: str, max_concurrent: int = 8, max_queue: int = 16,
+                 threads: int = 2, latency_alpha: float = 0.2):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.latency_alpha = latency_alpha
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"tool-{name}")
+        self.threads = threads
+        
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.completed = 0
+        self.abandoned = 0  # Timed-out calls whose thread kept running (and kept its permit)
+        self.latency_ewma: Optional[float] = None
+    
+    def retry_after(self) -> float:
+        """Time for the current backlog to drain, from the tool's latency EWMA"""
+        latency = self.latency_ewma or 1.0
+        return max(1.0, latency * (self.queued + self.in_flight) / self.max_concurrent)
+    
+    async def run(self, call: Callable):
+        """Await ``call()`` inside the bulkhead; raises BulkheadFullError when the queue is full"""
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise BulkheadFullError(self.name, self.retry_after())
+        
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        
+        self.in_flight += 1
+        start_time = time.perf_counter()
+        futures = []
+        token = self._blocking_futures.set(futures)
+        try:
+            return await call()
+        finally:
+            self._blocking_futures.reset(token)
+            busy = [future for future in futures if not future.done()]
+            if busy:
+                # Cancelled (timed out) with a thread still running: hand the permit to that thread
+                self.abandoned += 1
+                remaining = len(busy)
+                def on_done(_):
+                    nonlocal remaining
+                    remaining -= 1
+                    if remaining == 0:
+                        self._release(start_time)
+                for future in busy:
+                    future.add_done_callback(on_done)
+            else:
+                self._release(start_time)
+    
+    def _release(self, start_time: float):
+        elapsed = time.perf_counter() - start_time
+        self.latency_ewma = elapsed if self.latency_ewma is None else (
+            self.latency_ewma + self.latency_alpha * (elapsed - self.latency_ewma))
+        self.in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+    
+    async def run_blocking(self, func: Callable, *args, **kwargs):
+        """Run a blocking function on this tool's bounded thread pool"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        futures = self._blocking_futures.get(None)
+        if futures is not None:
+            futures.append(future)
+        # Shielded: cancelling the caller cannot stop the thread, so the future must outlive it
+        return await asyncio.shield(future)
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "threads": self.threads,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "abandoned": self.abandoned,
+            "latency_ms": self.latency_ewma * 1000 if self.latency_ewma is not None else None
+        }
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Gradient-based adaptive concurrency limit (after Netflix's Gradient and TCP Vegas)
+    
+    Compares smoothed latency with the no-load baseline (the minimum latency
+    seen over the last ``min_rtt_window`` samples): while latency stays
+    within ``tolerance`` of the baseline the limit grows by about
+    sqrt(limit) per sample; once queueing pushes latency up, the gradient
+    (tolerance x baseline / latency) drops below 1 and the limit shrinks
+    towards the concurrency the server actually sustains. Requests beyond
+    the limit are shed immediately rather than queued, so goodput plateaus
+    under overload instead of collapsing into timeouts.
+    
+    Latency is tracked per tool and each sample is judged against its own
+    tool's baseline: millisecond knowledge searches and multi-second LLM
+    calls share one limit but never one baseline.
+    """
+    
+    def __init__(self, initial_limit: int = 32, min_limit: int = 4, max_limit: int = 256,
+                 tolerance: float = 2.0, smoothing: float = 0.2, overload_hold_seconds: float = 5.0,
+                 enabled: bool = True, min_rtt_window: int = 200, latency_alpha: float = 0.3):
+        self.enabled = enabled
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.overload_hold_seconds = overload_hold_seconds
+        self.min_rtt_window = min_rtt_window
+        self.latency_alpha = latency_alpha
+        
+        self.in_flight = 0
+        # Per tool: smoothed rtt, baseline min_rtt and the current baseline window
+        self.latency: Dict[str, Dict[str, Any]] = {}
+        self.shed = 0
+        self.admitted = 0
+        self.last_shed_at: Optional[float] = None
+    
+    def try_acquire(self) -> bool:
+        """Admit a request, or return False to shed it"""
+        if self.enabled and self.in_flight >= int(self.limit):
+            self.shed += 1
+            self.last_shed_at = time.monotonic()
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+    
+    def release(self):
+        self.in_flight -= 1
+    
+    def record(self, tool_name: str, rtt: float):
+        """One tool call's latency; failures carry no latency signal and are not recorded"""
+        if not self.enabled:
+            return
+        stats = self.latency.setdefault(tool_name, {
+            "rtt": rtt, "min_rtt": rtt, "window_min": float("inf"), "window_samples": 0
+        })
+        stats["rtt"] += self.latency_alpha * (rtt - stats["rtt"])
+        
+        # Baseline: minimum of the previous window, so it can rise again if the workload changes
+        stats["window_min"] = min(stats["window_min"], rtt)
+        stats["window_samples"] += 1
+        stats["min_rtt"] = min(stats["min_rtt"], rtt)
+        if stats["window_samples"] >= self.min_rtt_window:
+            stats["min_rtt"] = stats["window_min"]
+            stats["window_min"] = float("inf")
+            stats["window_samples"] = 0
+        
+        gradient = max(0.5, min(1.0, self.tolerance * stats["min_rtt"] / stats["rtt"]))
+        if gradient == 1.0 and self.in_flight + 1 < self.limit / 2:
+            return  # App-limited: latency says nothing about a limit we are nowhere near
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = (1 - self.smoothing) * self.limit + self.smoothing * new_limit
+        self.limit = max(self.min_limit, min(self.max_limit, self.limit))
+    
+    def is_overloaded(self) -> bool:
+        if not self.enabled:
+            return False
+        if self.in_flight >= int(self.limit):
+            return True
+        return self.last_shed_at is not None and time.monotonic() - self.last_shed_at < self.overload_hold_seconds
+    
+    def retry_after(self) -> int:
+        """Seconds until roughly one limit's worth of requests has drained"""
+        slowest = max((stats["rtt"] for stats in self.latency.values()), default=1.0)
+        return max(1, math.ceil(slowest))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "overloaded": self.is_overloaded(),
+            "latency_ms": {
+                tool_name: {"latency": stats["rtt"] * 1000, "baseline": stats["min_rtt"] * 1000}
+                for tool_name, stats in self.latency.items()
+            }
+        }
+
+class IdempotencyConflictError(Exception):
+    """An idempotency key was reused for a different tool call"""
+
+class IdempotencyStore:
+    """
+    Results of keyed tool calls, so retried requests never run twice
+    
+    The first request with a key starts the call as its own task; a retry
+    that arrives while it runs awaits the same task, and one that arrives
+    after it finished gets the stored result, for ``ttl_seconds``.
+    Failures are not stored, so a retry after an error runs the call again.
+    Completed entries sit in completion order (which, with a fixed TTL, is
+    also expiry order) and are capped at ``max_entries``.
+    """
+    
+    def __init__(self, ttl_seconds: float = 600.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._in_progress: Dict[str, Dict[str, Any]] = {}
+        self._completed: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.stats = {"executed": 0, "attached": 0, "replayed": 0, "conflicts": 0}
+    
+    @staticmethod
+    def fingerprint(tool_name: str, arguments: Dict[str, Any]) -> str:
+        canonical = json.dumps(arguments, sort_keys=True, default=str)
+        return f"{tool_name}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+    
+    async def run(self, key: str, fingerprint: str, call: Callable):
+        self._expire(time.monotonic())
+        
+        entry = self._in_progress.get(key) or self._completed.get(key)
+        if entry is not None:
+            if entry["fingerprint"] != fingerprint:
+                self.stats["conflicts"] += 1
+                raise IdempotencyConflictError(f"Idempotency key {key} was already used for a different call")
+            self.stats["replayed" if entry["task"].done() else "attached"] += 1
+            return await asyncio.shield(entry["task"])
+        
+        # Own task, shielded: a cancelled first request leaves the work running for its retry
+        task = asyncio.ensure_future(call())
+        entry = {"fingerprint": fingerprint, "task": task}
+        self._in_progress[key] = entry
+        task.add_done_callback(lambda finished: self._finished(key, entry, finished))
+        self.stats["executed"] += 1
+        return await asyncio.shield(task)
+    
+    def _finished(self, key: str, entry: Dict[str, Any], task: asyncio.Future):
+        self._in_progress.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        entry["expires_at"] = time.monotonic() + self.ttl_seconds
+        self._completed[key] = entry
+        while len(self._completed) > self.max_entries:
+            self._completed.popitem(last=False)
+    
+    def _expire(self, now: float):
+        while self._completed:
+            entry = next(iter(self._completed.values()))
+            if entry["expires_at"] > now:
+                break
+            self._completed.popitem(last=False)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "in_progress": len(self._in_progress),
+            "stored_results": len(self._completed),
+            "ttl_seconds": self.ttl_seconds
+        }
+
 class MCPCustomerServiceServer:
     """
     Enterprise MCP Server for Customer Service
@@ -145,12 +723,28 @@ class MCPCustomerServiceServer:
         
         # Initialize middleware
         self.auth_middleware = AuthenticationMiddleware()
-        self.rate_limiter = RateLimitMiddleware(config.max_requests_per_minute)
+        self.rate_limiter = RateLimitMiddleware(
+            config.max_requests_per_minute,
+            config.burst_limit,
+            self._create_rate_limit_backend(),
+            config.rate_limit_fail_open
+        )
         self.circuit_breaker = CircuitBreakerMiddleware()
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter(**config.adaptive_concurrency)
+        self.idempotency = IdempotencyStore(config.idempotency_ttl, config.idempotency_max_entries)
+        
+        # Heartbeat registration shared by every instance on this host
+        self.registry = ServiceRegistry(config.registry_path, config.registry_ttl)
+        self.instance_id = f"{config.service_name}@{config.host}:{config.port}"
+        self.in_flight = 0
+        self._heartbeat_task: Optional[asyncio.Task] = None
         
         # Setup logging
         self.setup_logging()
         
+        # Lab 1 LLM service, when available; /ready waits for its warm-up
+        self.llm_service = self._create_llm_service() if config.llm_warmup else None
+        
         # Setup FastAPI middleware
         self.app.add_middleware(
             CORSMiddleware,
@@ -160,8 +754,55 @@ class MCPCustomerServiceServer:
             allow_headers=["*"],
         )
         
+        @self.app.middleware("http")
+        async def track_in_flight(request: Request, call_next):
+            # Reported to the registry as a load hint
+            self.in_flight += 1
+            try:
+                return await call_next(request)
+            finally:
+                self.in_flight -= 1
+        
+        @self.app.middleware("http")
+        async def shed_load(request: Request, call_next):
+            # Only tool traffic is limited; health, readiness and metrics must always answer
+            if not request.url.path.startswith("/mcp"):
+                return await call_next(request)
+            
+            if not self.concurrency_limiter.try_acquire():
+                retry_after = self.concurrency_limiter.retry_after()
+                return JSONResponse(
+                    self._jsonrpc_error(None, -32002, "Server overloaded - retry later"),
+                    status_code=503,
+                    headers={"Retry-After": str(retry_after)}
+                )
+            
+            # Latency samples come per tool call from execute_jsonrpc
+            try:
+                return await call_next(request)
+            finally:
+                self.concurrency_limiter.release()
+        
+        @self.app.middleware("http")
+        async def rate_limit(request: Request, call_next):
+            # Outermost: per-client fairness is checked before any shared capacity is used
+            if not request.url.path.startswith("/mcp"):
+                return await call_next(request)
+            
+            allowed, retry_after = await self.rate_limiter.check_rate_limit(self._rate_limit_key(request))
+            if not allowed:
+                return JSONResponse(
+                    self._jsonrpc_error(None, -32003, "Rate limit exceeded"),
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+                )
+            return await call_next(request)
+        
         # Setup MCP tools and endpoints
+        self.tools: Dict[str, Callable] = {}
+        self.bulkheads: Dict[str, ToolBulkhead] = {}
         self.setup_mcp_tools()
+        self.setup_jsonrpc_endpoint()
         self.setup_health_endpoints()
         
         # Performance metrics
@@ -198,10 +839,54 @@ class MCPCustomerServiceServer:
         self.logger.addHandler(console_handler)
         self.logger.addHandler(file_handler)
     
+    def _rate_limit_key(self, request: Request) -> str:
+        """
+        Bucket for a request: the authenticated identity and the client IP
+        
+        Both come from the server's side of the connection, so a caller
+        cannot get a fresh bucket by changing anything it sends.
+        """
+        try:
+            user_id = self.auth_middleware.authenticate_request(request)["user_id"]
+        except HTTPException:
+            user_id = "invalid"
+        host = request.client.host if request.client else "unknown"
+        return f"{user_id}/{host}"
+    
+    def _create_rate_limit_backend(self):
+        if self.config.rate_limit_backend == "redis":
+            return RedisRateLimitBackend(self.config.rate_limit_redis_url)
+        if self.config.rate_limit_backend != "memory":
+            raise ValueError(f"Unknown rate limit backend: {self.config.rate_limit_backend}")
+        return InProcessRateLimitBackend(self.config.rate_limit_max_clients)
+    
+    def _create_llm_service(self):
+        """Enterprise LLM service from Lab 1, if it is on the path"""
+        try:
+            from enterprise_llm_service import EnterpriseLLMService
+            return EnterpriseLLMService()
+        except ImportError:
+            self.logger.info("Enterprise LLM service not available - readiness ignores model warm-up")
+            return None
+    
+    def register_tool(self, tool: Callable) -> Callable:
+        """Register a tool, behind its own bulkhead, with FastMCP and the JSON-RPC dispatcher"""
+        name = tool.__name__
+        limits = self.config.bulkheads.get(name, self.config.default_bulkhead)
+        bulkhead = ToolBulkhead(name, **limits)
+        self.bulkheads[name] = bulkhead
+        
+        @functools.wraps(tool)
+        async def guarded(*args, **kwargs):
+            return await bulkhead.run(lambda: tool(*args, **kwargs))
+        
+        self.tools[name] = guarded
+        return self.mcp.tool()(guarded)
+    
     def setup_mcp_tools(self):
         """Register MCP tools for customer service operations"""
         
-        @self.mcp.tool()
+        @self.register_tool
         async def handle_customer_query(query: str, customer_id: str = "unknown", correlation_id: str = None) -> Dict[str, Any]:
             """MCP tool implementation for customer query handling"""
             if not correlation_id:
@@ -216,7 +901,7 @@ class MCPCustomerServiceServer:
             })
             
             try:
-                # Simulate customer service processing
+                # LLM generation when the model is warm, canned answers otherwise
                 response = await self.process_customer_query(query, customer_id, correlation_id)
                 
                 # Update metrics
@@ -247,7 +932,7 @@ class MCPCustomerServiceServer:
                     "timestamp": datetime.now().isoformat()
                 }
         
-        @self.mcp.tool()
+        @self.register_tool
         async def escalate_to_human(conversation_id: str, reason: str) -> Dict[str, Any]:
             """MCP tool for escalating conversations to human agents"""
             
@@ -264,7 +949,7 @@ class MCPCustomerServiceServer:
                 "timestamp": datetime.now().isoformat()
             }
         
-        @self.mcp.tool()
+        @self.register_tool
         async def search_knowledge_base(query: str, max_results: int = 5) -> Dict[str, Any]:
             """MCP tool for searching enterprise knowledge base"""
             
@@ -291,6 +976,117 @@ class MCPCustomerServiceServer:
                 "query": query
             }
     
+    def setup_jsonrpc_endpoint(self):
+        """
+        JSON-RPC 2.0 endpoint for tools/call, single calls or batches
+        
+        A batch (a JSON array of calls) runs its calls concurrently, each
+        under ``tool_timeout``, and answers with one array; a failing or slow
+        call gets its own error object and the rest still succeed. Registered
+        before the FastMCP app is mounted, so it takes ``POST /mcp`` while
+        FastMCP keeps serving the paths below it.
+        """
+        
+        @self.app.post("/mcp")
+        async def jsonrpc(request: Request):
+            try:
+                payload = await request.json()
+            except ValueError:
+                return self._jsonrpc_error(None, -32700, "Parse error")
+            
+            if isinstance(payload, dict):
+                response = await self.execute_jsonrpc(payload)
+                if response is None:
+                    return Response(status_code=204)
+                if response.get("error", {}).get("code") == -32001:
+                    retry_after = response["error"]["data"]["retry_after"]
+                    return JSONResponse(response, status_code=503,
+                                        headers={"Retry-After": str(math.ceil(retry_after))})
+                return response
+            
+            if not isinstance(payload, list) or not payload:
+                return self._jsonrpc_error(None, -32600, "Invalid Request")
+            if len(payload) > self.config.batch_max_calls:
+                return self._jsonrpc_error(None, -32600, f"Batch exceeds {self.config.batch_max_calls} calls")
+            
+            responses = await asyncio.gather(*(self.execute_jsonrpc(call) for call in payload))
+            responses = [response for response in responses if response is not None]
+            # A batch of notifications only gets no content back
+            return responses if responses else Response(status_code=204)
+    
+    @staticmethod
+    def _jsonrpc_error(request_id: Any, code: int, message: str) -> Dict[str, Any]:
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+    
+    async def execute_jsonrpc(self, call: Any) -> Optional[Dict[str, Any]]:
+        """Run one JSON-RPC call; notifications (no id) return None"""
+        if not isinstance(call, dict) or call.get("jsonrpc") != "2.0" or "method" not in call:
+            return self._jsonrpc_error(None, -32600, "Invalid Request")
+        request_id = call.get("id")
+        is_notification = "id" not in call
+        
+        method = call["method"]
+        params = call.get("params") or {}
+        if method == "tools/list":
+            result = {"tools": [{"name": name, "description": (tool.__doc__ or "").strip()}
+                                for name, tool in self.tools.items()]}
+            return None if is_notification else {"jsonrpc": "2.0", "id": request_id, "result": result}
+        if method != "tools/call":
+            return None if is_notification else self._jsonrpc_error(request_id, -32601, f"Method not found: {method}")
+        
+        tool = self.tools.get(params.get("name"))
+        if tool is None:
+            return None if is_notification else self._jsonrpc_error(request_id, -32601, f"Unknown tool: {params.get('name')}")
+        
+        arguments = params.get("arguments") or {}
+        try:
+            inspect.signature(tool).bind(**arguments)
+        except TypeError as e:
+            return None if is_notification else self._jsonrpc_error(request_id, -32602, f"Invalid params: {e}")
+        
+        timeout = self.config.tool_timeouts.get(params["name"], self.config.tool_timeout)
+        
+        async def timed_call():
+            # Completed and timed-out calls feed the limiter; fast rejections and errors do not
+            start_time = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(tool(**arguments), timeout)
+            except asyncio.TimeoutError:
+                self.concurrency_limiter.record(params["name"], time.perf_counter() - start_time)
+                raise
+            self.concurrency_limiter.record(params["name"], time.perf_counter() - start_time)
+            return result
+        
+        # Retries carry the same key in params._meta: attach to or replay the first execution
+        idempotency_key = (params.get("_meta") or {}).get("idempotency_key")
+        
+        try:
+            if idempotency_key:
+                result = await self.idempotency.run(
+                    idempotency_key,
+                    IdempotencyStore.fingerprint(params["name"], arguments),
+                    timed_call
+                )
+            else:
+                result = await timed_call()
+        except IdempotencyConflictError as e:
+            return None if is_notification else self._jsonrpc_error(request_id, -32004, str(e))
+        except BulkheadFullError as e:
+            # Fast reject: the caller should back off rather than queue behind the backlog
+            return None if is_notification else {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": -32001, "message": str(e), "data": {"retry_after": e.retry_after}}
+            }
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Tool {params['name']} timed out after {timeout}s")
+            return None if is_notification else self._jsonrpc_error(request_id, -32000, "Tool call timed out")
+        except Exception as e:
+            self.logger.error(f"Tool {params['name']} failed: {e}")
+            return None if is_notification else self._jsonrpc_error(request_id, -32603, f"Internal error: {e}")
+        
+        return None if is_notification else {"jsonrpc": "2.0", "id": request_id, "result": result}
+    
     def setup_health_endpoints(self):
         """Setup health check and metrics endpoints"""
         
@@ -303,6 +1099,7 @@ class MCPCustomerServiceServer:
                 "version": "1.0.0",
                 "uptime": time.time() - self.start_time,
                 "circuit_breaker_state": self.circuit_breaker.state,
+                "llm": self.llm_service.get_health_status() if self.llm_service else None,
                 "timestamp": datetime.now().isoformat()
             }
         
@@ -315,10 +1112,10 @@ class MCPCustomerServiceServer:
                     "state": self.circuit_breaker.state,
                     "failure_count": self.circuit_breaker.failure_count
                 },
-                "rate_limiting": {
-                    "max_requests_per_minute": self.config.max_requests_per_minute,
-                    "current_requests": sum(self.rate_limiter.request_counts.values())
-                },
+                "rate_limiting": self.rate_limiter.get_stats(),
+                "bulkheads": {name: bulkhead.get_stats() for name, bulkhead in self.bulkheads.items()},
+                "adaptive_concurrency": self.concurrency_limiter.get_stats(),
+                "idempotency": self.idempotency.get_stats(),
                 "timestamp": datetime.now().isoformat()
             }
         
@@ -328,22 +1125,51 @@ class MCPCustomerServiceServer:
             # Check if service is ready to handle requests
             if self.circuit_breaker.state == "OPEN":
                 raise HTTPException(status_code=503, detail="Service not ready - circuit breaker open")
+            if self.llm_service and not self.llm_service.is_ready():
+                raise HTTPException(status_code=503, detail="Service not ready - LLM warming up")
+            if self.concurrency_limiter.is_overloaded():
+                # Lets upstream balancers drain traffic to other replicas until load falls
+                raise HTTPException(status_code=503, detail="Service not ready - overloaded")
             
             return {"status": "ready", "timestamp": datetime.now().isoformat()}
     
+    @staticmethod
+    def _classify_query(query: str) -> str:
+        """Keyword category of a query: account, billing, technical or general"""
+        query_lower = query.lower()
+        if "password" in query_lower or "login" in query_lower:
+            return "account"
+        if "billing" in query_lower or "charge" in query_lower:
+            return "billing"
+        if "technical" in query_lower or "error" in query_lower or "crash" in query_lower:
+            return "technical"
+        return "general"
+    
     async def process_customer_query(self, query: str, customer_id: str, correlation_id: str) -> str:
         """Process customer query with enterprise patterns"""
+        category = self._classify_query(query)
         
-        # Simulate different types of responses based on query content
-        query_lower = query.lower()
+        if self.llm_service and self.llm_service.is_ready():
+            # Blocking HTTP call to the model: keep it on this tool's own thread pool
+            result = await self.bulkheads["handle_customer_query"].run_blocking(
+                self.llm_service.call_llm,
+                query,
+                correlation_id=correlation_id,
+                session_id=customer_id if customer_id != "unknown" else None,
+                routing_hints={"category": category}
+            )
+            if "response" in result:
+                return result["response"]
+            self.logger.warning(f"LLM call failed, using canned response: {result.get('error')}")
         
-        if "password" in query_lower or "login" in query_lower:
+        # Simulate different types of responses based on query content
+        if category == "account":
             return "To reset your password, please visit our self-service portal or use the 'Forgot Password' link on the login page. You'll receive a reset email within 5 minutes."
         
-        elif "billing" in query_lower or "charge" in query_lower:
+        elif category == "billing":
             return "I understand your billing concern. For billing inquiries, I recommend checking your account dashboard first. If you still need assistance, I can escalate this to our billing specialists."
         
-        elif "technical" in query_lower or "error" in query_lower or "crash" in query_lower:
+        elif category == "technical":
             return "I'm sorry you're experiencing technical difficulties. Let's troubleshoot: 1) Try refreshing the application, 2) Clear your browser cache, 3) Restart the app. If the problem persists, I'll connect you with technical support."
         
         else:
@@ -365,32 +1191,53 @@ class MCPCustomerServiceServer:
             (current_avg * (total_requests - 1) + response_time) / total_requests
         )
     
-    def register_with_service_registry(self):
-        """Register this service instance with the service registry"""
-        registration_data = {
+    def _registration(self) -> Dict[str, Any]:
+        return {
+            "instance_id": self.instance_id,
             "service_name": self.config.service_name,
             "host": self.config.host,
             "port": self.config.port,
             "health_check_url": f"http://{self.config.host}:{self.config.port}/health",
             "metrics_url": f"http://{self.config.host}:{self.config.port}/metrics",
             "capabilities": ["customer_query_handling", "escalation_management", "knowledge_search"],
+            "capacity": self.config.capacity,
+            "load": self.in_flight,
             "timestamp": datetime.now().isoformat()
         }
+    
+    def register_with_service_registry(self):
+        """Register this service instance with the service registry"""
+        registration_data = self._registration()
         
         # In production, this would register with actual service discovery system
+        self.registry.register(registration_data)
         self.logger.info(f"Service registered: {registration_data}")
+    
+    async def _heartbeat_loop(self, server: uvicorn.Server):
+        """Register once the server is accepting connections, then keep the entry alive"""
+        while not server.started:
+            await asyncio.sleep(0.1)
+        await asyncio.to_thread(self.register_with_service_registry)
         
-        # Save registration info for client discovery
-        Path("mcp_services").mkdir(exist_ok=True)
-        with open("mcp_services/active_services.json", "w") as f:
-            json.dump({"services": [registration_data]}, f, indent=2)
+        while True:
+            await asyncio.sleep(self.config.heartbeat_interval)
+            try:
+                await asyncio.to_thread(
+                    self.registry.heartbeat,
+                    self.instance_id,
+                    {"load": self.in_flight, "capacity": self.config.capacity},
+                    self._registration()
+                )
+            except Exception as e:
+                self.logger.error(f"Registry heartbeat failed: {e}")
     
     async def start_server(self):
         """Start the MCP server with enterprise configuration"""
         self.start_time = time.time()
         
-        # Register with service discovery
-        self.register_with_service_registry()
+        # Load models in the background; /ready reports 503 until they are warm
+        if self.llm_service:
+            self.llm_service.start_warmup()
         
         # Mount MCP application
         self.app.mount("/mcp", self.mcp.create_app())
@@ -406,23 +1253,40 @@ class MCPCustomerServiceServer:
         server = uvicorn.Server(config)
         
         self.logger.info(f"Starting MCP server on {self.config.host}:{self.config.port}")
-        await server.serve()
+        # Register with service discovery (after startup, so clients never probe a closed port)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop(server))
+        try:
+            await server.serve()
+        finally:
+            # Leave the registry on a clean shutdown; a crash ages out after registry_ttl
+            self._heartbeat_task.cancel()
+            for bulkhead in self.bulkheads.values():
+                bulkhead.shutdown()
+            self.registry.deregister(self.instance_id)
+            self.logger.info(f"Service deregistered: {self.instance_id}")
 
 def main():
     """Main function to start enterprise MCP customer service server"""
     print("=== TechCorp MCP Customer Service Server ===")
     print("Enterprise Features: Auth, Rate Limiting, Circuit Breakers, Monitoring")
     
-    # Get port from environment variable for multiple instances
-    port = int(os.environ.get("MCP_PORT", 8000))
-    
-    # Initialize server configuration
-    config = ServiceConfig(
+    # Settings from config/mcp_server_config.yaml; environment variables override
+    # them (MCP_PORT lets several instances share one config file)
+    overrides = {}
+    for env_name, field_name, cast in (("MCP_PORT", "port", int),
+                                       ("MCP_RATE_LIMIT_PER_MINUTE", "max_requests_per_minute", int),
+                                       ("MCP_RATE_LIMIT_BURST", "burst_limit", int),
+                                       ("MCP_RATE_LIMIT_BACKEND", "rate_limit_backend", str),
+                                       ("REDIS_URL", "rate_limit_redis_url", str)):
+        if env_name in os.environ:
+            overrides[field_name] = cast(os.environ[env_name])
+    config = ServiceConfig.from_config(
+        os.environ.get("MCP_SERVER_CONFIG", "config/mcp_server_config.yaml"),
         service_name="customer_service",
-        host="localhost",
-        port=port,
-        max_requests_per_minute=100
+        **overrides
     )
+    print(f"Rate limiting: {config.max_requests_per_minute}/min, burst {config.burst_limit} "
+          f"per client ({config.rate_limit_backend} backend)")
     
     # Create and start server
     server = MCPCustomerServiceServer(config)
@@ -9,15 +9,29 @@ import logging
 import time
 import uuid
 from datetime import datetime
-from typing import Dict, List, Any, Optional
-from dataclasses import dataclass
+import re
+import heapq
+import itertools
+import shutil
+import pickle
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import multiprocessing
+import atexit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Iterator, Tuple, Union
+from dataclasses import dataclass, field
 from pathlib import Path
 import yaml
 import hashlib
+import math
 
-# RAG and ML imports
-import chromadb
-from sentence_transformers import SentenceTransformer
+# RAG and ML imports (chromadb and sentence_transformers are imported lazily on first use)
 import numpy as np
 
 @dataclass
@@ -30,6 +44,7 @@ class DocumentMetadata:
     last_updated: str
     version: str
     chunk_id: str
+    token_count: int = 0
 
 @dataclass
 class SearchResult:
@@ -39,16 +54,141 @@ class SearchResult:
     metadata: DocumentMetadata
     citation: str
     access_granted: bool
+    additional_citations: List[str] = field(default_factory=list)
 
+class TokenCounter:
+    """Counts text units in embedding-model tokens (with a word-level fallback)"""
+    
+    def __init__(self, tokenizer=None, max_length: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        # [CLS]/[SEP] and friends count against the model window too
+        self.special_tokens = (tokenizer.num_special_tokens_to_add(pair=False)
+                               if hasattr(tokenizer, 'num_special_tokens_to_add') else 0)
+    
+    @property
+    def content_limit(self) -> Optional[int]:
+        """Largest chunk, in content tokens, the model embeds without truncation"""
+        if not self.max_length:
+            return None
+        return self.max_length - self.special_tokens
+        
+    def count(self, units: List[str]) -> List[int]:
+        """Return the token count for each text unit"""
+        counts = [0] * len(units)
+        
+        # Whitespace-only units never produce tokens
+        indexed = [(i, unit) for i, unit in enumerate(units) if unit.strip()]
+        if not indexed:
+            return counts
+        
+        if self.tokenizer is not None:
+            # Batch-encode so a whole line costs one tokenizer call
+            encoded = self.tokenizer(
+                [unit for _, unit in indexed], add_special_tokens=False
+            )["input_ids"]
+            for (i, _), ids in zip(indexed, encoded):
+                counts[i] = max(1, len(ids))
+        else:
+            # Approximate word-piece tokenization: words and punctuation
+            for i, unit in indexed:
+                counts[i] = max(1, len(re.findall(r"\w+|[^\w\s]", unit)))
+        
+        return counts
+
+class _TokenWindow:
+    """Sliding token window over one document section"""
+    
+    def __init__(self, heading: str, token_counter: TokenCounter, chunk_size: int, overlap: int):
+        self.heading = heading
+        self.token_counter = token_counter
+        self.overlap = overlap
+    
+        # Every chunk repeats the section heading for context
+        self.heading_tokens = sum(token_counter.count([heading])) if heading else 0
+        self.budget = max(1, chunk_size - self.heading_tokens)
+    
+        self.units = deque()  # (text, token_count)
+        self.tokens = 0
+        self.has_new_content = False
+    
+    def add_line(self, line: str) -> Iterator[Tuple[str, int]]:
+        """Add a line of section text, yielding any chunks that fill up"""
+        units = re.findall(r"\S+\s*|\s+", line)
+        for unit, count in zip(units, self.token_counter.count(units)):
+            if self.tokens + count > self.budget and self.has_new_content:
+                yield self._emit()
+                self._retain_overlap()
+    
+            self.units.append((unit, count))
+            self.tokens += count
+            if count:
+                self.has_new_content = True
+    
+    def flush(self) -> Iterator[Tuple[str, int]]:
+        """Emit the remaining text at a section boundary"""
+        if self.has_new_content:
+            yield self._emit()
+        self.units.clear()
+        self.tokens = 0
+        self.has_new_content = False
+    
+    def _emit(self) -> Tuple[str, int]:
+        body = "".join(unit for unit, _ in self.units).strip()
+        content = f"{self.heading}\n{body}" if self.heading else body
+        self.has_new_content = False
+        return content, self.heading_tokens + self.tokens
+    
+    def _retain_overlap(self):
+        """Keep the trailing units that fit in the overlap budget"""
+        retained = deque()
+        retained_tokens = 0
+        while self.units:
+            unit, count = self.units[-1]
+            if retained_tokens + count > self.overlap:
+                break
+            retained.appendleft(self.units.pop())
+            retained_tokens += count
+        self.units = retained
+        self.tokens = retained_tokens
+    
 class DocumentProcessor:
     """Enterprise document processing with validation and classification"""
     
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], token_counter: Optional[TokenCounter] = None):
         self.config = config
         self.logger = logging.getLogger("document_processor")
+        self.token_counter = token_counter or TokenCounter()
+        
+        processing_config = config.get('processing_config', {})
+        self.chunk_size = processing_config.get('chunk_size', 500)
+        self.chunk_overlap = processing_config.get('chunk_overlap', 50)
+        
+        # Chunks longer than the model window would be truncated at embedding time
+        content_limit = self.token_counter.content_limit
+        if content_limit and self.chunk_size > content_limit:
+            self.logger.warning(
+                f"chunk_size {self.chunk_size} exceeds model max length "
+                f"{self.token_counter.max_length} ({self.token_counter.special_tokens} special tokens "
+                f"reserved), capping to {content_limit}"
+            )
+            self.chunk_size = content_limit
+        
+        self.chunk_overlap = min(self.chunk_overlap, self.chunk_size // 2)
         
     def process_document(self, file_path: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Process document into chunks with enterprise metadata"""
+        return list(self.iter_chunks(file_path, metadata))
+    
+    def iter_chunks(self, file_path: str, metadata: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a document as token-bounded chunks
+        
+        The file is read line by line and split at heading boundaries; each
+        section is then cut with a sliding token window of ``chunk_size``
+        tokens overlapping by ``chunk_overlap``. Memory use is bounded by the
+        window size, not the document size.
+        """
         
         self.logger.info(f"Processing document: {file_path}")
         
@@ -56,64 +196,71 @@ class DocumentProcessor:
         if not self.validate_document(file_path, metadata):
             raise ValueError(f"Document validation failed: {file_path}")
         
-        # Read document content
+        title = ""
+        chunk_index = 0
+        heading = ""
+        window = None
+        
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+                for line in f:
+                    if line.startswith('# '):
+                        title = line[2:].strip()
+                        continue
+                    
+                    if line.startswith('## ') or line.startswith('### '):
+                        # Heading boundary: flush the previous section
+                        if window is not None:
+                            for content, token_count in window.flush():
+                                yield self._make_chunk(file_path, metadata, title, content,
+                                                       token_count, chunk_index)
+                                chunk_index += 1
+                        heading = line.strip()
+                        window = _TokenWindow(heading, self.token_counter,
+                                              self.chunk_size, self.chunk_overlap)
+                        continue
+                    
+                    if window is None:
+                        window = _TokenWindow("", self.token_counter,
+                                              self.chunk_size, self.chunk_overlap)
+                    
+                    for content, token_count in window.add_line(line):
+                        yield self._make_chunk(file_path, metadata, title, content,
+                                               token_count, chunk_index)
+                        chunk_index += 1
         except Exception as e:
             self.logger.error(f"Failed to read document {file_path}: {e}")
             raise
         
-        # Extract title and sections
-        lines = content.split('\n')
-        title = ""
-        sections = []
-        current_section = []
-        
-        for line in lines:
-            if line.startswith('# '):
-                title = line[2:].strip()
-            elif line.startswith('## ') or line.startswith('### '):
-                if current_section:
-                    sections.append('\n'.join(current_section))
-                    current_section = []
-                current_section.append(line)
-            else:
-                current_section.append(line)
-        
-        # Add final section
-        if current_section:
-            sections.append('\n'.join(current_section))
+        # Flush final section
+        if window is not None:
+            for content, token_count in window.flush():
+                yield self._make_chunk(file_path, metadata, title, content,
+                                       token_count, chunk_index)
+                chunk_index += 1
         
-        # Create chunks with enterprise metadata
-        chunks = []
-        chunk_size = self.config.get('processing_config', {}).get('chunk_size', 500)
-        
-        for i, section in enumerate(sections):
-            # Skip empty sections
-            if not section.strip():
-                continue
-            
-            # Create chunk with metadata
-            chunk_metadata = DocumentMetadata(
-                source_file=file_path,
-                classification=metadata.get('classification', 'internal'),
-                access_roles=metadata.get('access_roles', ['customer_service']),
-                department=metadata.get('department', 'unknown'),
-                last_updated=metadata.get('last_updated', datetime.now().isoformat()),
-                version=metadata.get('version', '1.0'),
-                chunk_id=f"{file_path}:chunk:{i}"
-            )
-            
-            chunks.append({
-                'content': section.strip(),
-                'metadata': chunk_metadata,
-                'document_title': title,
-                'chunk_index': i
-            })
+        self.logger.info(f"Created {chunk_index} chunks from {file_path}")
+    
+    def _make_chunk(self, file_path: str, metadata: Dict[str, Any], title: str,
+                    content: str, token_count: int, chunk_index: int) -> Dict[str, Any]:
+        """Create chunk with enterprise metadata"""
+        chunk_metadata = DocumentMetadata(
+            source_file=file_path,
+            classification=metadata.get('classification', 'internal'),
+            access_roles=metadata.get('access_roles', ['customer_service']),
+            department=metadata.get('department', 'unknown'),
+            last_updated=metadata.get('last_updated', datetime.now().isoformat()),
+            version=metadata.get('version', '1.0'),
+            chunk_id=f"{file_path}:chunk:{chunk_index}",
+            token_count=token_count
+        )
         
-        self.logger.info(f"Created {len(chunks)} chunks from {file_path}")
-        return chunks
+        return {
+            'content': content,
+            'metadata': chunk_metadata,
+            'document_title': title,
+            'chunk_index': chunk_index
+        }
     
     def validate_document(self, file_path: str, metadata: Dict[str, Any]) -> bool:
         """Validate document content and metadata"""
@@ -177,19 +324,29 @@ class AccessControlManager:
     
     def log_access(self, user_id: str, document_id: str, action: str, granted: bool):
         """Log access attempts for audit trail"""
+        self.log_access_batch([(user_id, document_id, action, granted)])
+    
+    def log_access_batch(self, attempts: List[Tuple[str, str, str, bool]]):
+        """Log many (user_id, document_id, action, granted) attempts with one file write"""
+        if not attempts:
+            return
         
-        access_log = {
-            "timestamp": datetime.now().isoformat(),
-            "user_id": user_id,
-            "document_id": document_id,
-            "action": action,
-            "access_granted": granted
-        }
+        timestamp = datetime.now().isoformat()
+        access_logs = [
+            json.dumps({
+                "timestamp": timestamp,
+                "user_id": user_id,
+                "document_id": document_id,
+                "action": action,
+                "access_granted": granted
+            }) + "\n"
+            for user_id, document_id, action, granted in attempts
+        ]
         
         # Write to access log
         Path("logs").mkdir(exist_ok=True)
         with open("logs/knowledge_access.log", "a") as f:
-            f.write(json.dumps(access_log) + "\n")
+            f.writelines(access_logs)
 
 class PerformanceMonitor:
     """Performance monitoring for RAG operations"""
@@ -246,317 +403,2458 @@ class PerformanceMonitor:
             "last_updated": datetime.now().isoformat()
         }
 
-class EnterpriseRAGService:
-    """
-    Enterprise RAG Service with:
-    - Document ingestion pipeline with validation
-    - Role-based access control
-    - Performance monitoring and optimization
-    - Citation tracking and governance
-    - Multi-modal document support
-    """
+# Largest Mersenne prime below 2^64, as used for MinHash universal hashing
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+class MinHasher:
+    """MinHash signatures over word shingles (picklable for worker processes)"""
     
-    def __init__(self, config_path: str = "knowledge_base/data_sources.yaml"):
-        self.config_path = config_path
-        self.config = self._load_config()
-        
-        # Initialize components
-        self.document_processor = DocumentProcessor(self.config)
-        self.access_control = AccessControlManager()
-        self.performance_monitor = PerformanceMonitor()
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.perm_a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.perm_b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
         
-        # Setup logging
-        self.setup_logging()
+    def signature(self, text: str) -> np.ndarray:
+        """Compute the MinHash signature of a chunk's normalized text"""
+        words = re.findall(r"\w+", text.lower())
+        size = self.shingle_size
+        if len(words) <= size:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
         
-        # Initialize vector database
-        self.vector_db = chromadb.PersistentClient(path="./chroma_db")
-        self.collection = self.vector_db.get_or_create_collection(
-            name="enterprise_knowledge",
-            metadata={"description": "TechCorp Enterprise Knowledge Base"}
+        # Stable 32-bit shingle hashes (built-in hash() is salted per process)
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'little')
+             for s in shingles],
+            dtype=np.uint64
         )
-        
-        # Initialize embedding model
-        self.embedding_model = SentenceTransformer(
-            self.config.get('processing_config', {}).get('embedding_model', 
-                                                        'sentence-transformers/all-MiniLM-L6-v2')
+        permuted = (np.outer(hashes, self.perm_a) + self.perm_b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+class NearDuplicateDetector:
+    """
+    MinHash/LSH index that finds near-duplicate chunks before embedding
+    
+    Only chunks with the same classification and access roles are compared,
+    so deduplication never changes who can see a piece of content. Each
+    duplicate is recorded as a back-reference on its canonical chunk so
+    citations can still list every source.
+    """
+    
+    def __init__(self, config: Dict[str, Any]):
+        dedup_config = config.get('processing_config', {}).get('deduplication', {})
+        self.enabled = dedup_config.get('enabled', True)
+        self.threshold = dedup_config.get('jaccard_threshold', 0.8)
+        self.index_path = Path(dedup_config.get('index_path', 'checkpoints/dedup_index.pkl'))
+        self.hasher = MinHasher(
+            num_perm=dedup_config.get('num_perm', 128),
+            shingle_size=dedup_config.get('shingle_size', 5)
         )
+        self.bands, self.rows = self._optimal_bands(self.hasher.num_perm, self.threshold)
+        self.logger = logging.getLogger("near_duplicate_detector")
         
-        self.logger.info("Enterprise RAG Service initialized")
+        # With a sharded index, duplicates never span shards so each rebuilds on its own
+        sharding_config = config.get('sharding', {})
+        self.partition_key = sharding_config.get('key', 'department') if sharding_config.get('enabled') else None
+        
+        self.buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(self.bands)]
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.access_keys: Dict[str, str] = {}
+        self.back_references: Dict[str, List[Dict[str, Any]]] = {}
+        self.stats = {
+            "chunks_checked": 0,
+            "duplicates_found": 0,
+            "bytes_saved": 0,
+            "tokens_saved": 0
+        }
+        
+    @staticmethod
+    def _optimal_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+        """Pick LSH bands x rows whose S-curve crosses closest to the threshold"""
+        best = (num_perm, 1)
+        best_error = float('inf')
+        for bands in range(1, num_perm + 1):
+            if num_perm % bands:
+                continue
+            rows = num_perm // bands
+            error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+            if error < best_error:
+                best, best_error = (bands, rows), error
+        return best
     
-    def _load_config(self) -> Dict[str, Any]:
-        """Load configuration from YAML file"""
-        try:
-            with open(self.config_path, 'r') as f:
-                return yaml.safe_load(f)
-        except FileNotFoundError:
-            self.logger.warning(f"Config file not found: {self.config_path}")
-            return {"data_sources": []}
+    def _access_key(self, metadata: DocumentMetadata) -> str:
+        access_key = f"{metadata.classification}|{','.join(sorted(metadata.access_roles))}"
+        if self.partition_key:
+            access_key += f"|{getattr(metadata, self.partition_key, '')}"
+        return access_key
     
-    def setup_logging(self):
-        """Setup structured logging for enterprise monitoring"""
-        # Create logs directory
-        Path("logs").mkdir(exist_ok=True)
+    def check(self, chunk: Dict[str, Any]) -> Optional[str]:
+        """
+        Index a chunk, returning its canonical chunk id if it is a near-duplicate
         
-        # Setup logger
-        self.logger = logging.getLogger("enterprise_rag")
-        self.logger.setLevel(logging.INFO)
+        The chunk's signature is taken from ``chunk['minhash']`` when a worker
+        already computed it.
+        """
+        metadata = chunk['metadata']
+        chunk_id = metadata.chunk_id
+        signature = chunk.get('minhash')
+        if signature is None:
+            signature = self.hasher.signature(chunk['content'])
         
-        # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        ))
+        self.stats["chunks_checked"] += 1
+        access_key = self._access_key(metadata)
+        band_keys = self._band_keys(access_key, signature)
         
-        # File handler
-        file_handler = logging.FileHandler('logs/rag_service.log')
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        ))
+        # Re-indexing a canonical chunk is not a duplicate of itself
+        if chunk_id not in self.signatures:
+            candidates = set()
+            for band, key in enumerate(band_keys):
+                candidates.update(self.buckets[band].get(key, ()))
+            
+            for candidate_id in candidates:
+                similarity = float(np.mean(self.signatures[candidate_id] == signature))
+                if similarity >= self.threshold:
+                    self._add_back_reference(candidate_id, chunk)
+                    return candidate_id
         
-        self.logger.addHandler(console_handler)
-        self.logger.addHandler(file_handler)
+        self._index(chunk_id, access_key, signature, band_keys)
+        return None
+    
+    def _band_keys(self, access_key: str, signature: np.ndarray) -> List[bytes]:
+        return [
+            hashlib.blake2b(
+                access_key.encode() + signature[b * self.rows:(b + 1) * self.rows].tobytes(),
+                digest_size=8
+            ).digest()
+            for b in range(self.bands)
+        ]
+    
+    def _index(self, chunk_id: str, access_key: str, signature: np.ndarray, band_keys: List[bytes]):
+        self.signatures[chunk_id] = signature
+        self.access_keys[chunk_id] = access_key
+        for band, key in enumerate(band_keys):
+            bucket = self.buckets[band].setdefault(key, [])
+            if chunk_id not in bucket:
+                bucket.append(chunk_id)
+    
+    def _add_back_reference(self, canonical_id: str, chunk: Dict[str, Any]):
+        metadata = chunk['metadata']
+        references = self.back_references.setdefault(canonical_id, [])
+        if any(ref['chunk_id'] == metadata.chunk_id for ref in references):
+            return
+        
+        references.append({
+            "chunk_id": metadata.chunk_id,
+            "source_file": metadata.source_file,
+            "department": metadata.department,
+            "last_updated": metadata.last_updated
+        })
+        self.stats["duplicates_found"] += 1
+        self.stats["bytes_saved"] += len(chunk['content'].encode('utf-8'))
+        self.stats["tokens_saved"] += metadata.token_count
     
-    def ingest_documents(self) -> Dict[str, Any]:
+    def forget_source(self, source_file: str) -> set:
         """
-        Ingest documents from configured sources
+        Drop a source's chunks and back-references before it is re-indexed
         
-        Enterprise features:
-        - Batch processing with progress tracking
-        - Validation and error handling
-        - Metadata preservation
-        - Access control setup
-        - Version tracking
+        Returns the other source files whose chunks were deduplicated against
+        the dropped ones; they must be re-indexed too so their content stays
+        searchable.
         """
+        prefix = f"{source_file}:chunk:"
+        dependents = set()
         
-        self.logger.info("Starting document ingestion pipeline")
+        for chunk_id in [chunk_id for chunk_id in self.signatures if chunk_id.startswith(prefix)]:
+            access_key = self.access_keys.pop(chunk_id, "")
+            signature = self.signatures.pop(chunk_id)
+            for band, key in enumerate(self._band_keys(access_key, signature)):
+                bucket = self.buckets[band].get(key)
+                if bucket and chunk_id in bucket:
+                    bucket.remove(chunk_id)
+                    if not bucket:
+                        del self.buckets[band][key]
+            dependents.update(ref['source_file'] for ref in self.back_references.pop(chunk_id, []))
+        
+        for canonical_id in list(self.back_references):
+            references = [ref for ref in self.back_references[canonical_id]
+                          if ref['source_file'] != source_file]
+            if references:
+                self.back_references[canonical_id] = references
+            else:
+                del self.back_references[canonical_id]
+        
+        dependents.discard(source_file)
+        return dependents
+    
+    def get_back_references(self, canonical_id: str) -> List[Dict[str, Any]]:
+        """Sources whose copies of this chunk were deduplicated away"""
+        return self.back_references.get(canonical_id, [])
+    
+    def get_report(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "canonical_chunks": len(self.signatures),
+            "lsh_bands": self.bands,
+            "lsh_rows": self.rows
+        }
+    
+    def save(self):
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                "num_perm": self.hasher.num_perm,
+                "signatures": self.signatures,
+                "access_keys": self.access_keys,
+                "back_references": self.back_references
+            }, f)
+        os.replace(tmp_path, self.index_path)
+    
+    def load(self):
+        """Restore the index from disk, rebuilding LSH buckets from signatures"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                state = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return
+        
+        if state.get("num_perm") != self.hasher.num_perm:
+            self.logger.warning("Dedup index built with different parameters, ignoring it")
+            return
+        
+        self.back_references = state.get("back_references", {})
+        self.buckets = [{} for _ in range(self.bands)]
+        access_keys = state.get("access_keys", {})
+        for chunk_id, signature in state.get("signatures", {}).items():
+            access_key = access_keys.get(chunk_id, "")
+            self._index(chunk_id, access_key, signature, self._band_keys(access_key, signature))
+
+def _parse_worker(document_processor: DocumentProcessor, doc_queue, chunk_queue, batch_size: int,
+                  hasher: Optional[MinHasher] = None, niceness: int = 0):
+    """Ingestion stage 1: read, chunk and MinHash documents in a worker process"""
+    
+    # Background rebuilds yield CPU to query serving
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+    
+    while True:
+        source = doc_queue.get()
+        if source is None:
+            chunk_queue.put(("worker_done", None))
+            return
+        
+        try:
+            batch = []
+            chunk_count = 0
+            for chunk in document_processor.iter_chunks(source['path'], source):
+                if hasher is not None:
+                    chunk['minhash'] = hasher.signature(chunk['content'])
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    chunk_queue.put(("chunks", batch))
+                    chunk_count += len(batch)
+                    batch = []
+            
+            if batch:
+                chunk_queue.put(("chunks", batch))
+                chunk_count += len(batch)
+            
+            chunk_queue.put(("document_done", {"source": source, "chunks": chunk_count}))
+            
+        except Exception as e:
+            chunk_queue.put(("document_failed", {"source": source, "error": str(e)}))
+
+class IngestionPipeline:
+    """
+    Staged ingestion pipeline with bounded queues for backpressure
+    
+    Stages:
+    1. Parse/chunk - pool of worker processes (also computes MinHash signatures)
+    2. Embed - single thread that drops near-duplicates, owns the embedding
+       model and batches encodes
+    3. Write - single thread doing bulk upserts and checkpointing
+    
+    Completed documents are checkpointed so an interrupted run resumes where it
+    stopped instead of starting over.
+    """
+    
+    def __init__(self,
+                 config: Dict[str, Any],
+                 document_processor: DocumentProcessor,
+                 embed_batch,
+                 write_batch,
+                 deduplicator: Optional[NearDuplicateDetector] = None,
+                 worker_niceness: int = 0,
+                 remove_stale_chunks=None):
+        self.document_processor = document_processor
+        # (path, chunk_count) -> drops a re-ingested document's chunks past its new length
+        self.remove_stale_chunks = remove_stale_chunks
+        self.worker_niceness = worker_niceness
+        self.embed_batch = embed_batch
+        self.write_batch = write_batch
+        self.deduplicator = deduplicator if deduplicator and deduplicator.enabled else None
+        self.logger = logging.getLogger("ingestion_pipeline")
+        
+        processing_config = config.get('processing_config', {})
+        self.num_workers = processing_config.get('ingest_workers') or max(1, (os.cpu_count() or 2) - 1)
+        self.parse_batch_size = processing_config.get('parse_batch_size', 64)
+        self.embedding_batch_size = processing_config.get('embedding_batch_size', 32)
+        self.queue_size = processing_config.get('queue_size', 32)
+        self.progress_interval = processing_config.get('progress_interval', 5.0)
+        self.worker_poll_interval = processing_config.get('worker_poll_interval', 1.0)
+        self.worker_join_timeout = processing_config.get('worker_join_timeout', 10.0)
+        self.checkpoint_path = Path(processing_config.get('checkpoint_path',
+                                                          'checkpoints/ingestion_checkpoint.json'))
+        
+        self.stats = {
+            "documents_done": 0,
+            "chunks_parsed": 0,
+            "chunks_embedded": 0,
+            "chunks_deduplicated": 0,
+            "chunks_written": 0,
+            "embedding_time": 0.0
+        }
+        
+    def run(self, sources: List[Dict[str, Any]], resume: bool = True) -> Dict[str, Any]:
+        """Run the pipeline over the given data sources"""
         
-        ingestion_results = {
-            "total_documents": 0,
+        start_time = time.time()
+        self.stats = dict.fromkeys(self.stats, 0)
+        results = {
+            "total_documents": len(sources),
             "processed_documents": 0,
+            "skipped_documents": 0,
             "failed_documents": 0,
             "total_chunks": 0,
             "errors": []
         }
         
-        data_sources = self.config.get('data_sources', [])
+        checkpoint = self._load_checkpoint() if resume else {}
+        pending = []
+        for source in sources:
+            entry = checkpoint.get(source['path'])
+            if entry and entry.get('fingerprint') == self._fingerprint(source['path']):
+                results["skipped_documents"] += 1
+                continue
+            pending.append(source)
         
-        for source in data_sources:
-            try:
-                self.logger.info(f"Processing data source: {source['name']}")
-                
-                # Process document
-                chunks = self.document_processor.process_document(
-                    source['path'], 
-                    source
-                )
-                
-                # Generate embeddings and store in vector database
-                for chunk in chunks:
-                    # Generate embedding
-                    embedding = self.embedding_model.encode(chunk['content'])
-                    
-                    # Store in vector database with metadata
-                    self.collection.add(
-                        embeddings=[embedding.tolist()],
-                        documents=[chunk['content']],
-                        metadatas=[{
-                            "source_file": chunk['metadata'].source_file,
-                            "classification": chunk['metadata'].classification,
-                            "access_roles": json.dumps(chunk['metadata'].access_roles),
-                            "department": chunk['metadata'].department,
-                            "last_updated": chunk['metadata'].last_updated,
-                            "chunk_id": chunk['metadata'].chunk_id,
-                            "document_title": chunk['document_title']
-                        }],
-                        ids=[chunk['metadata'].chunk_id]
-                    )
-                
-                ingestion_results["processed_documents"] += 1
-                ingestion_results["total_chunks"] += len(chunks)
-                
-            except Exception as e:
-                error_msg = f"Failed to process {source['name']}: {str(e)}"
-                self.logger.error(error_msg)
-                ingestion_results["failed_documents"] += 1
-                ingestion_results["errors"].append(error_msg)
+        if results["skipped_documents"]:
+            self.logger.info(f"Resuming from checkpoint: {results['skipped_documents']} documents already indexed")
         
-        ingestion_results["total_documents"] = len(data_sources)
+        if not pending:
+            return self._finish(results, start_time)
         
-        self.logger.info(f"Ingestion complete: {ingestion_results}")
-        return ingestion_results
+        ctx = multiprocessing.get_context()
+        doc_queue = ctx.Queue()
+        chunk_queue = ctx.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        
+        num_workers = min(self.num_workers, len(pending))
+        for source in pending:
+            doc_queue.put(source)
+        for _ in range(num_workers):
+            doc_queue.put(None)
+        
+        workers = [
+            ctx.Process(target=_parse_worker,
+                        args=(self.document_processor, doc_queue, chunk_queue, self.parse_batch_size,
+                              self.deduplicator.hasher if self.deduplicator else None,
+                              self.worker_niceness),
+                        daemon=True)
+            for _ in range(num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        
+        embed_thread = threading.Thread(target=self._embed_stage,
+                                        args=(chunk_queue, write_queue, workers), daemon=True)
+        write_thread = threading.Thread(target=self._write_stage,
+                                        args=(write_queue, checkpoint, results), daemon=True)
+        embed_thread.start()
+        write_thread.start()
+        
+        # Progress reporting until the writer drains
+        while write_thread.is_alive():
+            write_thread.join(timeout=self.progress_interval)
+            self._report_progress(start_time, chunk_queue, write_queue)
+        
+        embed_thread.join()
+        for worker in workers:
+            worker.join(timeout=self.worker_join_timeout)
+            if worker.is_alive():
+                # The embed stage failed and stopped reading, leaving the worker blocked on a full queue
+                self.logger.warning(f"Terminating stuck parse worker {worker.pid}")
+                worker.terminate()
+                worker.join()
+        # Whatever the workers never consumed or produced is abandoned
+        doc_queue.cancel_join_thread()
+        chunk_queue.cancel_join_thread()
+        
+        if self.deduplicator:
+            self.deduplicator.save()
+        
+        return self._finish(results, start_time)
     
-    def search_knowledge(self, 
-                        query: str, 
-                        user_role: str = "customer_service",
-                        max_results: int = 5,
-                        relevance_threshold: float = 0.7) -> List[SearchResult]:
-        """
-        Search knowledge base with enterprise controls
+    def _embed_stage(self, chunk_queue, write_queue: queue.Queue, workers: List[multiprocessing.Process]):
+        """Ingestion stage 2: batch chunks from all workers through the model"""
         
-        Features:
-        - Semantic and keyword search combination
-        - Role-based result filtering
-        - Citation generation
-        - Performance tracking
-        - Access logging
-        """
+        pending_chunks = []
+        pending_markers = []  # (chunks that must be embedded first, marker)
+        workers_done = 0
+        chunks_queued = 0
+        chunks_sent = 0
         
-        start_time = time.time()
-        query_id = str(uuid.uuid4())
+        def embed(batch):
+            nonlocal chunks_sent
+            embed_start = time.time()
+            embeddings = self.embed_batch([chunk['content'] for chunk in batch])
+            self.stats["embedding_time"] += time.time() - embed_start
+            self.stats["chunks_embedded"] += len(batch)
+            write_queue.put(("chunks", batch, embeddings))
+            chunks_sent += len(batch)
+            # A marker rides right behind the batch holding its document's last chunk,
+            # so documents are checkpointed as the run goes, not all at the final flush
+            while pending_markers and pending_markers[0][0] <= chunks_sent:
+                write_queue.put(pending_markers.pop(0)[1])
         
-        self.logger.info(f"Knowledge search query: {query[:100]}...", extra={
-            "query_id": query_id,
-            "user_role": user_role
-        })
+        def flush():
+            if pending_chunks:
+                embed(list(pending_chunks))
+                pending_chunks.clear()
+            for _, marker in pending_markers:
+                write_queue.put(marker)
+            pending_markers.clear()
         
         try:
-            # Generate query embedding
-            query_embedding = self.embedding_model.encode(query)
-            
-            # Search vector database
-            results = self.collection.query(
-                query_embeddings=[query_embedding.tolist()],
-                n_results=max_results * 2,  # Get more results for filtering
-                include=["documents", "metadatas", "distances"]
-            )
-            
-            # Process and filter results
-            search_results = []
-            
-            for i, (doc, metadata, distance) in enumerate(zip(
-                results['documents'][0],
-                results['metadatas'][0], 
-                results['distances'][0]
-            )):
-                # Convert distance to similarity score
-                relevance_score = 1.0 - distance
-                
-                # Skip results below threshold
-                if relevance_score < relevance_threshold:
+            while workers_done < len(workers):
+                try:
+                    kind, payload = chunk_queue.get(timeout=self.worker_poll_interval)
+                except queue.Empty:
+                    # A worker killed by OOM or a signal never sends worker_done
+                    if not any(worker.is_alive() for worker in workers):
+                        exit_codes = [worker.exitcode for worker in workers if worker.exitcode]
+                        flush()
+                        error = (f"{len(workers) - workers_done} parse worker(s) exited without "
+                                 f"finishing (exit codes {exit_codes})")
+                        self.logger.error(error)
+                        write_queue.put(("stage_failed", {"error": error}))
+                        return
                     continue
                 
-                # Create document metadata object
-                doc_metadata = DocumentMetadata(
-                    source_file=metadata['source_file'],
-                    classification=metadata['classification'],
-                    access_roles=json.loads(metadata['access_roles']),
-                    department=metadata['department'],
-                    last_updated=metadata['last_updated'],
-                    version="1.0",
-                    chunk_id=metadata['chunk_id']
-                )
-                
-                # Check access control
-                access_granted = self.access_control.check_access(
-                    user_role,
-                    doc_metadata.classification,
-                    doc_metadata.access_roles
-                )
-                
-                if access_granted:
-                    # Create citation
-                    citation = self._create_citation(doc_metadata, doc)
-                    
-                    # Create search result
-                    search_result = SearchResult(
-                        content=doc,
-                        relevance_score=relevance_score,
-                        metadata=doc_metadata,
-                        citation=citation,
-                        access_granted=True
-                    )
-                    
-                    search_results.append(search_result)
-                    
-                    # Log citation usage
-                    self._log_citation_usage(user_role, query_id, citation)
-                
-                # Log access attempt
-                self.access_control.log_access(
-                    user_role, 
-                    metadata['chunk_id'], 
-                    "search", 
-                    access_granted
-                )
-                
-                # Limit results
-                if len(search_results) >= max_results:
-                    break
-            
-            # Track performance metrics
-            response_time = time.time() - start_time
-            relevance_scores = [r.relevance_score for r in search_results]
-            self.performance_monitor.track_query(query, response_time, len(search_results), relevance_scores)
-            
-            self.logger.info(f"Search completed: {len(search_results)} results", extra={
-                "query_id": query_id,
-                "response_time": response_time,
-                "results_count": len(search_results)
-            })
-            
-            return search_results
+                if kind == "chunks":
+                    self.stats["chunks_parsed"] += len(payload)
+                    if self.deduplicator:
+                        unique = [chunk for chunk in payload if self.deduplicator.check(chunk) is None]
+                        self.stats["chunks_deduplicated"] += len(payload) - len(unique)
+                        payload = unique
+                    pending_chunks.extend(payload)
+                    chunks_queued += len(payload)
+                    while len(pending_chunks) >= self.embedding_batch_size:
+                        batch = pending_chunks[:self.embedding_batch_size]
+                        del pending_chunks[:self.embedding_batch_size]
+                        embed(batch)
+                elif kind == "worker_done":
+                    workers_done += 1
+                elif chunks_queued <= chunks_sent:
+                    write_queue.put((kind, payload))
+                else:
+                    pending_markers.append((chunks_queued, (kind, payload)))
             
+            flush()
         except Exception as e:
-            self.logger.error(f"Search failed: {str(e)}", extra={"query_id": query_id})
-            return []
-    
-    def _create_citation(self, metadata: DocumentMetadata, chunk_content: str) -> str:
-        """Create proper citation for search result"""
-        # Create standardized citation format
-        source_name = Path(metadata.source_file).stem
-        return f"{source_name}:{metadata.department}:{metadata.last_updated[:10]}"
+            self.logger.error(f"Embedding stage failed: {e}")
+            write_queue.put(("stage_failed", {"error": str(e)}))
+        finally:
+            write_queue.put(None)
     
-    def _log_citation_usage(self, user_role: str, query_id: str, citation: str):
-        """Log citation usage for compliance tracking"""
-        citation_log = {
-            "timestamp": datetime.now().isoformat(),
-            "query_id": query_id,
-            "user_role": user_role,
-            "citation": citation,
-            "action": "citation_generated"
-        }
+    def _write_stage(self, write_queue: queue.Queue, checkpoint: Dict[str, Any], results: Dict[str, Any]):
+        """Ingestion stage 3: bulk-write embeddings and checkpoint finished documents"""
         
-        Path("logs").mkdir(exist_ok=True)
-        with open("logs/citation_tracking.log", "a") as f:
-            f.write(json.dumps(citation_log) + "\n")
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            
+            kind = item[0]
+            try:
+                if kind == "chunks":
+                    _, chunks, embeddings = item
+                    self.write_batch(chunks, embeddings)
+                    self.stats["chunks_written"] += len(chunks)
+                    
+                elif kind == "document_done":
+                    source = item[1]["source"]
+                    if self.remove_stale_chunks:
+                        self.remove_stale_chunks(source['path'], item[1]["chunks"])
+                    checkpoint[source['path']] = {
+                        "fingerprint": self._fingerprint(source['path']),
+                        "chunks": item[1]["chunks"],
+                        "completed_at": datetime.now().isoformat()
+                    }
+                    self._save_checkpoint(checkpoint)
+                    self.stats["documents_done"] += 1
+                    results["processed_documents"] += 1
+                    results["total_chunks"] += item[1]["chunks"]
+                    
+                elif kind == "document_failed":
+                    error_msg = f"Failed to process {item[1]['source']['name']}: {item[1]['error']}"
+                    self.logger.error(error_msg)
+                    results["failed_documents"] += 1
+                    results["errors"].append(error_msg)
+                    
+                elif kind == "stage_failed":
+                    results["errors"].append(f"Embedding stage failed: {item[1]['error']}")
+                    
+            except Exception as e:
+                # A failed write leaves its document un-checkpointed for the next run
+                error_msg = f"Bulk write failed: {e}"
+                self.logger.error(error_msg)
+                results["errors"].append(error_msg)
     
-    def get_health_status(self) -> Dict[str, Any]:
-        """Get service health and performance status"""
-        
-        # Check vector database health
+    def _report_progress(self, start_time: float, chunk_queue, write_queue: queue.Queue):
+        """Log throughput and queue depths"""
+        elapsed = max(time.time() - start_time, 1e-6)
         try:
-            collection_count = self.collection.count()
-            db_healthy = True
-        except Exception as e:
-            collection_count = 0
-            db_healthy = False
+            chunk_depth = chunk_queue.qsize()
+        except NotImplementedError:  # macOS
+            chunk_depth = -1
         
-        # Get performance metrics
-        performance_metrics = self.performance_monitor.get_metrics()
+        self.logger.info(
+            f"Ingestion progress: {self.stats['documents_done']} documents, "
+            f"{self.stats['chunks_written']} chunks written "
+            f"({self.stats['chunks_written'] / elapsed:.1f} chunks/s), "
+            f"queue depths parse->embed={chunk_depth} embed->write={write_queue.qsize()}"
+        )
+    
+    def _finish(self, results: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        elapsed = time.time() - start_time
+        results["elapsed_time"] = elapsed
+        results["chunks_per_second"] = results["total_chunks"] / elapsed if elapsed > 0 else 0.0
         
-        # Save performance metrics to file
-        Path("metrics").mkdir(exist_ok=True)
-        with open("metrics/rag_performance.json", "w") as f:
-            json.dump(performance_metrics, f, indent=2)
+        if self.deduplicator:
+            # Estimate time saved from the measured per-chunk embedding cost
+            per_chunk = self.stats["embedding_time"] / max(self.stats["chunks_embedded"], 1)
+            results["deduplication"] = {
+                **self.deduplicator.get_report(),
+                "duplicates_this_run": self.stats["chunks_deduplicated"],
+                "embedding_time_avoided": per_chunk * self.stats["chunks_deduplicated"]
+            }
+        return results
+    
+    def _fingerprint(self, path: str) -> str:
+        """Cheap change detection from file size and mtime"""
+        try:
+            stat = os.stat(path)
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            return ""
+    
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                return json.load(f).get("documents", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]):
+        """Write checkpoint atomically so a crash never leaves it half-written"""
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"documents": checkpoint, "last_updated": datetime.now().isoformat()}, f, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+    
+    def reset_checkpoint(self):
+        """Forget all completed documents so the next run re-indexes everything"""
+        if self.checkpoint_path.exists():
+            self.checkpoint_path.unlink()
+    
+    def record_documents(self, chunk_counts: Dict[str, int]):
+        """Checkpoint documents indexed outside the pipeline"""
+        if not chunk_counts:
+            return
+        checkpoint = self._load_checkpoint()
+        for path, chunks in chunk_counts.items():
+            checkpoint[path] = {
+                "fingerprint": self._fingerprint(path),
+                "chunks": chunks,
+                "completed_at": datetime.now().isoformat()
+            }
+        self._save_checkpoint(checkpoint)
+    
+    def forget_documents(self, paths: List[str]):
+        """Remove documents from the checkpoint so the next run re-indexes them"""
+        checkpoint = self._load_checkpoint()
+        removed = [path for path in paths if checkpoint.pop(path, None) is not None]
+        if removed:
+            self._save_checkpoint(checkpoint)
+    
+    def stale_documents(self, sources: List[Dict[str, Any]]) -> List[str]:
+        """Paths whose files changed since they were last checkpointed"""
+        checkpoint = self._load_checkpoint()
+        return [
+            source['path'] for source in sources
+            if checkpoint.get(source['path'], {}).get('fingerprint') != self._fingerprint(source['path'])
+        ]
+
+class IndexSnapshot:
+    """
+    Compact single-file snapshot of the vector index
+    
+    Layout: magic, header length, JSON header (ids, documents, metadatas),
+    padding to a 64-byte boundary, the float32 embedding matrix and its
+    squared row norms. Loading is one sequential read, or an mmap so pages
+    fault in on demand and are shared between processes.
+    """
+    
+    MAGIC = b"TCRAGSN1"
+    ALIGNMENT = 64
+    
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+                 embeddings: np.ndarray, norms: np.ndarray):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.norms = norms
+        
+    @classmethod
+    def write(cls, path: str, ids: List[str], documents: List[str],
+              metadatas: List[Dict[str, Any]], embeddings) -> int:
+        """Write a snapshot atomically, returning its size in bytes"""
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(ids), -1)
+        norms = np.einsum('ij,ij->i', matrix, matrix).astype(np.float32)
+        
+        header = json.dumps({
+            "version": 1,
+            "count": len(ids),
+            "dim": int(matrix.shape[1]) if len(ids) else 0,
+            "ids": ids,
+            "documents": documents,
+            "metadatas": metadatas,
+            "created_at": datetime.now().isoformat()
+        }).encode('utf-8')
+        prefix_length = len(cls.MAGIC) + 8 + len(header)
+        padding = -prefix_length % cls.ALIGNMENT
+        
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_suffix(target.suffix + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            f.write(b"\0" * padding)
+            f.write(matrix.tobytes())
+            f.write(norms.tobytes())
+        os.replace(tmp_path, target)
+        return target.stat().st_size
+    
+    @classmethod
+    def load(cls, path: str, use_mmap: bool = True) -> "IndexSnapshot":
+        """Load a snapshot with one sequential read (or mmap for the matrix)"""
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"Not an index snapshot: {path}")
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length))
+            offset = len(cls.MAGIC) + 8 + header_length
+            offset += -offset % cls.ALIGNMENT
+            
+            count, dim = header["count"], header["dim"]
+            if use_mmap and count:
+                data = np.memmap(path, dtype=np.float32, mode='r', offset=offset,
+                                 shape=(count * dim + count,))
+            else:
+                f.seek(offset)
+                data = np.fromfile(f, dtype=np.float32, count=count * dim + count)
+        
+        embeddings = data[:count * dim].reshape(count, dim)
+        norms = data[count * dim:]
+        return cls(header["ids"], header["documents"], header["metadatas"], embeddings, norms)
+    
+    def count(self) -> int:
+        return len(self.ids)
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int) -> Dict[str, List[List[Any]]]:
+        """Brute-force squared-L2 search returning ChromaDB-shaped results"""
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if not self.ids:
+            for key in results:
+                results[key] = [[] for _ in query_embeddings]
+            return results
+        
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2, same metric as the default Chroma space
+        distances = (self.norms[None, :] - 2.0 * queries @ self.embeddings.T
+                     + np.einsum('ij,ij->i', queries, queries)[:, None])
+        
+        k = min(n_results, len(self.ids))
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k]
+            top = top[np.argsort(row[top])]
+            results["ids"].append([self.ids[i] for i in top])
+            results["documents"].append([self.documents[i] for i in top])
+            results["metadatas"].append([self.metadatas[i] for i in top])
+            results["distances"].append([float(row[i]) for i in top])
+        return results
+
+class ShardedCollection:
+    """
+    A logical collection split into one ChromaDB collection per value of a
+    metadata key (department or classification)
+    
+    Exposes the subset of the collection API the service uses, so ingestion,
+    snapshots and incremental updates work unchanged. Queries fan out
+    concurrently to the requested shards and the per-shard rankings are
+    merged with a k-way heap. A manifest next to the database records each
+    shard's collection and the access keys of its chunks, so searches can
+    skip shards the caller could never see.
+    """
+    
+    # Same defaults DocumentProcessor applies when a source omits the field
+    SHARD_DEFAULTS = {'department': 'unknown', 'classification': 'internal'}
+    
+    def __init__(self, client, name: str, key: str, manifest_path: Path, max_workers: int = 8):
+        self.client = client
+        self.name = name
+        self.key = key
+        self.manifest_path = manifest_path
+        self.logger = logging.getLogger("sharded_collection")
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"shards-{name[:16]}")
+        
+        self.manifest = {"key": key, "shards": {}}
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+            # A generation keeps the key it was built with
+            self.key = self.manifest["key"]
+        self.shards = {
+            value: client.get_or_create_collection(name=shard["collection"])
+            for value, shard in self.manifest["shards"].items()
+        }
+    
+    @classmethod
+    def shard_of_source(cls, source: Dict[str, Any], key: str) -> str:
+        return str(source.get(key, cls.SHARD_DEFAULTS.get(key, 'unknown')))
+    
+    def _save_manifest(self):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+    
+    def create_shard_collection(self, value: str):
+        """A new, empty collection for a shard (not yet visible to queries)"""
+        # Collection names are opaque and short; the manifest maps them to shard values
+        digest = hashlib.blake2b(f"{self.name}|{value}|{uuid.uuid4()}".encode(), digest_size=6).hexdigest()
+        return self.client.get_or_create_collection(
+            name=f"{self.name[:32]}_{digest}",
+            metadata={"description": "TechCorp Enterprise Knowledge Base", "shard": value}
+        )
+    
+    def _shard(self, value: str):
+        with self._lock:
+            if value not in self.shards:
+                collection = self.create_shard_collection(value)
+                self.shards[value] = collection
+                self.manifest["shards"][value] = {"collection": collection.name, "access_keys": []}
+                self._save_manifest()
+            return self.shards[value]
+    
+    def swap_shard(self, value: str, collection, access_keys: List[str]):
+        """Point a shard at a rebuilt collection and drop the old one"""
+        with self._lock:
+            old = self.shards.get(value)
+            self.shards[value] = collection
+            self.manifest["shards"][value] = {"collection": collection.name, "access_keys": sorted(access_keys)}
+            self._save_manifest()
+        if old is not None and old.name != collection.name:
+            self.client.delete_collection(old.name)
+    
+    def visible_shards(self, user_role: str, access_control: "AccessControlManager",
+                       departments: Optional[List[str]] = None) -> List[str]:
+        """Shards holding at least one chunk the role may read, optionally limited to departments"""
+        visible = []
+        for value, shard in self.manifest["shards"].items():
+            if departments is not None and self.key == 'department' and value not in departments:
+                continue
+            for access_key in shard["access_keys"]:
+                classification, roles = access_key.split("|", 1)
+                if access_control.check_access(user_role, classification, roles.split(",")):
+                    visible.append(value)
+                    break
+        return visible
+    
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict[str, Any]]):
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(str(metadata.get(self.key, self.SHARD_DEFAULTS.get(self.key, 'unknown'))), []).append(i)
+        
+        for value, rows in groups.items():
+            collection = self._shard(value)
+            collection.upsert(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                documents=[documents[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows]
+            )
+            self._record_access_keys(value, {
+                f"{metadatas[i]['classification']}|{','.join(sorted(json.loads(metadatas[i]['access_roles'])))}"
+                for i in rows
+            })
+    
+    def _record_access_keys(self, value: str, access_keys: set):
+        with self._lock:
+            known = self.manifest["shards"][value]["access_keys"]
+            new = access_keys - set(known)
+            if new:
+                known.extend(sorted(new))
+                self._save_manifest()
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int,
+              include: Optional[List[str]] = None, shards: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Fan out to the given shards (default all) and merge the nearest results"""
+        targets = [self.shards[value] for value in (self.shards if shards is None else shards)
+                   if value in self.shards]
+        merged = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if not targets:
+            for field_name in merged:
+                merged[field_name] = [[] for _ in query_embeddings]
+            return merged
+        
+        def query_shard(collection):
+            try:
+                return collection.query(query_embeddings=query_embeddings, n_results=n_results,
+                                        include=["documents", "metadatas", "distances"])
+            except Exception as e:
+                # A shard being swapped out by a rebuild just contributes nothing
+                self.logger.warning(f"Shard query failed on {collection.name}: {e}")
+                return None
+        
+        if len(targets) == 1:
+            shard_results = [query_shard(targets[0])]
+        else:
+            shard_results = list(self._executor.map(query_shard, targets))
+        shard_results = [result for result in shard_results if result is not None]
+        
+        for row in range(len(query_embeddings)):
+            # Each shard's list is already sorted by distance: k-way merge, stop at n_results
+            ranked = heapq.merge(*[
+                zip(result['distances'][row], result['ids'][row],
+                    result['documents'][row], result['metadatas'][row])
+                for result in shard_results
+            ], key=lambda hit: hit[0])
+            top = list(itertools.islice(ranked, n_results))
+            merged["distances"].append([hit[0] for hit in top])
+            merged["ids"].append([hit[1] for hit in top])
+            merged["documents"].append([hit[2] for hit in top])
+            merged["metadatas"].append([hit[3] for hit in top])
+        return merged
+    
+    def get(self, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None,
+            limit: Optional[int] = None, offset: int = 0) -> Dict[str, Any]:
+        """Page through shards in a stable order as if they were one collection"""
+        include = ["documents", "metadatas"] if include is None else include
+        page = {"ids": [], **{field_name: [] for field_name in include}}
+        remaining = limit
+        
+        for value in sorted(self.shards):
+            collection = self.shards[value]
+            if where is None:
+                size = collection.count()
+                if offset >= size:
+                    offset -= size
+                    continue
+            shard_page = collection.get(where=where, include=include, limit=remaining, offset=offset)
+            offset = 0
+            page["ids"].extend(shard_page["ids"])
+            for field_name in include:
+                page[field_name].extend(shard_page[field_name])
+            if remaining is not None:
+                remaining -= len(shard_page["ids"])
+                if remaining <= 0:
+                    break
+        return page
+    
+    def delete(self, ids: List[str]):
+        for collection in list(self.shards.values()):
+            collection.delete(ids=ids)
+    
+    def count(self) -> int:
+        return sum(collection.count() for collection in list(self.shards.values()))
+    
+    def shard_counts(self) -> Dict[str, int]:
+        return {value: collection.count() for value, collection in sorted(self.shards.items())}
+    
+    def drop(self):
+        """Delete every shard collection and the manifest"""
+        self._executor.shutdown(wait=False)
+        for collection in self.shards.values():
+            self.client.delete_collection(collection.name)
+        if self.manifest_path.exists():
+            self.manifest_path.unlink()
+
+class IndexGeneration:
+    """
+    One build of the vector index: a ChromaDB collection plus its optional
+    snapshot and dedup index
+    
+    Queries hold a reference while they run, so swapping in a new generation
+    never pulls the index out from under an in-flight query.
+    """
+    
+    def __init__(self, name: str, collection, deduplicator: NearDuplicateDetector,
+                 snapshot: Optional[IndexSnapshot] = None):
+        self.name = name
+        self.collection = collection
+        self.deduplicator = deduplicator
+        self.snapshot = snapshot
+        self.active_queries = 0
+        
+    def query(self, query_embeddings: List[List[float]], n_results: int,
+              shards: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Query the snapshot when available, otherwise the collection (or the given shards)"""
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return snapshot.query(query_embeddings, n_results)
+        
+        if shards is not None and isinstance(self.collection, ShardedCollection):
+            return self.collection.query(query_embeddings, n_results, shards=shards)
+        
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"]
+        )
+    
+    def visible_shards(self, user_roles: List[str], access_control: AccessControlManager,
+                       departments: Optional[List[str]] = None) -> Optional[List[str]]:
+        """Shards any of the roles may see, or None when every query scans the whole index"""
+        if self.snapshot is not None or not isinstance(self.collection, ShardedCollection):
+            return None
+        visible = set()
+        for user_role in user_roles:
+            visible.update(self.collection.visible_shards(user_role, access_control, departments))
+        return sorted(visible)
+    
+    def count(self) -> int:
+        snapshot = self.snapshot
+        return snapshot.count() if snapshot is not None else self.collection.count()
+
+@dataclass
+class PackedContext:
+    """Knowledge context selected for a prompt"""
+    text: str
+    citations: List[str]
+    passages: List[Tuple[str, str]]
+    tokens: int
+    budget: int
+    candidate_sentences: int
+    duplicates_dropped: int
+
+class ContextPacker:
+    """
+    Packs ranked retrieval results into a prompt token budget
+    
+    Results are split into whole sentences (or list items), exact and
+    near-duplicate sentences are dropped, and sentences are picked by
+    maximal marginal relevance: relevance to the query, penalized by
+    overlap with what is already selected. Selected sentences are emitted
+    grouped by source, in document order, with the citations actually used.
+    
+    Sentence relevance is lexical overlap with the query weighted by the
+    result's retrieval score, which keeps packing around a millisecond.
+    Results that carry the token count stored at ingestion have it split
+    across their sentences by length instead of being re-tokenized.
+    Sentences sharing no terms with the query are kept only from the top
+    result, where they usually carry the surrounding context.
+    """
+    
+    SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+    LIST_MARKER = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+", re.MULTILINE)
+    STOPWORDS = frozenset(
+        "a an and are as at be by can do does for from how i in is it my of on or our "
+        "the this to we what when where which who why with you your".split()
+    )
+    
+    def __init__(self,
+                 context_window: int = 2048,
+                 max_tokens: int = 150,
+                 max_context_tokens: int = 512,
+                 mmr_lambda: float = 0.7,
+                 duplicate_threshold: float = 0.8,
+                 token_counter: Optional[TokenCounter] = None):
+        self.context_window = context_window
+        self.max_tokens = max_tokens
+        self.max_context_tokens = max_context_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.token_counter = token_counter or TokenCounter()
+    
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ContextPacker":
+        packing_config = config.get('context_packing', {})
+        return cls(
+            context_window=packing_config.get('context_window', 2048),
+            max_tokens=packing_config.get('max_tokens', 150),
+            max_context_tokens=packing_config.get('max_context_tokens', 512),
+            mmr_lambda=packing_config.get('mmr_lambda', 0.7),
+            duplicate_threshold=packing_config.get('duplicate_threshold', 0.8)
+        )
+    
+    def budget(self, prompt_overhead_tokens: int = 0) -> int:
+        """Context tokens left after the prompt template and the generated answer"""
+        available = self.context_window - self.max_tokens - prompt_overhead_tokens
+        return max(0, min(self.max_context_tokens, available))
+    
+    def count_tokens(self, text: str) -> int:
+        return sum(self.token_counter.count([text]))
+    
+    def _terms(self, text: str) -> set:
+        # Crude plural folding so "refunds" matches "refund"
+        return {word[:-1] if len(word) > 3 and word.endswith("s") else word
+                for word in re.findall(r"\w+", text.lower()) if word not in self.STOPWORDS}
+    
+    @staticmethod
+    def _similarity(a: set, b: set) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+    
+    @staticmethod
+    def _unpack_result(result) -> Tuple[str, str, float, int]:
+        """Accept SearchResult objects or {'content', 'source', 'relevance', 'token_count'} dicts"""
+        if isinstance(result, dict):
+            return (result.get('content', ''), result.get('source', ''), result.get('relevance', 1.0),
+                    result.get('token_count', 0))
+        return result.content, result.citation, result.relevance_score, result.metadata.token_count
+    
+    def pack(self, query: str, results: List[Any], budget_tokens: Optional[int] = None,
+             prompt_overhead_tokens: int = 0) -> PackedContext:
+        """Select whole sentences from ranked ``results`` into the token budget"""
+        budget = self.budget(prompt_overhead_tokens) if budget_tokens is None else budget_tokens
+        query_terms = self._terms(query)
+        
+        # Candidate sentences: (rank, position, citation, text, terms, relevance)
+        candidates = []
+        stored_counts = []  # per candidate, None when the result has no stored token count
+        seen = set()
+        duplicates = 0
+        for rank, result in enumerate(results):
+            content, citation, score, token_count = self._unpack_result(result)
+            for position, sentence in enumerate(self.SENTENCE_SPLIT.split(self.LIST_MARKER.sub("", content))):
+                sentence = sentence.strip()
+                # Chunks already open with their heading; headings alone answer nothing
+                if sentence.startswith("#"):
+                    continue
+                terms = self._terms(sentence)
+                if not terms:
+                    continue
+                # List items become sentences so passages read cleanly when joined
+                if sentence[-1] not in ".!?:;":
+                    sentence += "."
+                normalized = " ".join(re.findall(r"\w+", sentence.lower()))
+                if normalized in seen:
+                    duplicates += 1
+                    continue
+                seen.add(normalized)
+                overlap = len(terms & query_terms) / len(query_terms) if query_terms else 0.0
+                # Off-topic sentences are only worth their tokens from the best-ranked result
+                if overlap == 0.0 and rank > 0 and query_terms:
+                    continue
+                relevance = max(score, 0.0) * (0.5 + 0.5 * overlap)
+                candidates.append((rank, position, citation, sentence, terms, relevance))
+                stored_counts.append(math.ceil(token_count * len(sentence) / len(content))
+                                     if token_count else None)
+        
+        unknown = [index for index, count in enumerate(stored_counts) if count is None]
+        token_counts = list(stored_counts)
+        for index, count in zip(unknown, self.token_counter.count([candidates[index][3] for index in unknown])):
+            token_counts[index] = count
+        
+        # Greedy MMR under the token budget; redundancy is each candidate's
+        # highest similarity to anything already selected
+        selected = []
+        used_tokens = 0
+        redundancy = [0.0] * len(candidates)
+        remaining = set(range(len(candidates)))
+        while remaining:
+            best, best_score = None, float('-inf')
+            for index in remaining:
+                if used_tokens + token_counts[index] > budget or redundancy[index] >= self.duplicate_threshold:
+                    continue
+                mmr = self.mmr_lambda * candidates[index][5] - (1 - self.mmr_lambda) * redundancy[index]
+                if mmr > best_score:
+                    best, best_score = index, mmr
+            if best is None:
+                break
+            selected.append(best)
+            used_tokens += token_counts[best]
+            remaining.discard(best)
+            for index in remaining:
+                redundancy[index] = max(redundancy[index],
+                                        self._similarity(candidates[index][4], candidates[best][4]))
+        
+        duplicates += sum(1 for index in remaining if redundancy[index] >= self.duplicate_threshold)
+        
+        # Emit by source in retrieval order, sentences in document order
+        by_source: Dict[str, List[Tuple[int, int, str]]] = {}
+        for index in selected:
+            rank, position, citation, sentence, _, _ = candidates[index]
+            by_source.setdefault(citation, []).append((rank, position, sentence))
+        ordered_sources = sorted(by_source, key=lambda citation: min(item[:2] for item in by_source[citation]))
+        passages = [
+            (citation, " ".join(sentence for _, _, sentence in sorted(by_source[citation])))
+            for citation in ordered_sources
+        ]
+        text = "\n".join(f"[{number}] {passage} ({citation})"
+                         for number, (citation, passage) in enumerate(passages, 1))
+        
+        return PackedContext(
+            text=text,
+            citations=[citation for citation, _ in passages],
+            passages=passages,
+            tokens=used_tokens,
+            budget=budget,
+            candidate_sentences=len(candidates),
+            duplicates_dropped=duplicates
+        )
+
+class EnterpriseRAGService:
+    """
+    Enterprise RAG Service with:
+    - Document ingestion pipeline with validation
+    - Role-based access control
+    - Performance monitoring and optimization
+    - Citation tracking and governance
+    - Multi-modal document support
+    """
+    
+    # Process-wide registry so agents in one process share one service
+    _shared_instances: Dict[str, "EnterpriseRAGService"] = {}
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, config_path: str = "knowledge_base/data_sources.yaml"):
+        init_start = time.time()
+        self.config_path = config_path
+        self.config = self._load_config()
+        
+        # Initialize components
+        self.access_control = AccessControlManager()
+        self.performance_monitor = PerformanceMonitor()
+        self.context_packer = ContextPacker.from_config(self.config)
+        
+        # Setup logging
+        self.setup_logging()
+        
+        # Heavy components (embedding model, vector database, index) load on first use
+        self._init_lock = threading.RLock()
+        self._embedding_model = None
+        self._document_processor = None
+        self._vector_db = None
+        
+        snapshot_config = self.config.get('index_snapshot', {})
+        self.snapshot_enabled = snapshot_config.get('enabled', False)
+        self.snapshot_path = snapshot_config.get('path', 'snapshots/enterprise_knowledge.snap')
+        self.snapshot_use_mmap = snapshot_config.get('use_mmap', True)
+        
+        # Blue/green index generations behind an atomic pointer file
+        generations_config = self.config.get('index_generations', {})
+        self.base_collection_name = generations_config.get('base_name', 'enterprise_knowledge')
+        self.generation_pointer_path = Path(generations_config.get('pointer_path',
+                                                                   'chroma_db/active_generation.json'))
+        self.keep_previous_generations = generations_config.get('keep_previous', 1)
+        # Serving processes re-stat the pointer so a rebuild run from another process swaps them too
+        self.pointer_check_interval = generations_config.get('pointer_check_interval', 2.0)
+        self._pointer_checked_at = 0.0
+        self._pointer_mtime: Optional[int] = None
+        # One file per process naming the generation it serves; GC never drops a leased one
+        self.generation_lease_dir = self.generation_pointer_path.parent / "generation_leases"
+        
+        sharding_config = self.config.get('sharding', {})
+        self.sharding_enabled = sharding_config.get('enabled', False)
+        self.shard_key = sharding_config.get('key', 'department')
+        self.shard_fan_out_workers = sharding_config.get('fan_out_workers', 8)
+        self._generation_lock = threading.Lock()
+        self._generation: Optional[IndexGeneration] = None
+        self._previous_generations: List[str] = []
+        self._retired_generations: List[IndexGeneration] = []
+        self._pending_drop: List[str] = []
+        self.rebuild_status: Dict[str, Any] = {"state": "idle"}
+        
+        # Serializes in-place index updates (ingest and watched re-indexing)
+        self._update_lock = threading.Lock()
+        self.watcher: Optional["KnowledgeBaseWatcher"] = None
+        
+        self.startup_timings = {"service_init": time.time() - init_start}
+        self.logger.info("Enterprise RAG Service initialized")
+    
+    @classmethod
+    def get_shared(cls, config_path: str = "knowledge_base/data_sources.yaml") -> "EnterpriseRAGService":
+        """Return the process-wide service for this config, creating it once"""
+        key = os.path.abspath(config_path)
+        with cls._shared_lock:
+            instance = cls._shared_instances.get(key)
+            if instance is None:
+                instance = cls(config_path)
+                cls._shared_instances[key] = instance
+            return instance
+    
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            with self._init_lock:
+                if self._embedding_model is None:
+                    load_start = time.time()
+                    from sentence_transformers import SentenceTransformer
+                    self._embedding_model = SentenceTransformer(
+                        self.config.get('processing_config', {}).get('embedding_model', 
+                                                                    'sentence-transformers/all-MiniLM-L6-v2')
+                    )
+                    self.startup_timings["embedding_model"] = time.time() - load_start
+                    self.logger.info(f"Embedding model loaded in {self.startup_timings['embedding_model']:.2f}s")
+        return self._embedding_model
+    
+    @property
+    def document_processor(self) -> DocumentProcessor:
+        if self._document_processor is None:
+            with self._init_lock:
+                if self._document_processor is None:
+                    # Chunk with the embedding model's own tokenizer so chunk sizes are exact
+                    self._document_processor = DocumentProcessor(self.config, TokenCounter(
+                        getattr(self.embedding_model, 'tokenizer', None),
+                        getattr(self.embedding_model, 'max_seq_length', None)
+                    ))
+        return self._document_processor
+    
+    @property
+    def vector_db(self):
+        if self._vector_db is None:
+            with self._init_lock:
+                if self._vector_db is None:
+                    load_start = time.time()
+                    import chromadb
+                    self._vector_db = chromadb.PersistentClient(path="./chroma_db")
+                    self.startup_timings["vector_database"] = time.time() - load_start
+        return self._vector_db
+    
+    @property
+    def generation(self) -> IndexGeneration:
+        """The active index generation, opened from the pointer file on first use"""
+        if self._generation is None:
+            with self._init_lock:
+                if self._generation is None:
+                    self._pointer_mtime = self._pointer_stat()
+                    self._pointer_checked_at = time.monotonic()
+                    pointer = self._read_generation_pointer()
+                    self._previous_generations = pointer.get("previous", [])
+                    self._generation = self._open_generation(pointer.get("active", self.base_collection_name))
+                    self._write_lease(self._generation.name)
+                    atexit.register(self._remove_lease)
+        return self._generation
+    
+    @property
+    def collection(self):
+        return self.generation.collection
+    
+    @property
+    def snapshot(self) -> Optional[IndexSnapshot]:
+        return self.generation.snapshot
+    
+    @property
+    def deduplicator(self) -> NearDuplicateDetector:
+        return self.generation.deduplicator
+    
+    def _generation_dir(self, name: str) -> Path:
+        return Path("checkpoints/generations") / name
+    
+    def _generation_snapshot_path(self, name: str) -> Path:
+        if name == self.base_collection_name:
+            return Path(self.snapshot_path)
+        return Path(self.snapshot_path).parent / f"{name}.snap"
+    
+    def _shard_manifest_path(self, name: str) -> Path:
+        return self.generation_pointer_path.parent / f"{name}.shards.json"
+    
+    def _open_collection(self, name: str, new: bool = False):
+        """
+        The collection behind a generation, sharded or not
+        
+        A generation stays in the layout it was built with: turning sharding
+        on applies to new generations (or an empty index), so existing data
+        needs a --mode rebuild.
+        """
+        manifest_path = self._shard_manifest_path(name)
+        if manifest_path.exists() or (self.sharding_enabled and (new or not self._collection_exists(name))):
+            return ShardedCollection(self.vector_db, name, self.shard_key, manifest_path,
+                                     self.shard_fan_out_workers)
+        
+        return self.vector_db.get_or_create_collection(
+            name=name,
+            metadata={"description": "TechCorp Enterprise Knowledge Base"}
+        )
+    
+    def _collection_exists(self, name: str) -> bool:
+        try:
+            self.vector_db.get_collection(name)
+            return True
+        except Exception:
+            return False
+    
+    def _open_generation(self, name: str) -> IndexGeneration:
+        collection = self._open_collection(name)
+        
+        # The original collection keeps the configured dedup index; rebuilt ones have their own
+        deduplicator = NearDuplicateDetector(self.config)
+        if name != self.base_collection_name:
+            deduplicator.index_path = self._generation_dir(name) / "dedup_index.pkl"
+        deduplicator.load()
+        
+        snapshot = None
+        snapshot_path = self._generation_snapshot_path(name)
+        if self.snapshot_enabled and snapshot_path.exists():
+            load_start = time.time()
+            snapshot = IndexSnapshot.load(str(snapshot_path), self.snapshot_use_mmap)
+            self.startup_timings["index_snapshot"] = time.time() - load_start
+            self.logger.info(f"Loaded index snapshot with {snapshot.count()} chunks "
+                             f"in {self.startup_timings['index_snapshot']:.3f}s")
+        
+        return IndexGeneration(name, collection, deduplicator, snapshot)
+    
+    def _read_generation_pointer(self) -> Dict[str, Any]:
+        try:
+            with open(self.generation_pointer_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def _write_generation_pointer(self, active: str, previous: List[str], validation: Dict[str, Any]):
+        """Point at a generation atomically; restarts pick up whatever this file names"""
+        self.generation_pointer_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.generation_pointer_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "active": active,
+                "previous": previous,
+                "activated_at": datetime.now().isoformat(),
+                "validation": validation
+            }, f, indent=2)
+        os.replace(tmp_path, self.generation_pointer_path)
+        self._pointer_mtime = self._pointer_stat()
+    
+    def _pointer_stat(self) -> Optional[int]:
+        try:
+            return self.generation_pointer_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def _refresh_generation(self):
+        """Follow a pointer swap made by another process, e.g. a CLI --mode rebuild"""
+        now = time.monotonic()
+        if now - self._pointer_checked_at < self.pointer_check_interval:
+            return
+        self._pointer_checked_at = now
+        
+        mtime = self._pointer_stat()
+        if mtime is None or mtime == self._pointer_mtime:
+            return
+        # Never swap underneath an in-place update; the next check retries
+        if not self._update_lock.acquire(blocking=False):
+            return
+        try:
+            pointer = self._read_generation_pointer()
+            active = pointer.get("active", self.base_collection_name)
+            if active != self._generation.name:
+                generation = self._open_generation(active)
+                with self._generation_lock:
+                    current = self._generation
+                    self._generation = generation
+                    self._previous_generations = pointer.get("previous", [])
+                    self._retired_generations.append(current)
+                    if current.name not in self._previous_generations:
+                        self._pending_drop.append(current.name)
+                self._write_lease(active)
+                self.logger.info(f"Followed index pointer to generation {active} (was {current.name})")
+                self._collect_generations()
+            self._pointer_mtime = mtime
+        except Exception as e:
+            self.logger.warning(f"Could not follow index pointer: {e}")
+        finally:
+            self._update_lock.release()
+    
+    def _write_lease(self, name: str):
+        self.generation_lease_dir.mkdir(parents=True, exist_ok=True)
+        lease_path = self.generation_lease_dir / str(os.getpid())
+        tmp_path = lease_path.with_suffix(".tmp")
+        tmp_path.write_text(name)
+        os.replace(tmp_path, lease_path)
+    
+    def _remove_lease(self):
+        try:
+            (self.generation_lease_dir / str(os.getpid())).unlink()
+        except FileNotFoundError:
+            pass
+    
+    def _leased_generations(self) -> set:
+        """Generations other live processes are serving; leases of dead processes are cleared"""
+        leased = set()
+        if not self.generation_lease_dir.exists():
+            return leased
+        for lease_path in self.generation_lease_dir.iterdir():
+            if not lease_path.name.isdigit() or int(lease_path.name) == os.getpid():
+                continue
+            try:
+                os.kill(int(lease_path.name), 0)
+            except ProcessLookupError:
+                lease_path.unlink(missing_ok=True)
+                continue
+            except PermissionError:
+                pass
+            try:
+                leased.add(lease_path.read_text().strip())
+            except FileNotFoundError:
+                pass
+        return leased
+    
+    def _acquire_generation(self) -> IndexGeneration:
+        """Pin the active generation for the duration of a query"""
+        self.generation
+        self._refresh_generation()
+        with self._generation_lock:
+            generation = self._generation
+            generation.active_queries += 1
+        return generation
+    
+    def _release_generation(self, generation: IndexGeneration):
+        with self._generation_lock:
+            generation.active_queries -= 1
+            retired = generation in self._retired_generations
+        if retired:
+            self._collect_generations()
+    
+    def _activate_generation(self, generation: IndexGeneration, validation: Dict[str, Any]):
+        """Swap the active pointer to a new generation and retire the old one"""
+        current = self.generation
+        candidates = [current.name] + [name for name in self._previous_generations if name != current.name]
+        # The generation being replaced is always kept: other processes may still be serving it
+        keep = max(1, self.keep_previous_generations)
+        previous = candidates[:keep]
+        
+        self._write_generation_pointer(generation.name, previous, validation)
+        
+        with self._generation_lock:
+            self._generation = generation
+            self._previous_generations = previous
+            self._retired_generations.append(current)
+            self._pending_drop.extend(name for name in candidates[keep:] if name != generation.name)
+        self._write_lease(generation.name)
+        
+        self.logger.info(f"Activated index generation {generation.name} (previous: {current.name})")
+        self._collect_generations()
+    
+    def _collect_generations(self):
+        """
+        Drop superseded generations once nothing is using them
+        
+        A generation stays while an in-flight query here pins it or another
+        live process still leases it; that process drops it itself after it
+        follows the pointer.
+        """
+        leased = self._leased_generations()
+        with self._generation_lock:
+            in_use = {g.name for g in self._retired_generations if g.active_queries > 0}
+            kept = in_use | leased | {self._generation.name}
+            doomed = [name for name in self._pending_drop if name not in kept]
+            self._pending_drop = [name for name in self._pending_drop if name in kept]
+            self._retired_generations = [
+                g for g in self._retired_generations
+                if g.name in in_use or g.name in self._previous_generations
+            ]
+        
+        for name in doomed:
+            self._drop_generation(name)
+    
+    def _drop_generation(self, name: str):
+        if self._generation is not None and name == self._generation.name:
+            return
+        try:
+            manifest_path = self._shard_manifest_path(name)
+            if manifest_path.exists():
+                ShardedCollection(self.vector_db, name, self.shard_key, manifest_path).drop()
+            else:
+                self.vector_db.delete_collection(name)
+        except Exception as e:
+            self.logger.warning(f"Could not delete collection {name}: {e}")
+        
+        snapshot_path = self._generation_snapshot_path(name)
+        if snapshot_path.exists():
+            snapshot_path.unlink()
+        shutil.rmtree(self._generation_dir(name), ignore_errors=True)
+        self.logger.info(f"Garbage-collected index generation {name}")
+    
+    def rebuild_index(self, background: bool = False) -> Dict[str, Any]:
+        """
+        Blue/green rebuild: build a new generation, validate it, then swap it in
+        
+        Searches keep running against the current generation throughout; the
+        swap is a single pointer update.
+        """
+        with self._generation_lock:
+            if self.rebuild_status.get("state") == "running":
+                return {"status": "already_running", **self.rebuild_status}
+            self.rebuild_status = {"state": "running", "started_at": datetime.now().isoformat()}
+        
+        if background:
+            threading.Thread(target=self._run_rebuild, daemon=True).start()
+            return {"status": "started"}
+        return self._run_rebuild()
+    
+    def _run_rebuild(self) -> Dict[str, Any]:
+        # In-place updates (the watcher) wait, then land in whichever generation is active
+        with self._update_lock:
+            return self._build_generation()
+    
+    def _build_generation(self) -> Dict[str, Any]:
+        name = f"{self.base_collection_name}_gen_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        generation_dir = self._generation_dir(name)
+        self.logger.info(f"Building index generation {name}")
+        
+        try:
+            current = self.generation
+            collection = self._open_collection(name, new=True)
+            deduplicator = NearDuplicateDetector(self.config)
+            deduplicator.index_path = generation_dir / "dedup_index.pkl"
+            generation = IndexGeneration(name, collection, deduplicator)
+            
+            # Fresh checkpoint per generation so the build never skips documents
+            pipeline = self._ingestion_pipeline(
+                generation,
+                worker_niceness=self.config.get('index_generations', {}).get('rebuild_worker_niceness', 10)
+            )
+            ingestion_results = pipeline.run(self.config.get('data_sources', []), resume=False)
+            
+            if self.snapshot_enabled:
+                self._write_generation_snapshot(generation)
+            
+            validation = self._validate_generation(generation, current, ingestion_results)
+            if not validation["passed"]:
+                self.logger.error(f"Generation {name} failed validation: {validation}")
+                self._drop_generation(name)
+                self.rebuild_status = {"state": "failed", "generation": name, "validation": validation,
+                                       "finished_at": datetime.now().isoformat()}
+                return {"status": "failed", "generation": name, "validation": validation,
+                        "ingestion": ingestion_results}
+            
+            self._activate_generation(generation, validation)
+            self.rebuild_status = {"state": "completed", "generation": name,
+                                   "finished_at": datetime.now().isoformat()}
+            return {"status": "activated", "generation": name, "validation": validation,
+                    "ingestion": ingestion_results}
+            
+        except Exception as e:
+            self.logger.error(f"Index rebuild failed: {e}")
+            self._drop_generation(name)
+            self.rebuild_status = {"state": "failed", "generation": name, "error": str(e),
+                                   "finished_at": datetime.now().isoformat()}
+            return {"status": "failed", "generation": name, "error": str(e)}
+    
+    def _validate_generation(self,
+                             candidate: IndexGeneration,
+                             current: IndexGeneration,
+                             ingestion_results: Dict[str, Any]) -> Dict[str, Any]:
+        """Check chunk counts and sample queries before a generation goes live"""
+        validation_config = self.config.get('index_generations', {}).get('validation', {})
+        checks = {}
+        
+        chunk_count = candidate.count()
+        try:
+            current_count = current.count()
+        except Exception:
+            current_count = 0
+        min_ratio = validation_config.get('min_chunk_ratio', 0.5)
+        checks["chunk_count"] = {
+            "candidate": chunk_count,
+            "current": current_count,
+            "passed": (chunk_count >= validation_config.get('min_chunks', 1)
+                       and chunk_count >= current_count * min_ratio)
+        }
+        
+        failed_documents = ingestion_results.get("failed_documents", 0)
+        checks["failed_documents"] = {
+            "count": failed_documents,
+            "passed": failed_documents <= validation_config.get('max_failed_documents', 0)
+        }
+        
+        sample_queries = validation_config.get('sample_queries', [])
+        min_relevance = validation_config.get('sample_relevance_threshold', 0.3)
+        if sample_queries:
+            embeddings = self.embedding_model.encode(sample_queries)
+            results = candidate.query([embedding.tolist() for embedding in embeddings], n_results=1)
+            failures = [
+                query for query, distances in zip(sample_queries, results['distances'])
+                if not distances or 1.0 - distances[0] < min_relevance
+            ]
+            checks["sample_queries"] = {
+                "total": len(sample_queries),
+                "failed": failures,
+                "passed": not failures
+            }
+        
+        return {"passed": all(check["passed"] for check in checks.values()), "checks": checks}
+    
+    def rollback_index(self) -> Dict[str, Any]:
+        """Re-activate the most recent previous generation"""
+        self.generation
+        if not self._previous_generations:
+            return {"status": "no_previous_generation"}
+        
+        with self._update_lock:
+            generation = self._open_generation(self._previous_generations[0])
+            self._activate_generation(generation, {"passed": True, "rollback": True})
+        return {"status": "activated", "generation": generation.name}
+    
+    def rebuild_shard(self, shard: str) -> Dict[str, Any]:
+        """
+        Re-ingest one shard of a sharded index into a fresh collection and swap it in
+        
+        Other shards keep serving untouched; the shard itself keeps serving
+        its old collection until the new one is complete.
+        """
+        with self._update_lock:
+            generation = self.generation
+            sharded = generation.collection
+            if not isinstance(sharded, ShardedCollection):
+                return {"status": "not_sharded"}
+            
+            sources = [source for source in self.config.get('data_sources', [])
+                       if ShardedCollection.shard_of_source(source, sharded.key) == shard]
+            if not sources:
+                return {"status": "unknown_shard", "shard": shard}
+            
+            for source in sources:
+                generation.deduplicator.forget_source(source['path'])
+            
+            collection = sharded.create_shard_collection(shard)
+            access_keys = set()
+            def write_batch(chunks, embeddings):
+                self._store_chunks(chunks, embeddings, collection)
+                access_keys.update(f"{chunk['metadata'].classification}|"
+                                   f"{','.join(sorted(chunk['metadata'].access_roles))}" for chunk in chunks)
+            
+            pipeline = self._ingestion_pipeline(generation, write_batch=write_batch)
+            results = pipeline.run(sources, resume=False)
+            if results["failed_documents"]:
+                self.vector_db.delete_collection(collection.name)
+                self.logger.error(f"Shard {shard} rebuild failed, keeping the current shard: {results['errors']}")
+                return {"status": "failed", "shard": shard, "ingestion": results}
+            
+            sharded.swap_shard(shard, collection, access_keys)
+            if generation.deduplicator.enabled:
+                generation.deduplicator.save()
+            if generation.snapshot is not None:
+                generation.snapshot = None
+        
+        self.logger.info(f"Rebuilt shard {shard}: {results['total_chunks']} chunks")
+        return {"status": "activated", "shard": shard, "ingestion": results}
+    
+    def preload(self, background: bool = False):
+        """Load the model and index ahead of the first query"""
+        def load():
+            self.embedding_model
+            self.generation
+        
+        if background:
+            threading.Thread(target=load, daemon=True).start()
+        else:
+            load()
+    
+    def export_snapshot(self, path: Optional[str] = None) -> Dict[str, Any]:
+        """Write the active generation to a compact snapshot file"""
+        return self._write_generation_snapshot(self.generation, path)
+    
+    def _write_generation_snapshot(self, generation: IndexGeneration, path: Optional[str] = None,
+                                   page_size: int = 1000) -> Dict[str, Any]:
+        path = path or str(self._generation_snapshot_path(generation.name))
+        ids, documents, metadatas, embeddings = [], [], [], []
+        
+        offset = 0
+        while True:
+            page = generation.collection.get(include=["embeddings", "documents", "metadatas"],
+                                             limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            ids.extend(page['ids'])
+            documents.extend(page['documents'])
+            metadatas.extend(page['metadatas'])
+            embeddings.extend(page['embeddings'])
+            offset += len(page['ids'])
+        
+        size = IndexSnapshot.write(path, ids, documents, metadatas, embeddings)
+        
+        if self.snapshot_enabled:
+            generation.snapshot = IndexSnapshot.load(path, self.snapshot_use_mmap)
+        
+        self.logger.info(f"Exported index snapshot: {len(ids)} chunks, {size / 1024:.1f} KB -> {path}")
+        return {"path": path, "chunks": len(ids), "size_bytes": size}
+    
+    def _load_config(self) -> Dict[str, Any]:
+        """Load configuration from YAML file"""
+        try:
+            with open(self.config_path, 'r') as f:
+                return yaml.safe_load(f)
+        except FileNotFoundError:
+            # Runs before setup_logging, so use the module logger directly
+            logging.getLogger("enterprise_rag").warning(f"Config file not found: {self.config_path}")
+            return {"data_sources": []}
+    
+    def setup_logging(self):
+        """Setup structured logging for enterprise monitoring"""
+        # Create logs directory
+        Path("logs").mkdir(exist_ok=True)
+        
+        # Setup logger
+        self.logger = logging.getLogger("enterprise_rag")
+        self.logger.setLevel(logging.INFO)
+        
+        # Console handler
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+        
+        # File handler
+        file_handler = logging.FileHandler('logs/rag_service.log')
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+        
+        self.logger.addHandler(console_handler)
+        self.logger.addHandler(file_handler)
+    
+    def ingest_documents(self, resume: bool = True) -> Dict[str, Any]:
+        """
+        Ingest documents from configured sources
+        
+        Enterprise features:
+        - Staged parallel pipeline with backpressure
+        - Resumable checkpoints per completed document
+        - Validation and error handling
+        - Metadata preservation
+        - Access control setup
+        - Version tracking
+        """
+        
+        self.logger.info("Starting document ingestion pipeline")
+        
+        data_sources = self.config.get('data_sources', [])
+        
+        with self._update_lock:
+            generation = self.generation
+            # In place: a document that got shorter must not leave its old tail chunks behind
+            pipeline = self._ingestion_pipeline(
+                generation,
+                remove_stale_chunks=lambda path, chunk_count:
+                    self._remove_stale_chunks(generation.collection, path, chunk_count)
+            )
+            
+            # Documents about to be re-chunked leave the duplicate index first, and any
+            # document deduplicated against them is re-ingested in its own right
+            if generation.deduplicator.enabled:
+                worklist = pipeline.stale_documents(data_sources) if resume else \
+                    [source['path'] for source in data_sources]
+                targets = set()
+                while worklist:
+                    path = worklist.pop()
+                    if path not in targets:
+                        targets.add(path)
+                        worklist.extend(generation.deduplicator.forget_source(path))
+                if resume:
+                    pipeline.forget_documents(targets)
+            
+            ingestion_results = pipeline.run(data_sources, resume=resume)
+        
+        self.logger.info(f"Ingestion complete: {ingestion_results}")
+        return ingestion_results
+    
+    def _ingestion_pipeline(self, generation: IndexGeneration, write_batch=None, **kwargs) -> IngestionPipeline:
+        """Ingestion pipeline writing into a generation, with that generation's checkpoint"""
+        config = self.config
+        if generation.name != self.base_collection_name:
+            processing_config = dict(config.get('processing_config', {}),
+                                     checkpoint_path=str(self._generation_dir(generation.name) /
+                                                         "ingestion_checkpoint.json"))
+            config = dict(config, processing_config=processing_config)
+        
+        return IngestionPipeline(
+            config,
+            self.document_processor,
+            embed_batch=self.embedding_model.encode,
+            write_batch=write_batch or (lambda chunks, embeddings:
+                                        self._store_chunks(chunks, embeddings, generation.collection)),
+            deduplicator=generation.deduplicator,
+            **kwargs
+        )
+    
+    def reindex_sources(self, paths: List[str]) -> Dict[str, Any]:
+        """
+        Incrementally re-index changed or deleted source files in place
+        
+        Only the given files are re-chunked and re-embedded, in this process
+        with the already loaded model: forking an ingestion pipeline from a
+        serving process is too heavy for a handful of files. New chunks are
+        upserted before the file's leftover chunks are deleted, so searches
+        never see the file missing.
+        """
+        start_time = time.time()
+        sources_by_path = {os.path.abspath(source['path']): source
+                           for source in self.config.get('data_sources', [])}
+        
+        with self._update_lock:
+            generation = self.generation
+            
+            # Chunks deduplicated against the changed files must be re-embedded in their own right
+            worklist = [sources_by_path[os.path.abspath(path)]['path'] for path in paths
+                        if os.path.abspath(path) in sources_by_path]
+            targets = set()
+            while worklist:
+                path = worklist.pop()
+                if path not in targets:
+                    targets.add(path)
+                    worklist.extend(generation.deduplicator.forget_source(path))
+            
+            changed = [source for source in self.config.get('data_sources', [])
+                       if source['path'] in targets and Path(source['path']).exists()]
+            deleted = [path for path in targets if not Path(path).exists()]
+            
+            pipeline = self._ingestion_pipeline(generation)
+            written_ids = set()
+            chunk_counts = {}
+            errors = []
+            for source in changed:
+                try:
+                    chunks = list(self.document_processor.iter_chunks(source['path'], source))
+                    chunk_count = len(chunks)
+                    if generation.deduplicator.enabled:
+                        chunks = [chunk for chunk in chunks if generation.deduplicator.check(chunk) is None]
+                    for start in range(0, len(chunks), pipeline.embedding_batch_size):
+                        batch = chunks[start:start + pipeline.embedding_batch_size]
+                        embeddings = self.embedding_model.encode([chunk['content'] for chunk in batch])
+                        self._store_chunks(batch, embeddings, generation.collection)
+                        written_ids.update(chunk['metadata'].chunk_id for chunk in batch)
+                    chunk_counts[source['path']] = chunk_count
+                except Exception as e:
+                    error_msg = f"Failed to process {source['name']}: {e}"
+                    self.logger.error(error_msg)
+                    errors.append(error_msg)
+            
+            pipeline.record_documents(chunk_counts)
+            pipeline.forget_documents(deleted)
+            if generation.deduplicator.enabled:
+                generation.deduplicator.save()
+            
+            # Failed documents keep their previous chunks until the next successful run
+            stale_paths = set(chunk_counts) | set(deleted)
+            removed = 0
+            for path in stale_paths:
+                existing = generation.collection.get(where={"source_file": path}, include=[])['ids']
+                stale_ids = [chunk_id for chunk_id in existing if chunk_id not in written_ids]
+                if stale_ids:
+                    generation.collection.delete(ids=stale_ids)
+                    removed += len(stale_ids)
+            
+            if generation.snapshot is not None:
+                self.logger.warning("Index snapshot is out of date after incremental update; "
+                                    "serving from the vector database until it is re-exported")
+                generation.snapshot = None
+        
+        update = {
+            "updated": sorted(s['path'] for s in changed),
+            "deleted": sorted(deleted),
+            "chunks_written": len(written_ids),
+            "chunks_removed": removed,
+            "failed_documents": len(errors),
+            "errors": errors,
+            "elapsed_time": time.time() - start_time
+        }
+        self.logger.info(f"Incremental re-index: {update}")
+        return update
+    
+    def _remove_stale_chunks(self, collection, path: str, chunk_count: int) -> int:
+        """Delete a source's chunk ids numbered at or beyond its current chunk count"""
+        existing = collection.get(where={"source_file": path}, include=[])['ids']
+        stale_ids = [chunk_id for chunk_id in existing if int(chunk_id.rsplit(':', 1)[1]) >= chunk_count]
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+            self.logger.info(f"Removed {len(stale_ids)} stale chunks of {path}")
+        return len(stale_ids)
+    
+    def stale_sources(self) -> List[str]:
+        """Configured sources changed or deleted since the active generation indexed them"""
+        return self._ingestion_pipeline(self.generation).stale_documents(self.config.get('data_sources', []))
+    
+    def start_watching(self) -> "KnowledgeBaseWatcher":
+        """Watch the configured sources and re-index them in place as they change"""
+        with self._init_lock:
+            if self.watcher is None:
+                self.watcher = KnowledgeBaseWatcher(self, self.config.get('watch', {}))
+                self.watcher.start()
+        return self.watcher
+    
+    def _store_chunks(self, chunks: List[Dict[str, Any]], embeddings, collection=None):
+        """Bulk-write a batch of embedded chunks to the vector database"""
+        collection = collection if collection is not None else self.collection
+        
+        # Store in vector database with metadata
+        collection.upsert(
+            embeddings=[embedding.tolist() for embedding in embeddings],
+            documents=[chunk['content'] for chunk in chunks],
+            metadatas=[{
+                "source_file": chunk['metadata'].source_file,
+                "classification": chunk['metadata'].classification,
+                "access_roles": json.dumps(chunk['metadata'].access_roles),
+                "department": chunk['metadata'].department,
+                "last_updated": chunk['metadata'].last_updated,
+                "chunk_id": chunk['metadata'].chunk_id,
+                "token_count": chunk['metadata'].token_count,
+                "document_title": chunk['document_title']
+            } for chunk in chunks],
+            ids=[chunk['metadata'].chunk_id for chunk in chunks]
+        )
+    
+    def search_knowledge(self, 
+                        query: str, 
+                        user_role: str = "customer_service",
+                        max_results: int = 5,
+                        relevance_threshold: float = 0.7,
+                        departments: Optional[List[str]] = None) -> List[SearchResult]:
+        """
+        Search knowledge base with enterprise controls
+        
+        Features:
+        - Semantic and keyword search combination
+        - Role-based result filtering
+        - Citation generation
+        - Performance tracking
+        - Access logging
+        
+        ``departments`` limits results to those departments; with a sharded
+        index only the shards the role can see (and those departments) are
+        searched.
+        """
+        
+        start_time = time.time()
+        query_id = str(uuid.uuid4())
+        
+        self.logger.info(f"Knowledge search query: {query[:100]}...", extra={
+            "query_id": query_id,
+            "user_role": user_role
+        })
+        
+        generation = None
+        try:
+            # Generate query embedding
+            query_embedding = self.embedding_model.encode(query)
+            
+            # Search the active index generation; a concurrent swap does not affect this query
+            generation = self._acquire_generation()
+            results = generation.query(
+                [query_embedding.tolist()],
+                n_results=max_results * 2,  # Get more results for filtering
+                shards=generation.visible_shards([user_role], self.access_control, departments)
+            )
+            
+            access_log, citation_log = [], []
+            search_results = self._filter_results(
+                generation, results, 0, user_role, max_results, relevance_threshold, query_id,
+                access_log, citation_log, departments
+            )
+            self.access_control.log_access_batch(access_log)
+            self._log_citation_batch(citation_log)
+            
+            # Track performance metrics
+            response_time = time.time() - start_time
+            relevance_scores = [r.relevance_score for r in search_results]
+            self.performance_monitor.track_query(query, response_time, len(search_results), relevance_scores)
+            
+            self.logger.info(f"Search completed: {len(search_results)} results", extra={
+                "query_id": query_id,
+                "response_time": response_time,
+                "results_count": len(search_results)
+            })
+            
+            return search_results
+            
+        except Exception as e:
+            self.logger.error(f"Search failed: {str(e)}", extra={"query_id": query_id})
+            return []
+        finally:
+            if generation is not None:
+                self._release_generation(generation)
+    
+    def search_knowledge_batch(self,
+                               queries: List[str],
+                               roles: Union[str, List[str]] = "customer_service",
+                               max_results: int = 5,
+                               relevance_threshold: float = 0.7,
+                               departments: Optional[List[str]] = None) -> List[List[SearchResult]]:
+        """
+        Search many queries at once
+        
+        All queries are encoded in one model batch and sent as a single
+        multi-embedding vector query; results are filtered per query with the
+        same access control as ``search_knowledge``. ``roles`` is one role
+        for every query or one role per query.
+        """
+        if not queries:
+            return []
+        
+        if isinstance(roles, str):
+            roles = [roles] * len(queries)
+        if len(roles) != len(queries):
+            raise ValueError(f"Got {len(roles)} roles for {len(queries)} queries")
+        
+        start_time = time.time()
+        batch_id = str(uuid.uuid4())
+        
+        self.logger.info(f"Knowledge batch search: {len(queries)} queries", extra={
+            "batch_id": batch_id
+        })
+        
+        generation = None
+        try:
+            query_embeddings = self.embedding_model.encode(queries)
+            
+            generation = self._acquire_generation()
+            results = generation.query(
+                [embedding.tolist() for embedding in query_embeddings],
+                n_results=max_results * 2,  # Get more results for filtering
+                shards=generation.visible_shards(sorted(set(roles)), self.access_control, departments)
+            )
+            
+            access_log, citation_log = [], []
+            batch_results = [
+                self._filter_results(
+                    generation, results, row, user_role, max_results, relevance_threshold,
+                    f"{batch_id}:{row}", access_log, citation_log, departments
+                )
+                for row, user_role in enumerate(roles)
+            ]
+            self.access_control.log_access_batch(access_log)
+            self._log_citation_batch(citation_log)
+            
+            # Track performance metrics, amortizing the batch time over its queries
+            response_time = (time.time() - start_time) / len(queries)
+            for query, search_results in zip(queries, batch_results):
+                self.performance_monitor.track_query(
+                    query, response_time, len(search_results), [r.relevance_score for r in search_results]
+                )
+            
+            self.logger.info(f"Batch search completed: {sum(len(r) for r in batch_results)} results", extra={
+                "batch_id": batch_id,
+                "response_time": time.time() - start_time,
+                "queries": len(queries)
+            })
+            
+            return batch_results
+            
+        except Exception as e:
+            self.logger.error(f"Batch search failed: {str(e)}", extra={"batch_id": batch_id})
+            return [[] for _ in queries]
+        finally:
+            if generation is not None:
+                self._release_generation(generation)
+    
+    def _filter_results(self,
+                        generation: "IndexGeneration",
+                        results: Dict[str, Any],
+                        row: int,
+                        user_role: str,
+                        max_results: int,
+                        relevance_threshold: float,
+                        query_id: str,
+                        access_log: List[Tuple[str, str, str, bool]],
+                        citation_log: List[Tuple[str, str, str]],
+                        departments: Optional[List[str]] = None) -> List[SearchResult]:
+        """
+        Apply relevance threshold, access control and citations to one query's raw results
+        
+        Audit entries are appended to ``access_log`` and ``citation_log`` for
+        the caller to write in one go.
+        """
+        search_results = []
+        
+        for doc, metadata, distance in zip(
+            results['documents'][row],
+            results['metadatas'][row], 
+            results['distances'][row]
+        ):
+            # Convert distance to similarity score
+            relevance_score = 1.0 - distance
+            
+            # Skip results below threshold or outside the requested departments
+            if relevance_score < relevance_threshold:
+                continue
+            if departments is not None and metadata['department'] not in departments:
+                continue
+            
+            # Create document metadata object
+            doc_metadata = DocumentMetadata(
+                source_file=metadata['source_file'],
+                classification=metadata['classification'],
+                access_roles=json.loads(metadata['access_roles']),
+                department=metadata['department'],
+                last_updated=metadata['last_updated'],
+                version="1.0",
+                chunk_id=metadata['chunk_id'],
+                token_count=metadata.get('token_count', 0)
+            )
+            
+            # Check access control
+            access_granted = self.access_control.check_access(
+                user_role,
+                doc_metadata.classification,
+                doc_metadata.access_roles
+            )
+            
+            if access_granted:
+                # Create citation
+                citation = self._create_citation(doc_metadata, doc)
+                
+                # Cite every source that carried a deduplicated copy of this chunk
+                additional_citations = [
+                    self._create_citation(DocumentMetadata(
+                        source_file=ref['source_file'],
+                        classification=doc_metadata.classification,
+                        access_roles=doc_metadata.access_roles,
+                        department=ref['department'],
+                        last_updated=ref['last_updated'],
+                        version="1.0",
+                        chunk_id=ref['chunk_id']
+                    ), doc)
+                    for ref in generation.deduplicator.get_back_references(doc_metadata.chunk_id)
+                ]
+                
+                # Create search result
+                search_result = SearchResult(
+                    content=doc,
+                    relevance_score=relevance_score,
+                    metadata=doc_metadata,
+                    citation=citation,
+                    access_granted=True,
+                    additional_citations=additional_citations
+                )
+                
+                search_results.append(search_result)
+                
+                # Log citation usage
+                citation_log.append((user_role, query_id, citation))
+            
+            # Log access attempt
+            access_log.append((user_role, metadata['chunk_id'], "search", access_granted))
+            
+            # Limit results
+            if len(search_results) >= max_results:
+                break
+        
+        return search_results
+    
+    def _create_citation(self, metadata: DocumentMetadata, chunk_content: str) -> str:
+        """Create proper citation for search result"""
+        # Create standardized citation format
+        source_name = Path(metadata.source_file).stem
+        return f"{source_name}:{metadata.department}:{metadata.last_updated[:10]}"
+    
+    def _log_citation_batch(self, citations: List[Tuple[str, str, str]]):
+        """Log (user_role, query_id, citation) usage for compliance tracking, one file write per batch"""
+        if not citations:
+            return
+        
+        timestamp = datetime.now().isoformat()
+        citation_logs = [
+            json.dumps({
+                "timestamp": timestamp,
+                "query_id": query_id,
+                "user_role": user_role,
+                "citation": citation,
+                "action": "citation_generated"
+            }) + "\n"
+            for user_role, query_id, citation in citations
+        ]
+        
+        Path("logs").mkdir(exist_ok=True)
+        with open("logs/citation_tracking.log", "a") as f:
+            f.writelines(citation_logs)
+    
+    def get_health_status(self, deep: bool = False) -> Dict[str, Any]:
+        """
+        Get service health and performance status
+        
+        Components that have not been loaded yet are reported as such instead
+        of being loaded, unless ``deep`` is set.
+        """
+        
+        # Check vector index health
+        db_initialized = deep or self._generation is not None
+        collection_count = 0
+        db_healthy = True
+        if db_initialized:
+            try:
+                collection_count = self.generation.count()
+            except Exception as e:
+                db_healthy = False
+        
+        if deep:
+            self.embedding_model
+        
+        # Get performance metrics
+        performance_metrics = self.performance_monitor.get_metrics()
+        
+        # Save performance metrics to file
+        Path("metrics").mkdir(exist_ok=True)
+        with open("metrics/rag_performance.json", "w") as f:
+            json.dump(performance_metrics, f, indent=2)
         
         return {
             "status": "healthy" if db_healthy else "degraded",
             "vector_database": {
                 "healthy": db_healthy,
-                "document_count": collection_count
+                "initialized": db_initialized,
+                "document_count": collection_count,
+                "serving_from_snapshot": self._generation is not None and self._generation.snapshot is not None,
+                "index_generation": self._generation.name if self._generation is not None else "not_loaded",
+                "shards": (self._generation.collection.shard_counts()
+                           if self._generation is not None
+                           and isinstance(self._generation.collection, ShardedCollection) else None)
             },
+            "rebuild": self.rebuild_status,
+            "watcher": self.watcher.get_status() if self.watcher is not None else "not_running",
             "performance_metrics": performance_metrics,
-            "embedding_model": self.embedding_model.get_sentence_embedding_dimension(),
+            "embedding_model": (self._embedding_model.get_sentence_embedding_dimension()
+                                if self._embedding_model is not None else "not_loaded"),
+            "startup_timings": self.startup_timings,
             "last_updated": datetime.now().isoformat()
         }
 
+class _InotifyBackend:
+    """Linux inotify on the source directories, read through libc with ctypes"""
+    
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    EVENT_HEADER = struct.Struct("iIII")
+    
+    def __init__(self, directories: List[str]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        
+        # Watch directories, not files, so editors that save by rename are still seen
+        mask = (self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM |
+                self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+        self.directories: Dict[int, str] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self.directories[wd] = directory
+    
+    def wait(self, timeout: float) -> List[str]:
+        """Block up to ``timeout`` seconds and return the paths that changed"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, _, _, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name and wd in self.directories:
+                paths.append(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return paths
+    
+    def close(self):
+        os.close(self.fd)
+
+class _PollingBackend:
+    """Portable fallback: compare size and mtime of each watched file"""
+    
+    def __init__(self, paths: List[str], interval: float):
+        self.paths = paths
+        self.interval = interval
+        self.fingerprints = {path: self._fingerprint(path) for path in paths}
+    
+    @staticmethod
+    def _fingerprint(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+    
+    def wait(self, timeout: float) -> List[str]:
+        time.sleep(min(self.interval, timeout))
+        changed = []
+        for path in self.paths:
+            fingerprint = self._fingerprint(path)
+            if fingerprint != self.fingerprints[path]:
+                self.fingerprints[path] = fingerprint
+                changed.append(path)
+        return changed
+    
+    def close(self):
+        pass
+
+class KnowledgeBaseWatcher:
+    """
+    Watches the configured data sources and re-indexes changed files in place
+    
+    Bursts of edits are debounced per file: a file is re-indexed once it has
+    been quiet for ``debounce_seconds`` (or has kept changing for
+    ``max_delay_seconds``), so an editor's save sequence costs one update.
+    """
+    
+    def __init__(self, service: "EnterpriseRAGService", config: Dict[str, Any]):
+        self.service = service
+        self.debounce_seconds = config.get('debounce_seconds', 1.0)
+        self.max_delay_seconds = config.get('max_delay_seconds', 10.0)
+        self.poll_interval = config.get('poll_interval', 1.0)
+        self.backend_name = config.get('backend', 'auto')
+        self.logger = logging.getLogger("kb_watcher")
+        
+        self.paths = sorted({os.path.abspath(source['path'])
+                             for source in service.config.get('data_sources', [])})
+        self.backend = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            "events": 0,
+            "updates": 0,
+            "files_reindexed": 0,
+            "files_deleted": 0,
+            "chunks_written": 0,
+            "last_update_latency": None,
+            "last_update": None
+        }
+    
+    def _create_backend(self):
+        if self.backend_name in ('auto', 'inotify'):
+            try:
+                return _InotifyBackend(sorted({os.path.dirname(path) for path in self.paths
+                                               if os.path.isdir(os.path.dirname(path))}))
+            except (OSError, AttributeError) as e:
+                if self.backend_name == 'inotify':
+                    raise
+                self.logger.info(f"inotify unavailable ({e}), falling back to polling")
+        return _PollingBackend(self.paths, self.poll_interval)
+    
+    def start(self):
+        self.backend = self._create_backend()
+        self._thread = threading.Thread(target=self._run, name="kb-watcher", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Watching {len(self.paths)} sources with {type(self.backend).__name__}")
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.backend is not None:
+            self.backend.close()
+    
+    def _run(self):
+        # Catch up on edits made while nothing was watching
+        try:
+            stale = self.service.stale_sources()
+        except Exception as e:
+            self.logger.error(f"Could not check sources for changes made while not watching: {e}")
+            stale = []
+        if stale:
+            self._apply(stale, time.time())
+        
+        watched = set(self.paths)
+        first_seen: Dict[str, float] = {}
+        last_seen: Dict[str, float] = {}
+        
+        while not self._stop.is_set():
+            now = time.time()
+            timeout = self.poll_interval
+            if last_seen:
+                timeout = max(0.0, min(min(last_seen.values()) + self.debounce_seconds - now, timeout))
+            
+            for path in self.backend.wait(timeout):
+                path = os.path.abspath(path)
+                if path in watched:
+                    self.stats["events"] += 1
+                    now = time.time()
+                    first_seen.setdefault(path, now)
+                    last_seen[path] = now
+            
+            now = time.time()
+            due = [path for path in last_seen
+                   if now - last_seen[path] >= self.debounce_seconds
+                   or now - first_seen[path] >= self.max_delay_seconds]
+            if due:
+                earliest = min(first_seen[path] for path in due)
+                for path in due:
+                    del first_seen[path], last_seen[path]
+                self._apply(due, earliest)
+    
+    def _apply(self, paths: List[str], first_event: float):
+        try:
+            update = self.service.reindex_sources(paths)
+        except Exception as e:
+            self.logger.error(f"Incremental re-index failed for {paths}: {e}")
+            return
+        
+        self.stats["updates"] += 1
+        self.stats["files_reindexed"] += len(update["updated"])
+        self.stats["files_deleted"] += len(update["deleted"])
+        self.stats["chunks_written"] += update["chunks_written"]
+        self.stats["last_update_latency"] = time.time() - first_event
+        self.stats["last_update"] = datetime.now().isoformat()
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "watched_sources": len(self.paths),
+            **self.stats
+        }
+
 def main():
     """Main function for enterprise RAG service"""
     import argparse
     
     parser = argparse.ArgumentParser(description="TechCorp Enterprise RAG Service")
-    parser.add_argument("--mode", choices=["ingest", "search", "health"], 
+    parser.add_argument("--mode", choices=["ingest", "search", "health", "snapshot", "rebuild", "rollback", "watch"], 
                        default="search", help="Operation mode")
+    parser.add_argument("--full", action="store_true",
+                       help="Ignore the ingestion checkpoint and re-index every document")
+    parser.add_argument("--deep", action="store_true",
+                       help="Health mode: load the model and index instead of reporting lazy state")
+    parser.add_argument("--shard",
+                       help="Rebuild mode: rebuild only this shard of a sharded index")
+    parser.add_argument("--watch", action="store_true",
+                       help="Search mode: re-index knowledge base files as they change")
     args = parser.parse_args()
     
     print("=== TechCorp Enterprise Knowledge Base ===")
@@ -572,18 +2870,70 @@ def main():
     
     if args.mode == "ingest":
         print("\n📚 Starting document ingestion pipeline...")
-        results = rag_service.ingest_documents()
+        results = rag_service.ingest_documents(resume=not args.full)
         print(f"✅ Ingestion complete: {results['processed_documents']}/{results['total_documents']} documents")
-        print(f"📄 Total chunks created: {results['total_chunks']}")
+        if results['skipped_documents']:
+            print(f"⏭️  Unchanged since last checkpoint: {results['skipped_documents']} documents")
+        print(f"📄 Total chunks created: {results['total_chunks']} ({results['chunks_per_second']:.1f} chunks/s)")
+        if 'deduplication' in results:
+            dedup = results['deduplication']
+            print(f"♻️  Near-duplicates skipped: {dedup['duplicates_this_run']} "
+                  f"({dedup['bytes_saved'] / 1024:.1f} KB index saved in total, "
+                  f"~{dedup['embedding_time_avoided']:.2f}s embedding avoided)")
         if results['errors']:
             print(f"⚠️  Errors: {len(results['errors'])}")
         
     elif args.mode == "health":
         print("\n🔍 Checking service health...")
-        health = rag_service.get_health_status()
+        health = rag_service.get_health_status(deep=args.deep)
         print(json.dumps(health, indent=2))
         
+    elif args.mode == "snapshot":
+        print("\n💾 Exporting index snapshot...")
+        snapshot = rag_service.export_snapshot()
+        print(f"✅ Snapshot written: {snapshot['chunks']} chunks, "
+              f"{snapshot['size_bytes'] / 1024:.1f} KB -> {snapshot['path']}")
+        
+    elif args.mode == "rebuild" and args.shard:
+        print(f"\n🔁 Rebuilding shard '{args.shard}' (other shards keep serving)...")
+        results = rag_service.rebuild_shard(args.shard)
+        if results['status'] == "activated":
+            print(f"✅ Shard {args.shard} rebuilt: {results['ingestion']['total_chunks']} chunks")
+        else:
+            print(f"❌ Shard rebuild {results['status']}")
+        
+    elif args.mode == "rebuild":
+        print("\n🔁 Building a new index generation (searches keep using the current one)...")
+        results = rag_service.rebuild_index()
+        if results['status'] == "activated":
+            print(f"✅ Generation {results['generation']} validated and activated")
+        else:
+            print(f"❌ Rebuild {results['status']}: "
+                  f"{results.get('error') or json.dumps(results.get('validation', {}), indent=2)}")
+        
+    elif args.mode == "rollback":
+        results = rag_service.rollback_index()
+        if results['status'] == "activated":
+            print(f"✅ Rolled back to generation {results['generation']}")
+        else:
+            print("❌ No previous generation to roll back to")
+        
+    elif args.mode == "watch":
+        watcher = rag_service.start_watching()
+        print(f"\n👀 Watching {len(watcher.paths)} knowledge base sources for changes (Ctrl+C to stop)...")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            watcher.stop()
+            print(json.dumps(watcher.get_status(), indent=2))
+        
     else:  # search mode
+        # Load the model and index while the user types the first query
+        rag_service.preload(background=True)
+        if args.watch:
+            rag_service.start_watching()
+        
         print(f"\n🔍 Knowledge base ready for search")
         print("Available user roles: admin, supervisor, customer_service, guest")
         print("Type 'quit' to exit\n")
@@ -613,6 +2963,8 @@ def main():
                     print(f"\n📚 Found {len(results)} relevant documents:")
                     for i, result in enumerate(results, 1):
                         print(f"\n{i}. {result.citation}")
+                        if result.additional_citations:
+                            print(f"   Also in: {', '.join(result.additional_citations)}")
                         print(f"   Relevance: {result.relevance_score:.2f}")
                         print(f"   Classification: {result.metadata.classification}")
                         print(f"   Content: {result.content[:200]}...")
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+# Lab 4: RAG Performance Benchmarks
+# Cold-start and scaling benchmarks for the enterprise RAG service
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import shutil
+import hashlib
+import random
+import resource
+import re
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any
+
+import numpy as np
+import yaml
+
+# Runs in a fresh interpreter so every sample is a true cold start
+STARTUP_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+from enterprise_rag_service import EnterpriseRAGService
+t_import = time.perf_counter()
+service = EnterpriseRAGService(sys.argv[1])
+service.snapshot_enabled = sys.argv[2] == "snapshot"
+t_init = time.perf_counter()
+service.get_health_status()
+t_health = time.perf_counter()
+service.search_knowledge("How do I reset my password?", max_results=3, relevance_threshold=0.0)
+t_query = time.perf_counter()
+print(json.dumps({
+    "import": t_import - t0,
+    "service_init": t_init - t_import,
+    "health_ready": t_health - t0,
+    "first_query": t_query - t_health,
+    "query_ready": t_query - t0,
+    "component_timings": service.startup_timings
+}))
+"""
+
+# Cold start of a scaling run: loads the benchmark module by path for the hash embedder
+SCALING_PROBE = r"""
+import importlib.util, json, resource, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from enterprise_rag_service import EnterpriseRAGService
+service = EnterpriseRAGService(sys.argv[3])
+if sys.argv[4] == "hash":
+    spec = importlib.util.spec_from_file_location("rag_benchmark_probe", sys.argv[2])
+    benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(benchmark)
+    service._embedding_model = benchmark.HashEmbedder(int(sys.argv[5]))
+service.search_knowledge("How do I reset my password?", "admin", 5, float("-inf"))
+t_query = time.perf_counter()
+print(json.dumps({
+    "query_ready": t_query - t0,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "component_timings": service.startup_timings
+}))
+"""
+
+class HashEmbedder:
+    """
+    Deterministic hashing-trick embedder standing in for SentenceTransformer
+    
+    Words are hashed into signed buckets and the vector is L2-normalized, so
+    benchmarks run without downloading a model and give identical vectors on
+    every machine. Retrieval quality is meaningless; cost per chunk is not.
+    """
+    
+    tokenizer = None
+    max_seq_length = 512
+    
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+    
+    def encode(self, texts):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+        return vectors[0] if single else vectors
+
+_TOPICS = ["billing", "refunds", "login", "passwords", "subscriptions", "integrations", "security",
+           "performance", "exports", "notifications", "api", "permissions", "onboarding", "invoices"]
+_VOCABULARY = ("account customer support request policy issue access team plan update error "
+               "payment report settings service user data review process enterprise ticket "
+               "configure browser network escalate contract renewal storage limit version "
+               "workspace admin audit export import sync schedule region latency backup").split()
+_DEPARTMENTS = ["support", "billing", "engineering", "legal", "customer_success"]
+_ACCESS_LEVELS = [
+    ("public", ["guest", "customer_service", "supervisor", "admin"]),
+    ("internal", ["customer_service", "supervisor", "admin"]),
+    ("confidential", ["supervisor", "admin"])
+]
+
+def generate_corpus(output_dir: str, target_chunks: int, sections_per_file: int = 200,
+                    seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Write a synthetic markdown corpus of roughly ``target_chunks`` chunks
+    
+    Each file has a title, topic sections and ~80-word subsections, and each
+    subsection fits in one chunk at the benchmark chunk size. Returns the
+    ``data_sources`` entries for the files, spread across departments and
+    classifications.
+    """
+    rng = random.Random(seed)
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    
+    sources = []
+    written = 0
+    file_index = 0
+    while written < target_chunks:
+        sections = min(sections_per_file, target_chunks - written)
+        path = output / f"kb_{file_index:06d}.md"
+        with open(path, "w") as f:
+            f.write(f"# TechCorp Knowledge Article {file_index}\n\n")
+            for section in range(sections):
+                if section % 5 == 0:
+                    f.write(f"## {rng.choice(_TOPICS).title()} Guide {section // 5}\n\n")
+                topic = rng.choice(_TOPICS)
+                words = [rng.choice(_VOCABULARY) for _ in range(rng.randint(60, 100))]
+                f.write(f"### How to handle {topic} case {section}\n\n")
+                f.write(f"For {topic}: " + " ".join(words) + ".\n\n")
+        
+        classification, roles = _ACCESS_LEVELS[file_index % len(_ACCESS_LEVELS)]
+        sources.append({
+            "name": path.stem,
+            "type": "markdown",
+            "path": str(path.resolve()),
+            "classification": classification,
+            "access_roles": roles,
+            "department": _DEPARTMENTS[file_index % len(_DEPARTMENTS)]
+        })
+        written += sections
+        file_index += 1
+    
+    return sources
+
+def _directory_size(path: str) -> int:
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    def at(percentile):
+        return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))] * 1000
+    return {"p50_ms": at(50), "p95_ms": at(95), "p99_ms": at(99), "mean_ms": statistics.mean(ordered) * 1000}
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+def benchmark_search(service, queries: List[str], roles: List[str], concurrency_levels: List[int],
+                     queries_per_level: int) -> List[Dict[str, Any]]:
+    """Search latency percentiles and throughput per role and concurrency level"""
+    results = []
+    for role in roles:
+        for concurrency in concurrency_levels:
+            def timed(query):
+                start = time.perf_counter()
+                found = service.search_knowledge(query, role, 5, float("-inf"))
+                return time.perf_counter() - start, len(found)
+            
+            workload = [queries[i % len(queries)] for i in range(queries_per_level)]
+            wall_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(timed, workload))
+            wall_time = time.perf_counter() - wall_start
+            
+            results.append({
+                "role": role,
+                "concurrency": concurrency,
+                "queries": len(samples),
+                "queries_per_second": len(samples) / wall_time,
+                "avg_results": statistics.mean(found for _, found in samples),
+                **_percentiles([latency for latency, _ in samples])
+            })
+    return results
+
+def benchmark_scaling(target_chunks: int, work_dir: str, embedder: str = "hash",
+                      concurrency_levels: List[int] = (1, 4, 16),
+                      roles: List[str] = ("guest", "customer_service", "admin"),
+                      queries_per_level: int = 200, dimension: int = 384) -> Dict[str, Any]:
+    """
+    Ingest a synthetic corpus of ``target_chunks`` chunks and measure it
+    
+    Runs in its own working directory so the vector database, checkpoints and
+    logs of each size are isolated.
+    """
+    from enterprise_rag_service import EnterpriseRAGService
+    
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    run_dir = Path(work_dir) / f"chunks_{target_chunks}"
+    shutil.rmtree(run_dir, ignore_errors=True)
+    run_dir.mkdir(parents=True)
+    previous_cwd = os.getcwd()
+    os.chdir(run_dir)
+    
+    try:
+        generate_start = time.perf_counter()
+        sources = generate_corpus("corpus", target_chunks)
+        generate_time = time.perf_counter() - generate_start
+        
+        config = {
+            "data_sources": sources,
+            "processing_config": {
+                "chunk_size": 128,
+                "chunk_overlap": 0,
+                "embedding_batch_size": 64,
+                "ingest_workers": 0,
+                "deduplication": {"enabled": True}
+            }
+        }
+        with open("benchmark_config.yaml", "w") as f:
+            yaml.safe_dump(config, f)
+        
+        service = EnterpriseRAGService("benchmark_config.yaml")
+        if embedder == "hash":
+            service._embedding_model = HashEmbedder(dimension)
+        
+        ingest = service.ingest_documents(resume=False)
+        chunk_count = service.generation.count()
+        
+        cold_start = json.loads(subprocess.run(
+            [sys.executable, "-c", SCALING_PROBE, script_dir, os.path.abspath(__file__),
+             "benchmark_config.yaml", embedder, str(dimension)],
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1])
+        
+        queries = [f"How do I fix {topic} {word} issues?" for topic in _TOPICS for word in _VOCABULARY[:8]]
+        search = benchmark_search(service, queries, list(roles), list(concurrency_levels), queries_per_level)
+        
+        return {
+            "target_chunks": target_chunks,
+            "indexed_chunks": chunk_count,
+            "documents": len(sources),
+            "embedder": embedder,
+            "corpus_generation_s": generate_time,
+            "ingest": {
+                "elapsed_s": ingest["elapsed_time"],
+                "chunks_per_second": ingest["chunks_per_second"],
+                "failed_documents": ingest["failed_documents"]
+            },
+            "index_size": {
+                "corpus_bytes": _directory_size("corpus"),
+                "vector_db_bytes": _directory_size("chroma_db"),
+                "checkpoint_bytes": _directory_size("checkpoints"),
+                "embedding_matrix_bytes": chunk_count * dimension * 4,
+                "cold_process_max_rss_mb": cold_start["max_rss_mb"],
+                "benchmark_process_max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            },
+            "cold_start": {
+                "query_ready_s": cold_start["query_ready"],
+                "component_timings": cold_start["component_timings"]
+            },
+            "search": search
+        }
+    finally:
+        os.chdir(previous_cwd)
+
+def _summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples)
+    }
+
+def benchmark_startup(config_path: str, index_source: str, runs: int = 3) -> Dict[str, Any]:
+    """Measure cold start of EnterpriseRAGService in fresh processes"""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, config_path, index_source],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        # The probe's JSON is the last line; service logging goes to stderr
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        "index_source": index_source,
+        "runs": runs,
+        **{
+            phase: _summarize([sample[phase] for sample in samples])
+            for phase in ["import", "service_init", "health_ready", "first_query", "query_ready"]
+        },
+        "component_timings": samples[-1]["component_timings"]
+    }
+
+def main():
+    """Main function for RAG benchmarks"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="TechCorp RAG Benchmarks")
+    parser.add_argument("--suite", choices=["startup", "scaling"], default="startup", help="Benchmark suite")
+    parser.add_argument("--config", default="knowledge_base/data_sources.yaml", help="RAG service config")
+    parser.add_argument("--runs", type=int, default=3, help="Samples per measurement")
+    parser.add_argument("--sizes", default="1000,10000",
+                        help="Scaling suite: comma-separated corpus sizes in chunks (up to 1000000)")
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash",
+                        help="Scaling suite: deterministic hash stub or the configured embedding model")
+    parser.add_argument("--concurrency", default="1,4,16", help="Scaling suite: concurrent searchers")
+    parser.add_argument("--roles", default="guest,customer_service,admin", help="Scaling suite: search roles")
+    parser.add_argument("--queries", type=int, default=200, help="Scaling suite: searches per role/concurrency")
+    parser.add_argument("--work-dir", default="benchmark_runs", help="Scaling suite: scratch directory")
+    parser.add_argument("--output", default="metrics/rag_benchmark.json", help="Results file")
+    args = parser.parse_args()
+
+    print("=== TechCorp RAG Benchmarks ===")
+
+    results = {
+        "suite": args.suite,
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "commit": _git_commit(),
+        "cpu_count": os.cpu_count(),
+        "results": []
+    }
+
+    if args.suite == "startup":
+        for index_source in ["vector_database", "snapshot"]:
+            print(f"⏱️  Cold start ({index_source}), {args.runs} runs...")
+            result = benchmark_startup(args.config, index_source, args.runs)
+            results["results"].append(result)
+            print(f"   health ready: {result['health_ready']['median']:.2f}s, "
+                  f"first query ready: {result['query_ready']['median']:.2f}s")
+    
+    elif args.suite == "scaling":
+        for size in [int(size) for size in args.sizes.split(",")]:
+            print(f"📚 Scaling run: {size} chunks ({args.embedder} embedder)...")
+            result = benchmark_scaling(
+                size, args.work_dir, args.embedder,
+                concurrency_levels=[int(c) for c in args.concurrency.split(",")],
+                roles=args.roles.split(","),
+                queries_per_level=args.queries
+            )
+            results["results"].append(result)
+            print(f"   ingest: {result['ingest']['chunks_per_second']:.0f} chunks/s, "
+                  f"index on disk: {result['index_size']['vector_db_bytes'] / 1024 / 1024:.1f} MB, "
+                  f"cold start: {result['cold_start']['query_ready_s']:.2f}s")
+            for search in result["search"]:
+                print(f"   search {search['role']:>16} x{search['concurrency']:<3} "
+                      f"p50 {search['p50_ms']:.1f}ms p95 {search['p95_ms']:.1f}ms "
+                      f"p99 {search['p99_ms']:.1f}ms ({search['queries_per_second']:.0f} q/s)")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
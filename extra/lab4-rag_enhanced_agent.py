@@ -16,7 +16,7 @@ from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 
 # Import enterprise RAG service
-from enterprise_rag_service import EnterpriseRAGService, SearchResult
+from enterprise_rag_service import EnterpriseRAGService, SearchResult, ContextPacker
 
 @dataclass 
 class CustomerContext:
@@ -39,12 +39,14 @@ class RAGEnhancedCustomerAgent:
     """
     
     def __init__(self):
-        # Initialize RAG service
+        # Share one RAG service per process; the model and index load on first search
         try:
-            self.rag_service = EnterpriseRAGService()
+            self.rag_service = EnterpriseRAGService.get_shared()
+            self.context_packer = self.rag_service.context_packer
             self.rag_available = True
         except Exception as e:
             logging.error(f"RAG service initialization failed: {e}")
+            self.context_packer = ContextPacker()
             self.rag_available = False
         
         # Setup logging
@@ -56,7 +58,8 @@ class RAGEnhancedCustomerAgent:
             "rag_enhanced_responses": 0,
             "knowledge_base_queries": 0,
             "average_response_time": 0.0,
-            "customer_satisfaction": 0.0
+            "customer_satisfaction": 0.0,
+            "average_context_tokens": 0.0
         }
         
         self.logger.info("RAG-Enhanced Customer Service Agent initialized")
@@ -208,30 +211,39 @@ class RAGEnhancedCustomerAgent:
                                           conversation_id: str) -> Dict[str, Any]:
         """Create response enhanced with knowledge base content"""
         
-        # Build context from knowledge base results
-        knowledge_context = []
-        citations = []
+        # Pack whole, non-redundant sentences into the answer budget: here the
+        # knowledge text is the reply itself rather than an LLM prompt
+        packed = self.context_packer.pack(query, knowledge_results,
+                                          budget_tokens=self.context_packer.max_tokens)
+        knowledge_context = "\n\n".join(passage for _, passage in packed.passages)
         
-        for result in knowledge_results:
-            knowledge_context.append(result.content)
-            citations.append({
+        # Cite only the sources that made it into the response
+        citations = [
+            {
                 "source": result.citation,
                 "relevance": result.relevance_score,
                 "classification": result.metadata.classification,
                 "department": result.metadata.department
-            })
+            }
+            for result in knowledge_results if result.citation in packed.citations
+        ]
         
         # Generate response based on query type and knowledge
         response = self._generate_contextual_response(query, knowledge_context, customer_context)
         
         # Track that this was RAG-enhanced
         self.metrics["rag_enhanced_responses"] += 1
+        enhanced = self.metrics["rag_enhanced_responses"]
+        self.metrics["average_context_tokens"] = (
+            (self.metrics["average_context_tokens"] * (enhanced - 1) + packed.tokens) / enhanced
+        )
         
         return {
             "success": True,
             "response": response,
             "knowledge_enhanced": True,
             "sources": citations,
+            "context_tokens": packed.tokens,
             "knowledge_base_used": True,
             "escalated": False
         }
@@ -269,37 +281,34 @@ class RAGEnhancedCustomerAgent:
     
     def _generate_contextual_response(self, 
                                     query: str, 
-                                    knowledge_context: List[str],
+                                    relevant_info: str,
                                     customer_context: CustomerContext) -> str:
-        """Generate contextual response using knowledge base information"""
-        
-        # Combine knowledge context into coherent information
-        relevant_info = "\n".join(knowledge_context[:2])  # Use top 2 most relevant
+        """Generate contextual response using packed knowledge base information"""
         
         query_lower = query.lower()
         
         # Generate response based on query type with knowledge enhancement
         if "return" in query_lower or "refund" in query_lower:
-            response = f"Based on our current policies, here's what I can tell you about returns and refunds:\n\n{relevant_info[:300]}..."
+            response = f"Based on our current policies, here's what I can tell you about returns and refunds:\n\n{relevant_info}"
             
             if customer_context.subscription_tier == "Enterprise":
                 response += "\n\nAs an Enterprise customer, you may have additional return options. Let me connect you with our Enterprise support team for personalized assistance."
         
         elif "api" in query_lower or "integration" in query_lower:
-            response = f"Here's the information about our API integration:\n\n{relevant_info[:300]}..."
+            response = f"Here's the information about our API integration:\n\n{relevant_info}"
             response += "\n\nFor additional technical support with API integration, I can connect you with our developer relations team."
         
         elif "billing" in query_lower or "payment" in query_lower:
-            response = f"Here's information about our billing and payment processes:\n\n{relevant_info[:300]}..."
+            response = f"Here's information about our billing and payment processes:\n\n{relevant_info}"
             response += "\n\nIf you need specific account assistance, I can escalate this to our billing specialists."
         
         elif "password" in query_lower or "login" in query_lower:
-            response = f"Here are the current password reset procedures:\n\n{relevant_info[:300]}..."
+            response = f"Here are the current password reset procedures:\n\n{relevant_info}"
             response += "\n\nIf you continue to have trouble accessing your account, I can escalate this to our technical support team."
         
         else:
             # General knowledge-based response
-            response = f"Based on our documentation, here's relevant information for your question:\n\n{relevant_info[:300]}..."
+            response = f"Based on our documentation, here's relevant information for your question:\n\n{relevant_info}"
             response += "\n\nIf you need additional assistance or have specific questions about your account, please let me know."
         
         return response
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# Lab 4: Offline Retrieval Evaluation
+# Recall@k, MRR and latency for the enterprise RAG service over labelled queries
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any
+
+from enterprise_rag_service import EnterpriseRAGService
+
+def load_eval_set(path: str) -> List[Dict[str, Any]]:
+    """Read JSONL lines of {"query", "expected_source", optional "role"}"""
+    examples = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            example = json.loads(line)
+            if 'query' not in example or 'expected_source' not in example:
+                raise ValueError(f"{path}:{line_number}: needs 'query' and 'expected_source'")
+            examples.append(example)
+    return examples
+
+def _matches(source_file: str, expected_source: str) -> bool:
+    """Expected sources may be a path, a file name or a bare stem"""
+    source = Path(source_file)
+    return (source_file == expected_source
+            or source.name == expected_source
+            or source.stem == expected_source)
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def score(examples: List[Dict[str, Any]],
+          ranked_sources: List[List[tuple]],
+          k: int,
+          relevance_threshold: float) -> Dict[str, Any]:
+    """Recall@k and MRR for one relevance threshold over pre-ranked (source, score) lists"""
+    hits = 0
+    reciprocal_ranks = 0.0
+    misses = []
+
+    for example, ranked in zip(examples, ranked_sources):
+        kept = [source for source, relevance in ranked if relevance >= relevance_threshold][:k]
+        rank = next((i for i, source in enumerate(kept, 1)
+                     if _matches(source, example['expected_source'])), None)
+        if rank is None:
+            misses.append(example['query'])
+        else:
+            hits += 1
+            reciprocal_ranks += 1.0 / rank
+
+    total = max(len(examples), 1)
+    return {
+        "relevance_threshold": relevance_threshold,
+        f"recall@{k}": hits / total,
+        "mrr": reciprocal_ranks / total,
+        "misses": misses
+    }
+
+def evaluate(service: EnterpriseRAGService,
+             examples: List[Dict[str, Any]],
+             k: int = 5,
+             thresholds: List[float] = (0.0,),
+             batch_size: int = 64,
+             default_role: str = "customer_service") -> Dict[str, Any]:
+    """
+    Run every labelled query once and score it at each relevance threshold
+
+    Queries are retrieved at the lowest threshold through
+    ``search_knowledge_batch``; higher thresholds are applied afterwards, so a
+    threshold sweep costs a single retrieval pass. Per-query latency is the
+    batch time divided by its size (use ``batch_size=1`` for true
+    single-query latency).
+    """
+    ranked_sources = []
+    latencies = []
+    floor = min(thresholds)
+
+    for start in range(0, len(examples), batch_size):
+        batch = examples[start:start + batch_size]
+        batch_start = time.perf_counter()
+        batch_results = service.search_knowledge_batch(
+            [example['query'] for example in batch],
+            [example.get('role', default_role) for example in batch],
+            max_results=k,
+            relevance_threshold=floor
+        )
+        per_query = (time.perf_counter() - batch_start) / len(batch)
+        latencies.extend([per_query] * len(batch))
+
+        for results in batch_results:
+            ranked_sources.append([(r.metadata.source_file, r.relevance_score) for r in results])
+
+    per_query_results = [
+        {
+            "query": example['query'],
+            "expected_source": example['expected_source'],
+            "retrieved": [source for source, _ in ranked],
+            "latency_ms": latency * 1000
+        }
+        for example, ranked, latency in zip(examples, ranked_sources, latencies)
+    ]
+
+    return {
+        "queries": len(examples),
+        "k": k,
+        "batch_size": batch_size,
+        "metrics": [score(examples, ranked_sources, k, threshold) for threshold in sorted(thresholds)],
+        "latency_ms": {
+            "mean": sum(latencies) / max(len(latencies), 1) * 1000,
+            "p50": _percentile(latencies, 50) * 1000 if latencies else 0.0,
+            "p95": _percentile(latencies, 95) * 1000 if latencies else 0.0,
+            "total_s": sum(latencies)
+        },
+        "per_query": per_query_results
+    }
+
+def main():
+    """Main function for offline retrieval evaluation"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="TechCorp RAG Retrieval Evaluation")
+    parser.add_argument("eval_set", nargs="?", default="knowledge_base/eval_queries.jsonl",
+                        help="JSONL file of query / expected_source pairs")
+    parser.add_argument("--config", default="knowledge_base/data_sources.yaml", help="RAG service config")
+    parser.add_argument("--k", type=int, default=5, help="Cut-off for recall@k")
+    parser.add_argument("--thresholds", default="0.0,0.3,0.5,0.7",
+                        help="Comma-separated relevance thresholds to sweep")
+    parser.add_argument("--batch-size", type=int, default=64, help="Queries per batch search")
+    parser.add_argument("--role", default="customer_service", help="Role for examples without one")
+    parser.add_argument("--output", default="metrics/rag_evaluation.json", help="Results file")
+    args = parser.parse_args()
+
+    print("=== TechCorp RAG Retrieval Evaluation ===")
+
+    examples = load_eval_set(args.eval_set)
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    print(f"📋 {len(examples)} labelled queries, k={args.k}, thresholds={thresholds}")
+
+    service = EnterpriseRAGService.get_shared(args.config)
+    service.preload()
+
+    report = evaluate(service, examples, args.k, thresholds, args.batch_size, args.role)
+    report["timestamp"] = datetime.now().isoformat()
+    report["eval_set"] = args.eval_set
+
+    for metrics in report["metrics"]:
+        print(f"   threshold {metrics['relevance_threshold']:.2f}: "
+              f"recall@{args.k} {metrics[f'recall@{args.k}']:.3f}, MRR {metrics['mrr']:.3f}")
+    latency = report["latency_ms"]
+    print(f"⏱️  Latency per query: mean {latency['mean']:.1f}ms, p50 {latency['p50']:.1f}ms, "
+          f"p95 {latency['p95']:.1f}ms ({latency['total_s']:.2f}s total)")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📊 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -53,8 +53,9 @@ class ProductionLogger:
 class HealthChecker:
     """Health check system for production monitoring"""
     
-    def __init__(self, check_interval: int = 30):
+    def __init__(self, check_interval: int = 30, llm_service=None):
         self.check_interval = check_interval
+        self.llm_service = llm_service
         self.logger = logging.getLogger("health_checker")
         self.health_status = {
             "status": "unknown",
@@ -103,6 +104,9 @@ class HealthChecker:
             check["status"] == "healthy" for check in checks.values()
         ) else "unhealthy"
         
+        # Model warm-up gates readiness only - a warming instance is alive
+        checks["llm_warmup"] = self._check_llm_warmup()
+        
         self.health_status = {
             "status": overall_status,
             "last_check": datetime.now().isoformat(),
@@ -197,9 +201,22 @@ class HealthChecker:
         except Exception as e:
             return {"status": "unhealthy", "message": f"Check failed: {e}"}
     
+    def _check_llm_warmup(self) -> Dict[str, Any]:
+        """Check whether the LLM backends have finished warming up"""
+        if self.llm_service is None:
+            return {"status": "healthy", "message": "No LLM service configured"}
+        if self.llm_service.is_ready():
+            return {"status": "healthy", "backends": self.llm_service.warmup_status}
+        return {"status": "warming", "backends": self.llm_service.warmup_status}
+    
     def get_health_status(self) -> Dict[str, Any]:
         """Get current health status"""
         return self.health_status
+    
+    def is_ready(self) -> bool:
+        """Ready for traffic: healthy and, if an LLM service is attached, warmed up"""
+        llm_ready = self.llm_service is None or self.llm_service.is_ready()
+        return self.health_status["status"] == "healthy" and llm_ready
 
 class MetricsCollector:
     """Collect and export application metrics"""
@@ -387,7 +404,9 @@ class ProductionOrchestrator:
         self.logger = logging.getLogger("production_orchestrator")
         
         # Initialize components
-        self.health_checker = HealthChecker(int(os.getenv("HEALTH_CHECK_INTERVAL", "30")))
+        self.llm_service = self._create_llm_service()
+        self.health_checker = HealthChecker(int(os.getenv("HEALTH_CHECK_INTERVAL", "30")),
+                                            self.llm_service)
         self.metrics_collector = MetricsCollector()
         self.process_manager = ProcessManager()
         
@@ -396,6 +415,17 @@ class ProductionOrchestrator:
             "environment": os.getenv("APP_ENV", "production")
         })
     
+    def _create_llm_service(self):
+        """Enterprise LLM service for warm-up and keep-warm, unless disabled"""
+        if os.getenv("LLM_WARMUP", "true").lower() != "true":
+            return None
+        try:
+            from enterprise_llm_service import EnterpriseLLMService
+            return EnterpriseLLMService()
+        except ImportError:
+            self.logger.info("Enterprise LLM service not available - skipping model warm-up")
+            return None
+    
     def validate_environment(self) -> bool:
         """Validate production environment configuration"""
         
@@ -436,6 +466,11 @@ class ProductionOrchestrator:
         
         self.logger.info("Starting production services")
         
+        # Start model warm-up first - it runs in the background and
+        # readiness stays false until it completes
+        if self.llm_service:
+            self.llm_service.start_warmup()
+        
         # Start health checker
         self.health_checker.start_health_checks()
         
@@ -558,7 +593,7 @@ class ProductionOrchestrator:
                     
                     # Write readiness status
                     readiness_status = {
-                        "ready": health_status["status"] == "healthy",
+                        "ready": self.health_checker.is_ready(),
                         "timestamp": datetime.now().isoformat()
                     }
                     